@@ -0,0 +1,90 @@
+import sys
+import copy
+import json
+import platform
+import tempfile
+
+from utils.predictor import *
+from utils.synthetic import synthetic_pifpaf, synthetic_image
+
+parser = cli('python3 benchmark')
+parser.add_argument('--crowd_sizes', default=[1, 5, 10, 25, 50, 100, 200], nargs='*', type=int, help='numbers of pedestrians per image')
+parser.add_argument('--resolutions', default=['640x480', '1280x720', '1920x1080'], nargs='*', type=str, help='image resolutions, WIDTHxHEIGHT')
+parser.add_argument('--repeats', default=20, type=int, help='number of measurements of each configuration')
+parser.add_argument('--baseline', default='benchmark_baseline.json', type=str, help='JSON baseline the results are compared with, a configuration is a regression if its median latency exceeds the baseline one by more than --tolerance')
+parser.add_argument('--save_baseline', action='store_true', help='write the results to the baseline file')
+parser.add_argument('--tolerance', default=0.2, type=float, help='relative slowdown of the median latency flagged as a regression: 0.2 flags the configurations more than 20%% slower than the baseline. The script then exits with status 1')
+args = parser.parse_args()
+
+# offline and cpu only: no pifpaf, the synthetic pifpaf outputs are given to the looking model
+args.keypoints = []
+args.device = 'cpu'
+args.image_output = tempfile.mkdtemp()
+predictor = Predictor(args)
+rng = np.random.RandomState(0)
+
+
+def measure(fn, inputs, repeats):
+    """
+        Median and 95th percentile of the latency of fn, in ms. inputs() gives fresh inputs to each call.
+    """
+    times = []
+    for _ in range(repeats):
+        data = inputs()
+        start = time.perf_counter()
+        fn(*data)
+        times.append((time.perf_counter() - start) * 1000)
+    return float(np.median(times)), float(np.percentile(times, 95))
+
+
+def normalize_each(keypoints, image_size):
+    return [normalize_by_image_(kps[0], kps[1], image_size) for kps in keypoints]
+
+
+results = {}
+for resolution in args.resolutions:
+    image_size = tuple(int(v) for v in resolution.split('x'))
+    image = synthetic_image(image_size, rng)
+    for n_persons in args.crowd_sizes:
+        annotations = synthetic_pifpaf(n_persons, image_size, rng)
+        boxes, keypoints = preprocess_pifpaf(copy.deepcopy(annotations), image_size, enlarge_boxes=False)
+        labels = predictor.predict_look(boxes, keypoints, image_size)
+        benchmarks = [
+            # preprocess_pifpaf modifies the boxes, each call gets a copy
+            ('preprocess_pifpaf', lambda a, s: preprocess_pifpaf(a, s, enlarge_boxes=False), lambda: (copy.deepcopy(annotations), image_size)),
+            ('normalize_by_image_', normalize_each, lambda: (keypoints, image_size)),
+            ('predict_look_batch_wise', lambda b, k, s: predictor.predict_look(b, k, s, batch_wise=True), lambda: (boxes, keypoints, image_size)),
+            ('predict_look_single', lambda b, k, s: predictor.predict_look(b, k, s, batch_wise=False), lambda: (boxes, keypoints, image_size)),
+            ('render_image', lambda i: predictor.render_image(i, boxes, keypoints, labels, 'benchmark.png', args.transparency, args.looking_threshold), lambda: (image,))
+        ]
+        for name, fn, inputs in benchmarks:
+            median, p95 = measure(fn, inputs, args.repeats)
+            key = '{}/{}/{}'.format(name, resolution, n_persons)
+            results[key] = {'latency_ms': median, 'latency_p95_ms': p95, 'persons_per_s': n_persons * 1000 / median if median > 0 else 0.}
+            print('{:<42} {:10.3f} ms | p95 {:10.3f} ms | {:12.1f} persons/s'.format(key, median, p95, results[key]['persons_per_s']))
+predictor.writer.close()
+
+regressions = []
+if os.path.isfile(args.baseline):
+    with open(args.baseline, 'r') as file:
+        baseline = json.load(file)['results']
+    for key, result in results.items():
+        if key in baseline and result['latency_ms'] > baseline[key]['latency_ms'] * (1 + args.tolerance):
+            regressions.append(key)
+            print('REGRESSION {} : {:.3f} ms, baseline {:.3f} ms (x{:.2f})'.format(key, result['latency_ms'], baseline[key]['latency_ms'], result['latency_ms'] / baseline[key]['latency_ms']))
+    print('{} regressions against {}'.format(len(regressions), args.baseline))
+
+if args.save_baseline:
+    environment = {
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'torch_threads': torch.get_num_threads(),
+        'cpu_count': os.cpu_count(),
+        'machine': platform.machine()
+    }
+    with open(args.baseline, 'w') as file:
+        json.dump({'environment': environment, 'repeats': args.repeats, 'results': results}, file, indent=2)
+    print('Baseline saved in {}'.format(args.baseline))
+
+if len(regressions) != 0:
+    sys.exit(1)
@@ -0,0 +1,33 @@
+import configparser
+import argparse
+
+from utils.trainer import *
+from utils.crop_store import *
+
+parser_command = argparse.ArgumentParser(description='Pre-decode the crops of the heads / eyes models into memory-mapped shards')
+parser_command.add_argument('--file', dest='f', type=str, help='Config file name to use', default="config.ini")
+parser_command.add_argument('--shard_size', default=4096, type=int, help='number of crops per shard')
+parser_command.add_argument('--force', action='store_true', help='compile the stores that already exist again')
+
+args = parser_command.parse_args()
+parser_file = args.f
+
+config = configparser.ConfigParser()
+config.read(parser_file)
+root = config['General'].get('crop_store')
+assert root, "please set crop_store in the [General] section of {}".format(parser_file)
+# the stores are attached below, once compiled
+config['General']['crop_store'] = ''
+
+parser = Parser(config)
+parser.parse()
+assert parser.model_type_ != 'joints', "the joints models do not use crops"
+
+datasets = parser.get_datasets() + [parser.get_data_test(parser.eval_params['eval_on'])]
+for data in datasets:
+    decode, _, size = split_transform(data.transform)
+    output = os.path.join(root, store_name(data, size))
+    if os.path.isfile(os.path.join(output, INDEX)) and not args.force:
+        print('{} already compiled'.format(output))
+        continue
+    compile_crop_store(data.path_data, list(data.X), decode, output, args.shard_size)
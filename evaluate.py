@@ -1,3 +1,6 @@
+from utils.startup import profile_startup, print_startup_profile
+profile_startup()
+
 import configparser
 import argparse
 from utils.trainer import *
@@ -6,6 +9,7 @@ parser_command = argparse.ArgumentParser(description='Training the model')
 parser_command.add_argument('--file', dest='f', type=str, help='Config file name to use', default="config.ini")
 
 args = parser_command.parse_args()
+print_startup_profile()
 parser_file = args.f
 
 config = configparser.ConfigParser()
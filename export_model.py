@@ -0,0 +1,47 @@
+import argparse
+import time
+
+from utils.network import *
+from utils.numpy_runtime import NumpyLookingModel
+
+parser = argparse.ArgumentParser(prog='python3 export_model', description='Export an inference-only Looking Model, BatchNorm folded into the linear layers')
+parser.add_argument('--model', default='./models/predictor/LookingModel_LOOK+PIE.p', type=str, help='trained LookingModel weights')
+parser.add_argument('--input_size', default=51, type=int, help='input size of the model, 51 for the full pose')
+parser.add_argument('--output', default=None, type=str, help='output TorchScript file, defaults to the weights file with a _fused.pt suffix')
+parser.add_argument('--npz', default=None, type=str, help='also write the fused weights to this .npz file, for the torch-free runtime')
+parser.add_argument('--tolerance', default=1e-5, type=float, help='maximum absolute difference allowed between the original and the fused model')
+parser.add_argument('--benchmark', default=1000, type=int, help='number of forward passes of a batch of 64 pedestrians to time both models on the cpu')
+args = parser.parse_args()
+
+output = args.output if args.output is not None else args.model[:-2] + '_fused.pt'
+
+model = LookingModel(args.input_size)
+model.load_state_dict(torch.load(args.model, map_location=torch.device('cpu')))
+model.eval()
+
+fused_model = fuse_looking_model(model)
+print('Max absolute difference with the fused model : {:.2e}'.format(check_fused_model(model, fused_model, tolerance=args.tolerance)))
+scripted_model = torch.jit.script(fused_model)
+print('Max absolute difference with the TorchScript model : {:.2e}'.format(check_fused_model(model, scripted_model, tolerance=args.tolerance)))
+scripted_model.save(output)
+print('Fused model saved in {}'.format(output))
+
+if args.npz is not None:
+    export_looking_model_npz(fused_model, args.npz)
+    numpy_model = NumpyLookingModel(args.npz)
+    x = torch.randn(4096, args.input_size)
+    with torch.no_grad():
+        max_diff = np.abs(model(x).numpy().reshape(-1) - numpy_model(x.numpy())).max()
+    assert max_diff <= args.tolerance, "the NumPy model differs from the original one by {}".format(max_diff)
+    print('Max absolute difference with the NumPy model : {:.2e}'.format(max_diff))
+    print('NumPy weights saved in {}'.format(args.npz))
+
+if args.benchmark > 0:
+    x = torch.randn(64, args.input_size)
+    with torch.no_grad():
+        for name, net in [('original', model), ('fused', fused_model), ('TorchScript', scripted_model)]:
+            net(x)
+            start = time.time()
+            for _ in range(args.benchmark):
+                net(x)
+            print('{} model : {:.3f} ms per forward pass'.format(name, (time.time() - start) * 1000 / args.benchmark))
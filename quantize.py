@@ -0,0 +1,60 @@
+import configparser
+import argparse
+import time
+
+from utils.trainer import *
+from utils.quantization import *
+
+parser_command = argparse.ArgumentParser(description='Quantize a trained model and compare it with the float model')
+parser_command.add_argument('--file', dest='f', type=str, help='Config file name to use', default="config.ini")
+parser_command.add_argument('--mode', default=None, choices=QUANTIZATION_MODES, help='int8 quantization mode, by default dynamic for the joints model and static for the heads models. The heads models only support static')
+parser_command.add_argument('--calibration_samples', default=512, type=int, help='number of validation samples used for the static quantization')
+parser_command.add_argument('--backend', default='fbgemm', choices=['fbgemm', 'qnnpack'], help='quantized engine, fbgemm on x86 and qnnpack on ARM')
+parser_command.add_argument('--output', default=None, type=str, help='save the quantized model (TorchScript) to this file')
+
+args = parser_command.parse_args()
+parser_file = args.f
+
+config = configparser.ConfigParser()
+config.read(parser_file)
+# the quantized models only run on the cpu
+config['General']['device'] = 'cpu'
+
+parser = Parser(config)
+parser.parse()
+assert parser.model_type_ in ['joints', 'heads'], "only the joints and heads models can be quantized"
+if args.mode is None:
+    args.mode = 'dynamic' if parser.model_type_ == 'joints' else 'static'
+assert parser.model_type_ == 'joints' or args.mode == 'static', "dynamic quantization leaves the convolutions of the heads models in float, please use --mode static"
+
+evaluator = Evaluator(parser)
+float_model = parser.model
+if args.mode == 'dynamic':
+    quantized_model = quantize_dynamic(float_model)
+else:
+    dataset_val = parser.dataset_val
+    if parser.multi_dataset:
+        dataset_val = torch.utils.data.ConcatDataset(dataset_val)
+    loader = DataLoader(dataset_val, batch_size=32, shuffle=True)
+    quantized_model = quantize_static(float_model, loader_calibration_batches(loader, args.calibration_samples), args.backend)
+
+data_to_evaluate = parser.eval_params['eval_on']
+data_test = parser.get_data_test(data_to_evaluate)
+results = {}
+for name, model in [('float', float_model), ('int8', quantized_model)]:
+    ap, acc = data_test.evaluate(model, parser.device, 10)
+    x, _ = next(iter(DataLoader(data_test, batch_size=32)))
+    with torch.no_grad():
+        model(x)
+        start = time.time()
+        for _ in range(20):
+            model(x)
+    throughput = 20 * len(x) / (time.time() - start)
+    results[name] = (ap, acc, throughput)
+    print('{} model on {} | acc:{:.1f} | ap:{:.1f} | {:.1f} samples/s'.format(name, data_to_evaluate, acc, ap*100, throughput))
+
+print('Delta int8 - float | acc:{:+.1f} | ap:{:+.1f} | speed-up x{:.2f}'.format(results['int8'][1] - results['float'][1], (results['int8'][0] - results['float'][0])*100, results['int8'][2] / results['float'][2]))
+
+if args.output is not None:
+    torch.jit.save(torch.jit.script(quantized_model), args.output)
+    print('Quantized model saved in {}'.format(args.output))
@@ -0,0 +1,21 @@
+from utils.startup import profile_startup, print_startup_profile
+profile_startup()
+
+from utils.predictor import *
+from utils.server import LookingServer
+
+parser = cli('python3 serve')
+parser.add_argument('--host', default='127.0.0.1', type=str, help='address to listen on')
+parser.add_argument('--port', default=8080, type=int, help='port to listen on')
+parser.add_argument('--unix_socket', default=None, type=str, help='listen on this Unix socket instead of host:port')
+parser.add_argument('--max_batch', default=256, type=int, help='maximum number of pedestrians scored in one forward pass')
+parser.add_argument('--max_wait', default=5., type=float, help='maximum time in ms a request waits for its batch to fill up')
+parser.add_argument('--decode_workers', default=2, type=int, help='number of threads decoding the images')
+args = parser.parse_args()
+print_startup_profile()
+args.no_render = True
+
+# only the models are needed, no output directory nor image writers
+predictor = Predictor(args, outputs=False)
+server = LookingServer(predictor, args.max_batch, args.max_wait / 1000., args.decode_workers)
+server.run(args.host, args.port, args.unix_socket)
@@ -0,0 +1,48 @@
+import os
+
+from utils.cache import PifpafCache
+
+
+def write(path, content):
+    with open(path, 'wb') as file:
+        file.write(content)
+
+
+def test_key_read_from_index(tmp_path):
+    image = str(tmp_path / 'image.png')
+    write(image, b'abc')
+    cache = PifpafCache(str(tmp_path / 'cache'), {'checkpoint': 'a'})
+    key = cache.key(image)
+    cache.save_index()
+    assert cache.n_hashed == 1
+
+    cache = PifpafCache(str(tmp_path / 'cache'), {'checkpoint': 'a'})
+    assert cache.key(image) == key
+    assert cache.n_hashed == 0 and cache.n_indexed == 1
+
+
+def test_key_follows_content_and_settings(tmp_path):
+    image = str(tmp_path / 'image.png')
+    copy = str(tmp_path / 'copy.png')
+    write(image, b'abc')
+    write(copy, b'abc')
+    cache = PifpafCache(str(tmp_path / 'cache'), {'checkpoint': 'a'})
+    key = cache.key(image)
+    assert cache.key(copy) == key
+    assert PifpafCache(str(tmp_path / 'other'), {'checkpoint': 'b'}).key(image) != key
+
+    write(image, b'abcd')
+    assert cache.key(image) != key
+    assert cache.n_hashed == 3
+
+
+def test_put_get(tmp_path):
+    image = str(tmp_path / 'image.png')
+    write(image, b'abc')
+    cache = PifpafCache(str(tmp_path / 'cache'), {})
+    key = cache.key(image)
+    assert key not in cache and cache.get(key) is None
+    cache.put(key, {'width': 2, 'height': 1, 'predictions': []})
+    cache.save_index()
+    cache = PifpafCache(str(tmp_path / 'cache'), {})
+    assert cache.get(cache.key(image)) == {'width': 2, 'height': 1, 'predictions': []}
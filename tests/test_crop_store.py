@@ -0,0 +1,67 @@
+import os
+import pickle
+
+import numpy as np
+import PIL.Image
+import torch
+from torchvision import transforms
+
+from utils.crop_store import split_transform, compile_crop_store, CropStore, StoredCropTransform, open_crop, INDEX
+
+MEAN, STD = [0.485, 0.456, 0.406], [0.229, 0.224, 0.225]
+
+
+def write_crops(path_data, n=5):
+    rng = np.random.RandomState(0)
+    names = []
+    for i in range(n):
+        name = os.path.join('person_{}'.format(i), 'head.png')
+        os.makedirs(os.path.join(path_data, 'person_{}'.format(i)))
+        image = rng.randint(0, 256, (20 + i, 15 + 2 * i, 3)).astype(np.uint8)
+        PIL.Image.fromarray(image).save(os.path.join(path_data, name))
+        names.append(name)
+    return names
+
+
+def test_split_transform():
+    transform = transforms.Compose([transforms.Resize((16, 12)), transforms.ToTensor(), transforms.Normalize(MEAN, STD)])
+    decode, normalize, size = split_transform(transform)
+    assert size == (16, 12)
+    assert len(decode.transforms) == 1 and len(normalize.transforms) == 1
+
+
+def test_round_trip(tmp_path):
+    path_data, output = str(tmp_path / 'data'), str(tmp_path / 'store')
+    names = write_crops(path_data)
+    transform = transforms.Compose([transforms.Resize((16, 12)), transforms.ToTensor(), transforms.Normalize(MEAN, STD)])
+    decode, _, _ = split_transform(transform)
+    # two crops per shard, the last shard is partial
+    compile_crop_store(path_data, names + names[:1], decode, output, shard_size=2)
+    assert os.path.isfile(os.path.join(output, INDEX))
+
+    store = CropStore(output)
+    assert len(store) == len(names)
+    stored_transform = StoredCropTransform(transform)
+    for name in names:
+        crop = open_crop(path_data, name, store)
+        expected = np.asarray(decode(PIL.Image.open(os.path.join(path_data, name)).convert('RGB')))
+        assert crop.dtype == np.uint8 and crop.shape == (16, 12, 3)
+        np.testing.assert_array_equal(crop, expected)
+        # same tensor as the full transform of the image file
+        full = transform(open_crop(path_data, name).convert('RGB'))
+        assert torch.allclose(stored_transform(crop), full, atol=1e-6)
+    assert 'missing.png' not in store
+
+    # the unpickled store (as sent to the DataLoader workers) maps the shards again
+    store = pickle.loads(pickle.dumps(store))
+    assert store.shards is None
+    np.testing.assert_array_equal(store[names[3]], np.asarray(decode(PIL.Image.open(os.path.join(path_data, names[3])).convert('RGB'))))
+
+
+def test_crops_missing_from_the_store(tmp_path):
+    path_data = str(tmp_path / 'data')
+    names = write_crops(path_data, n=1)
+    transform = transforms.Compose([transforms.Resize((16, 12)), transforms.ToTensor(), transforms.Normalize(MEAN, STD)])
+    crop = open_crop(path_data, names[0], None)
+    assert isinstance(crop, PIL.Image.Image)
+    assert torch.equal(StoredCropTransform(transform)(crop.convert('RGB')), transform(crop.convert('RGB')))
@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+import PIL.Image
+import torch
+from torchvision import transforms
+
+from utils.crops import HeadCropper, PilHeadCropper, head_regions, IMAGENET_MEAN, IMAGENET_STD
+from utils.network import SquarePad, AlexNet_head
+
+IMAGE = os.path.join(os.path.dirname(__file__), '..', 'images', 'people-walking-on-pedestrian-lane-during-daytime-3.jpg')
+# boxes of the pedestrians of IMAGE, as given by pifpaf (x1, y1, x2, y2, score)
+BOXES = [
+    [150.4, 195.2, 335.7, 630.1, 0.9],
+    [490.2, 268.8, 605.5, 680.3, 0.9],
+    [645.9, 245.1, 800.2, 625.6, 0.9],
+    [765.3, 268.4, 885.8, 625.2, 0.9],
+    [1015.7, 288.3, 1165.1, 670.9, 0.9],
+    [1195.2, 255.5, 1279.9, 625.4, 0.9]
+]
+
+
+def head_transform():
+    return transforms.Compose([SquarePad(), transforms.Resize((227, 227)), transforms.ToTensor(), transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD)])
+
+
+def crops():
+    image = PIL.Image.open(IMAGE).convert('RGB')
+    device = torch.device('cpu')
+    return PilHeadCropper(device, head_transform())(image, BOXES), HeadCropper(device)(image, BOXES)
+
+
+def test_head_regions_clipped():
+    regions = head_regions([[-5.5, 10.2, 20.7, 40.9, 1.], [630., 470., 700., 520., 1.]], (640, 480))
+    np.testing.assert_array_equal(regions, [[0, 10, 20, 20], [630, 470, 640, 480]])
+
+
+def test_roi_align_pixels_close_to_pil():
+    pil_crops, roi_crops = crops()
+    assert pil_crops.shape == roi_crops.shape == (len(BOXES), 3, 227, 227)
+    # difference in 8-bit levels of the unnormalized pixels
+    std = torch.tensor(IMAGENET_STD).view(1, 3, 1, 1)
+    diff = ((pil_crops - roi_crops).abs() * std * 255).flatten()
+    assert diff.mean().item() < 1.
+    assert diff.quantile(0.99).item() < 8.
+
+
+def test_roi_align_scores_close_to_pil():
+    torch.manual_seed(0)
+    model = AlexNet_head(torch.device('cpu'), fine_tune=False).eval()
+    pil_crops, roi_crops = crops()
+    with torch.no_grad():
+        pil_features = model.net.features(pil_crops).flatten(1)
+        roi_features = model.net.features(roi_crops).flatten(1)
+        pil_scores, roi_scores = model(pil_crops), model(roi_crops)
+    relative = (pil_features - roi_features).norm(dim=1) / pil_features.norm(dim=1)
+    assert relative.max().item() < 0.05
+    assert (pil_scores - roi_scores).abs().max().item() < 0.01
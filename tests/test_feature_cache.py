@@ -0,0 +1,89 @@
+import numpy as np
+import torch
+from torch import nn
+from torch.utils.data import Dataset
+
+from utils.network import LookingModel, LookingNet_early_fusion_eyes
+from utils.feature_cache import frozen_modules, train_mode, frozen_features, head_forward, compute_feature_cache, FeatureCache
+
+
+class FakeEyesDataset(Dataset):
+    def __init__(self, n=32):
+        rng = np.random.RandomState(0)
+        self.eyes = torch.from_numpy(rng.rand(n, 1, 30, 30).astype(np.float32))
+        self.keypoints = torch.from_numpy(rng.randn(n, 51).astype(np.float32))
+        self.labels = torch.from_numpy(rng.randint(0, 2, (n, 1)).astype(np.float32))
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        return (self.eyes[idx], self.keypoints[idx]), self.labels[idx]
+
+
+def make_model(tmp_path):
+    torch.manual_seed(0)
+    looking_model = LookingModel(51)
+    # non trivial running statistics in the frozen BatchNorm layers
+    looking_model.train()
+    with torch.no_grad():
+        looking_model(3 * torch.randn(64, 51) + 1)
+    path_look = str(tmp_path / 'looking_model.p')
+    torch.save(looking_model.state_dict(), path_look)
+    return LookingNet_early_fusion_eyes(path_look, 'cpu', fine_tune=True)
+
+
+def frozen_state(model):
+    return [{name: tensor.clone() for name, tensor in module.state_dict().items()} for module in frozen_modules(model)]
+
+
+def test_train_mode(tmp_path):
+    model = make_model(tmp_path)
+    train_mode(model, True)
+    assert model.training and model.encoder_eyes.training and model.looking_module.training
+    assert not any(module.training for module in model.looking_model.modules())
+    # without feature cache the whole model is in training mode
+    train_mode(model, False)
+    assert all(module.training for module in model.modules())
+
+
+def test_head_forward(tmp_path):
+    model = make_model(tmp_path).eval()
+    dataset = FakeEyesDataset()
+    x = (dataset.eyes, dataset.keypoints)
+    with torch.no_grad():
+        assert torch.allclose(head_forward(model, frozen_features(model, x)), model(x), atol=1e-6)
+
+
+def test_training_step_with_cache(tmp_path):
+    model = make_model(tmp_path)
+    dataset = FakeEyesDataset()
+    compute_feature_cache(model, dataset, str(tmp_path / 'cache'), 'cpu', batch_size=10)
+    cache = FeatureCache(str(tmp_path / 'cache'))
+    rows = np.arange(0, len(dataset), 2)
+    features, y_cached = cache.batch(rows, 'cpu')
+    x = (dataset.eyes[rows], dataset.keypoints[rows])
+    criterion = nn.BCELoss()
+    before = frozen_state(model)
+
+    losses, grads = [], []
+    for cached in [False, True]:
+        train_mode(model, True)
+        model.zero_grad()
+        # same dropout masks in the trainable layers
+        torch.manual_seed(1)
+        if cached:
+            loss = criterion(head_forward(model, features), y_cached)
+        else:
+            loss = criterion(model(x), dataset.labels[rows])
+        loss.backward()
+        losses.append(loss.item())
+        grads.append([p.grad.clone() for p in model.parameters() if p.requires_grad])
+
+    assert abs(losses[0] - losses[1]) < 1e-5
+    for grad, grad_cached in zip(*grads):
+        assert torch.allclose(grad, grad_cached, atol=1e-5)
+    # the running statistics of the frozen layers did not drift
+    for state, state_after in zip(before, frozen_state(model)):
+        for name in state:
+            assert torch.equal(state[name], state_after[name])
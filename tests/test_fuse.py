@@ -0,0 +1,56 @@
+import torch
+import torch.nn as nn
+
+from utils.network import LookingModel, fold_batch_norm, fuse_looking_model, check_fused_model, export_looking_model_npz
+from utils.numpy_runtime import NumpyLookingModel
+
+
+def trained_statistics(model, n_batches=20):
+    """
+        Give the BatchNorm layers non trivial running statistics and affine parameters.
+    """
+    model.train()
+    with torch.no_grad():
+        for module in model.modules():
+            if isinstance(module, nn.BatchNorm1d):
+                module.weight.uniform_(0.5, 1.5)
+                module.bias.uniform_(-0.5, 0.5)
+        for _ in range(n_batches):
+            model(torch.randn(64, model.input_size) * 3 + 1)
+    return model.eval()
+
+
+def test_fold_batch_norm():
+    torch.manual_seed(0)
+    linear = nn.Linear(8, 16)
+    batch_norm = nn.BatchNorm1d(16)
+    batch_norm.train()
+    with torch.no_grad():
+        for _ in range(10):
+            batch_norm(linear(torch.randn(32, 8) * 2 + 1))
+        batch_norm.weight.uniform_(0.5, 1.5)
+        batch_norm.bias.uniform_(-0.5, 0.5)
+    batch_norm.eval()
+    fused = fold_batch_norm(linear, batch_norm)
+    x = torch.randn(100, 8)
+    with torch.no_grad():
+        assert torch.allclose(fused(x), batch_norm(linear(x)), atol=1e-5)
+
+
+def test_fused_looking_model():
+    torch.manual_seed(0)
+    model = trained_statistics(LookingModel(51))
+    fused = fuse_looking_model(model)
+    assert not fused.training
+    assert check_fused_model(model, fused) <= 1e-5
+
+
+def test_numpy_runtime(tmp_path):
+    torch.manual_seed(0)
+    model = trained_statistics(LookingModel(51))
+    path = str(tmp_path / 'looking.npz')
+    export_looking_model_npz(fuse_looking_model(model), path)
+    x = torch.randn(50, 51)
+    with torch.no_grad():
+        expected = model(x).squeeze(1).numpy()
+    assert abs(NumpyLookingModel(path).forward(x.numpy()).reshape(-1) - expected).max() <= 1e-5
@@ -0,0 +1,55 @@
+import numpy as np
+import torch
+
+from utils.keypoints import normalize_by_image_, normalize_by_image_batch, prepare_pif_kps
+from utils.network import LookingModel
+from utils.predictor import Predictor
+
+
+def random_keypoints(n_persons, image_size, seed=0):
+    rng = np.random.RandomState(seed)
+    width, height = image_size
+    keypoints = np.empty((n_persons, 3, 17))
+    keypoints[:, 0] = rng.uniform(0, width, (n_persons, 17))
+    keypoints[:, 1] = rng.uniform(0, height, (n_persons, 17))
+    keypoints[:, 2] = rng.uniform(0, 1, (n_persons, 17))
+    return keypoints
+
+
+def test_batch_matches_per_person():
+    image_size = (1920, 1080)
+    keypoints = random_keypoints(32, image_size)
+    batch = normalize_by_image_batch(keypoints, image_size)
+    assert batch.shape == (32, 51) and batch.dtype == np.float32
+    for kps, row in zip(keypoints, batch):
+        X, Y = normalize_by_image_(kps[0], kps[1], image_size)
+        expected = np.concatenate([X, Y, kps[2]])
+        np.testing.assert_allclose(row, expected, rtol=1e-5, atol=1e-5)
+
+
+def test_batch_empty_and_flat_inputs():
+    image_size = (640, 480)
+    assert normalize_by_image_batch(np.zeros((0, 3, 17)), image_size).shape == (0, 51)
+    keypoints = random_keypoints(3, image_size, seed=1)
+    flat = [np.array(kps).T.reshape(-1).tolist() for kps in keypoints]
+    reshaped = np.array([prepare_pif_kps(kps) for kps in flat])
+    np.testing.assert_array_equal(normalize_by_image_batch(reshaped, image_size), normalize_by_image_batch(keypoints, image_size))
+
+
+def test_predict_look_per_person():
+    # only the attributes used by predict_look, the models are not loaded
+    predictor = Predictor.__new__(Predictor)
+    predictor.device = torch.device('cpu')
+    torch.manual_seed(0)
+    predictor.model = LookingModel(51).eval()
+    predictor.track_time = False
+    predictor.inference_time = []
+    predictor.metrics = None
+    image_size = (1280, 720)
+    keypoints = random_keypoints(5, image_size, seed=2)
+    boxes = [[0, 0, 10, 10, 1]] * len(keypoints)
+    batch = predictor.predict_look(boxes, keypoints, image_size)
+    single = predictor.predict_look(boxes, keypoints, image_size, batch_wise=False)
+    assert len(single) == len(keypoints)
+    np.testing.assert_allclose(single, batch, rtol=1e-5, atol=1e-6)
+    assert len(predictor.predict_look([], [], image_size, batch_wise=False)) == 0
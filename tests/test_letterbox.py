@@ -0,0 +1,36 @@
+import numpy as np
+import torch
+
+from utils.utils_predict import collate_letterbox, supported_pifpaf_version
+
+
+def test_collate_letterbox():
+    torch.manual_seed(0)
+    sizes = [(40, 60), (64, 30), (50, 50)]
+    batch = []
+    for i, (height, width) in enumerate(sizes):
+        image = np.full((height, width, 3), i, dtype=np.uint8)
+        # normalized images are not zero, except in the padding
+        processed_image = torch.rand(3, height, width) + 0.5
+        batch.append((image, processed_image, ['ann_{}'.format(i)], {'file_name': 'image_{}.png'.format(i), 'index': i}))
+
+    images, padded, anns, metas = collate_letterbox(batch)
+    assert padded.shape == (3, 3, 64, 60) and padded.dtype == torch.float32
+    for i, ((height, width), item) in enumerate(zip(sizes, batch)):
+        # the image is in the top left corner, its coordinates are unchanged
+        assert torch.equal(padded[i, :, :height, :width], item[1])
+        assert (padded[i, :, height:, :] == 0).all() and (padded[i, :, :, width:] == 0).all()
+        assert images[i] is item[0]
+        assert anns[i] == item[2] and metas[i] is item[3]
+
+
+def test_collate_letterbox_same_sizes():
+    batch = [(None, torch.ones(3, 8, 6) * i, [], {'index': i}) for i in range(2)]
+    _, padded, _, metas = collate_letterbox(batch)
+    assert torch.equal(padded, torch.stack([item[1] for item in batch]))
+    assert [meta['index'] for meta in metas] == [0, 1]
+
+
+def test_supported_pifpaf_version():
+    assert supported_pifpaf_version('0.13.0') and supported_pifpaf_version('0.13.11')
+    assert not any(supported_pifpaf_version(version) for version in ['0.12.14', '0.14.0', '1.13.0'])
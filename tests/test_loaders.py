@@ -0,0 +1,99 @@
+import math
+
+import pytest
+import torch
+
+from utils.loaders import JointsLoader, joints_tensors, sample_weights
+
+
+class JointsDataset():
+    """
+        Minimal joints dataset: the keypoints of instance i are all equal to offset + i.
+    """
+    type = 'joints'
+
+    def __init__(self, n, offset=0, as_tensor=True):
+        self.joints = torch.arange(offset, offset + n, dtype=torch.float).view(-1, 1).repeat(1, 51)
+        self.labels = (torch.arange(n) % 2).float()
+        self.as_tensor = as_tensor
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, idx):
+        return self.joints[idx], self.labels[idx]
+
+    def get_joints(self):
+        if self.as_tensor:
+            return self.joints, self.labels
+        return [None] * len(self), self.labels
+
+
+def test_joints_tensors_read_per_instance():
+    joints, labels = joints_tensors(JointsDataset(7, as_tensor=False))
+    assert joints.shape == (7, 51) and labels.shape == (7, 1)
+    assert torch.equal(joints[:, 0], torch.arange(7, dtype=torch.float))
+
+
+def test_epoch_covers_every_instance_once():
+    loader = JointsLoader([JointsDataset(10), JointsDataset(15, offset=10, as_tensor=False)], 4, torch.device('cpu'))
+    assert len(loader) == 7
+    batches = list(loader)
+    assert [len(x) for x, _ in batches] == [4] * 6 + [1]
+    x = torch.cat([x for x, _ in batches])
+    y = torch.cat([y for _, y in batches])
+    assert sorted(x[:, 0].tolist()) == list(range(25))
+    # the labels stay aligned with their keypoints
+    expected = torch.cat([torch.arange(10) % 2, torch.arange(15) % 2]).float()
+    assert torch.equal(y.view(-1), expected[x[:, 0].long()])
+
+
+def test_weighted_epoch():
+    torch.manual_seed(0)
+    weights = torch.zeros(20)
+    weights[:5] = 1.
+    loader = JointsLoader(JointsDataset(20), 8, torch.device('cpu'), weights)
+    x = torch.cat([x for x, _ in loader])
+    # drawn with replacement, only among the instances with a weight
+    assert len(x) == 20
+    assert x[:, 0].max().item() < 5
+
+
+def dataset_shares(weights, lengths):
+    shares = []
+    start = 0
+    for length in lengths:
+        shares.append(weights[start:start+length].sum().item())
+        start += length
+    return shares
+
+
+def test_sample_weights_temperatures():
+    lengths = [100, 300, 600]
+    # infinite temperature: the same share to each dataset
+    weights = sample_weights(lengths)
+    assert len(weights) == 1000
+    assert dataset_shares(weights, lengths) == pytest.approx([1/3] * 3)
+    # temperature 1: uniform over the instances
+    weights = sample_weights(lengths, temperature=1.)
+    assert torch.allclose(weights, torch.full((1000,), 1e-3))
+    # temperature 2: proportional to the square root of the lengths
+    shares = [math.sqrt(length) for length in lengths]
+    assert dataset_shares(sample_weights(lengths, temperature=2.), lengths) == pytest.approx([share / sum(shares) for share in shares])
+
+
+def test_sample_weights_ratios():
+    lengths = [10, 40]
+    weights = sample_weights(lengths, ratios=[3., 1.])
+    assert dataset_shares(weights, lengths) == pytest.approx([0.75, 0.25])
+    # the instances of a dataset have the same weight
+    assert torch.unique(weights[:10]).numel() == 1 and torch.unique(weights[10:]).numel() == 1
+    shares = [3. * 10, 1. * 40]
+    assert dataset_shares(sample_weights(lengths, ratios=[3., 1.], temperature=1.), lengths) == pytest.approx([share / sum(shares) for share in shares])
+
+
+def test_sample_weights_invalid():
+    with pytest.raises(AssertionError):
+        sample_weights([10, 0])
+    with pytest.raises(AssertionError):
+        sample_weights([10, 20], ratios=[1.])
@@ -0,0 +1,32 @@
+import os
+import threading
+import time
+
+from utils.metrics import Histogram, StageMetrics
+
+
+def test_histogram_quantiles():
+    histogram = Histogram()
+    for value in range(1, 1001):
+        histogram.add(float(value))
+    summary = histogram.summary()
+    assert summary['count'] == 1000 and summary['min'] == 1. and summary['max'] == 1000.
+    # the quantiles are bucketed, within the relative width of a bucket
+    for q, expected in [(0.5, 500.), (0.95, 950.), (0.99, 990.)]:
+        assert abs(histogram.quantile(q) - expected) / expected < 0.1
+
+
+def test_prometheus_written_off_the_frame_path(tmp_path):
+    path = str(tmp_path / 'metrics.prom')
+    n_threads = threading.active_count()
+    metrics = StageMetrics(prometheus_path=path, prometheus_interval=0.05)
+    metrics.add_frame('a.png', {'pifpaf_nn': 10., 'looking_model': 1.})
+    assert not os.path.isfile(path)
+    time.sleep(0.3)
+    with open(path) as file:
+        assert 'looking_frames_total 1' in file.read()
+    metrics.add_frame('b.png', {'pifpaf_nn': 12., 'looking_model': 1.})
+    metrics.close()
+    with open(path) as file:
+        assert 'looking_frames_total 2' in file.read()
+    assert threading.active_count() == n_threads
@@ -0,0 +1,70 @@
+import copy
+import json
+import os
+
+import numpy as np
+
+from utils.pifpaf_io import read_pifpaf_outputs, KEYPOINTS_SUFFIX
+from utils.predictor import Predictor
+from utils.writer import ResultsWriter
+
+IMAGE_SIZE = (640, 480)
+
+
+def annotation(rng, x, y):
+    keypoints = np.stack([rng.uniform(x, x + 80, 17), rng.uniform(y, y + 200, 17), rng.uniform(0.2, 1, 17)], 1)
+    return {'keypoints': keypoints.reshape(-1).tolist(), 'bbox': [x, y, 80., 200.], 'score': float(rng.uniform(0.3, 1))}
+
+
+def pifpaf_outputs(n_images=4, seed=0):
+    rng = np.random.RandomState(seed)
+    # the last pedestrian is on the border of the image, its box is clipped
+    return [[annotation(rng, 100. + 50 * i, 100.), annotation(rng, 5., 270.)] for i in range(n_images)]
+
+
+def test_read_files_in_order(tmp_path):
+    outputs = pifpaf_outputs()
+    names = ['image_{}.png'.format(i) for i in range(len(outputs))]
+    for name, pred in zip(names, outputs):
+        with open(str(tmp_path / (name + KEYPOINTS_SUFFIX)), 'w') as file:
+            json.dump(pred, file)
+    items = list(read_pifpaf_outputs([str(tmp_path)], image_size=IMAGE_SIZE, n_workers=2, window=2))
+    assert [meta['file_name'] for _, meta, _ in items] == names
+    assert [pred for pred, _, _ in items] == outputs
+    assert all(meta['size'] == IMAGE_SIZE and image is None for _, meta, image in items)
+
+
+def test_read_store(tmp_path):
+    path = str(tmp_path / 'store.ndjson')
+    outputs = pifpaf_outputs()
+    with open(path, 'w') as file:
+        for i, pred in enumerate(outputs):
+            file.write(json.dumps({'image': 'image_{}.png'.format(i), 'width': 320 + i, 'height': 240, 'predictions': pred}) + '\n')
+    items = list(read_pifpaf_outputs([path]))
+    assert [pred for pred, _, _ in items] == outputs
+    assert [meta['size'] for _, meta, _ in items] == [(320 + i, 240) for i in range(len(outputs))]
+
+
+def test_predictor_records_round_trip(tmp_path):
+    # only the methods building the frames and the records are used, the models are not loaded
+    predictor = Predictor.__new__(Predictor)
+    path = str(tmp_path / 'predictions.ndjson.gz')
+    writer = ResultsWriter(path)
+    frames = []
+    for i, pred in enumerate(pifpaf_outputs()):
+        meta = {'file_name': os.path.join('/data', 'image_{}.png'.format(i)), 'size': IMAGE_SIZE}
+        frame = predictor.get_frame(copy.deepcopy(pred), meta, None)
+        frame['labels'] = np.linspace(0, 1, len(frame['boxes']))
+        writer.write(predictor.get_record(frame))
+        frames.append(frame)
+    writer.close()
+
+    items = list(read_pifpaf_outputs([path]))
+    assert len(items) == len(frames)
+    for frame, (pred, meta, image) in zip(frames, items):
+        assert meta['file_name'] == frame['path'] and meta['size'] == IMAGE_SIZE and image is None
+        read = predictor.get_frame(pred, meta, None)
+        np.testing.assert_allclose(read['boxes'], frame['boxes'], atol=0.02)
+        np.testing.assert_allclose(read['keypoints'], frame['keypoints'], atol=0.01)
+    # the box on the border has been clipped
+    assert frames[0]['boxes'][1][0] == 0
@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+
+from utils.pipeline import Pipeline
+
+
+def test_order_kept_when_workers_finish_out_of_order():
+    def slow_for_small(x):
+        time.sleep(0.01 * (x % 4))
+        return x * 2
+
+    pipeline = Pipeline([(slow_for_small, 4), (lambda x: x + 1, 3)], queue_size=2)
+    assert list(pipeline.run(range(40))) == [2 * x + 1 for x in range(40)]
+
+
+def test_source_not_read_past_max_ahead():
+    read = []
+    release = threading.Event()
+
+    def source():
+        for i in range(100):
+            read.append(i)
+            yield i
+
+    def stall_first(x):
+        if x == 0:
+            release.wait(5)
+        return x
+
+    pipeline = Pipeline([(stall_first, 4)], queue_size=2, max_ahead=6)
+    outputs = pipeline.run(source())
+    consumer = threading.Thread(target=lambda: outputs.__next__())
+    consumer.start()
+    time.sleep(0.5)
+    assert len(read) <= 6 + 1
+    release.set()
+    consumer.join()
+    assert list(outputs) == list(range(1, 100))
+
+
+def test_stage_error_raised_and_threads_joined():
+    n_threads = threading.active_count()
+
+    def fail_on_five(x):
+        if x == 5:
+            raise ValueError("bad item")
+        return x
+
+    pipeline = Pipeline([(fail_on_five, 3), (lambda x: x, 2)], queue_size=2)
+    with pytest.raises(ValueError):
+        list(pipeline.run(range(1000)))
+    assert threading.active_count() == n_threads
+
+
+def test_closing_the_generator_joins_threads():
+    n_threads = threading.active_count()
+    outputs = Pipeline([(lambda x: x, 2)], queue_size=2).run(iter(range(1000)))
+    assert next(outputs) == 0
+    outputs.close()
+    assert threading.active_count() == n_threads
@@ -0,0 +1,33 @@
+import pytest
+import torch
+
+from utils.network import AlexNet_head, LookingModel, fuse_looking_model
+from utils.quantization import quantize_dynamic, quantize_static
+
+
+def test_static_alexnet_head():
+    torch.manual_seed(0)
+    model = AlexNet_head(torch.device('cpu'), fine_tune=False).eval()
+    batches = [torch.randn(2, 3, 227, 227) for _ in range(2)]
+    quantized = quantize_static(model, batches)
+    x = torch.randn(2, 3, 227, 227)
+    with torch.no_grad():
+        expected = model(x)
+        output = quantized(x)
+    assert output.shape == expected.shape == (2, 1)
+    assert (output - expected).abs().max().item() < 0.05
+
+
+def test_static_and_dynamic_looking_model():
+    torch.manual_seed(0)
+    model = LookingModel(51).eval()
+    x = torch.randn(64, 51)
+    with torch.no_grad():
+        expected = model(x)
+        for quantized in [quantize_static(model, [torch.randn(32, 51)]), quantize_dynamic(model), quantize_dynamic(fuse_looking_model(model))]:
+            assert (quantized(x) - expected).abs().max().item() < 0.05
+
+
+def test_dynamic_rejects_heads():
+    with pytest.raises(AssertionError):
+        quantize_dynamic(AlexNet_head(torch.device('cpu'), fine_tune=False))
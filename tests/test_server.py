@@ -0,0 +1,75 @@
+import asyncio
+import json
+
+import numpy as np
+import torch
+
+from utils.network import LookingModel
+from utils.predictor import Predictor
+from utils.server import LookingServer
+
+
+def make_predictor():
+    # a predictor created without outputs, as in serve.py, with a random looking model and without pifpaf
+    predictor = Predictor.__new__(Predictor)
+    predictor.mode = 'joints'
+    predictor.device = torch.device('cpu')
+    torch.manual_seed(0)
+    predictor.model = LookingModel(51).eval()
+    predictor.predictor_ = None
+    predictor.outputs = False
+    predictor.metrics = None
+    return predictor
+
+
+def annotation(seed):
+    rng = np.random.RandomState(seed)
+    keypoints = np.stack([rng.uniform(100, 200, 17), rng.uniform(50, 400, 17), rng.uniform(0.2, 1, 17)], 1)
+    return {'keypoints': keypoints.reshape(-1).tolist(), 'bbox': [100., 50., 100., 350.], 'score': 0.8}
+
+
+async def request(path, method, target, body):
+    reader, writer = await asyncio.open_unix_connection(path)
+    writer.write('{} {} HTTP/1.1\r\nContent-Length: {}\r\nConnection: close\r\n\r\n'.format(method, target, len(body)).encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, content = response.partition(b'\r\n\r\n')
+    return int(head.split(b' ')[1]), content
+
+
+def test_keypoints_request(tmp_path):
+    server = LookingServer(make_predictor(), max_batch=8, max_wait=0.001)
+    path = str(tmp_path / 'looking.sock')
+    body = json.dumps({'width': 640, 'height': 480, 'predictions': [annotation(0), annotation(1)]}).encode()
+
+    async def main():
+        serving = asyncio.get_running_loop().create_task(server.serve(unix_socket=path))
+        for _ in range(100):
+            if server.queue is not None and tmp_path.joinpath('looking.sock').exists():
+                break
+            await asyncio.sleep(0.01)
+        try:
+            responses = await asyncio.gather(*[request(path, 'POST', '/keypoints', body) for _ in range(3)])
+            empty = await request(path, 'POST', '/keypoints', json.dumps({'width': 640, 'height': 480, 'predictions': []}).encode())
+            invalid = await request(path, 'POST', '/keypoints', b'{}')
+            metrics = await request(path, 'GET', '/metrics', b'')
+        finally:
+            serving.cancel()
+        return responses, empty, invalid, metrics
+
+    responses, empty, invalid, metrics = asyncio.run(main())
+    scores = []
+    for status, content in responses:
+        assert status == 200
+        result = json.loads(content)
+        assert len(result['boxes']) == len(result['keypoints']) == len(result['looking']) == 2
+        assert all(0 <= score <= 1 for score in result['looking'])
+        scores.append(result['looking'])
+    # the same pedestrians get the same scores, whatever the batch they are scored in
+    np.testing.assert_allclose(scores[0], scores[1], atol=1e-6)
+    np.testing.assert_allclose(scores[0], scores[2], atol=1e-6)
+    assert empty[0] == 200 and json.loads(empty[1])['looking'] == []
+    assert invalid[0] == 400
+    assert metrics[0] == 200 and b'looking_requests_total{endpoint="/keypoints"} 5' in metrics[1]
+    assert b'looking_errors_total 1' in metrics[1]
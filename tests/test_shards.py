@@ -0,0 +1,94 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+import utils.predictor
+from utils.shards import list_images, split_shards, shard_path, read_completed, run_shard, merge_shards
+from utils.writer import ResultsWriter
+
+
+class FakePredictor():
+    """
+        Writes one record per image like the Predictor, without pifpaf nor the looking model.
+    """
+    delay = 0.
+
+    def __init__(self, args):
+        pass
+
+    def predict(self, args):
+        writer = ResultsWriter(args.json_output, append=args.json_append)
+        # the records of a shard are not necessarily in the input order
+        for path in reversed(args.images):
+            writer.write({'image': os.path.basename(path), 'path': path, 'looking': [0.5]})
+            time.sleep(self.delay)
+        writer.close()
+
+
+class SlowPredictor(FakePredictor):
+    delay = 0.05
+
+
+def shard_args(shard_dir):
+    return argparse.Namespace(shard_dir=shard_dir, shard_threads=1, shard_devices=None, json_output=None, glob=None, images=None)
+
+
+def records(path):
+    with open(path) as file:
+        return [json.loads(line) for line in file]
+
+
+def test_list_images_keeps_input_order(tmp_path):
+    args = shard_args(str(tmp_path))
+    args.images = ['c.png', 'a.png', 'b.png']
+    assert list_images(args) == ['c.png', 'a.png', 'b.png']
+    for name in ['b.png', 'c.png', 'a.png']:
+        open(str(tmp_path / name), 'w').close()
+    args.images, args.glob = [str(tmp_path)], '.png'
+    assert list_images(args) == [str(tmp_path / name) for name in ['a.png', 'b.png', 'c.png']]
+
+
+def test_split_shards_keeps_order():
+    items = list(range(11))
+    shards = split_shards(items, 3)
+    assert [len(shard) for shard in shards] == [4, 4, 3]
+    assert sum(shards, []) == items
+
+
+def test_read_completed_drops_cut_record(tmp_path):
+    path = str(tmp_path / 'shard.ndjson')
+    with open(path, 'w') as file:
+        file.write(json.dumps({'path': 'b.png'}) + '\n' + json.dumps({'path': 'a.png'}) + '\n{"path": "c.p')
+    assert read_completed(path) == {'a.png', 'b.png'}
+    assert len(records(path)) == 2
+
+
+def test_killed_shard_resumes(tmp_path, monkeypatch):
+    shard_dir = str(tmp_path)
+    images = ['/data/image_{:03d}.png'.format(i) for i in range(40)]
+    output = shard_path(shard_dir, 0)
+
+    monkeypatch.setattr(utils.predictor, 'Predictor', SlowPredictor)
+    process = multiprocessing.get_context('fork').Process(target=run_shard, args=(shard_args(shard_dir), 0, images))
+    process.start()
+    while not os.path.isfile(output) or len(records(output)) < 5:
+        time.sleep(0.01)
+    process.kill()
+    process.join()
+    # the kill may also happen in the middle of a record
+    with open(output, 'a') as file:
+        file.write('{"image": "image_0')
+    n_done = len(read_completed(output))
+    assert 5 <= n_done < len(images)
+    assert not os.path.isfile(shard_path(shard_dir, 0, '.done'))
+
+    monkeypatch.setattr(utils.predictor, 'Predictor', FakePredictor)
+    run_shard(shard_args(shard_dir), 0, images)
+    assert os.path.isfile(shard_path(shard_dir, 0, '.done'))
+    paths = [record['path'] for record in records(output)]
+    assert sorted(paths) == images
+
+    merged = merge_shards(shard_dir, 1, str(tmp_path / 'predictions.ndjson'))
+    assert len(records(merged)) == len(images)
@@ -0,0 +1,79 @@
+import numpy as np
+
+from utils.tracker import box_iou_matrix, Tracker
+
+
+def person(x, y, seed=0):
+    rng = np.random.RandomState(seed)
+    keypoints = np.stack([x + rng.uniform(0, 50, 17), y + rng.uniform(0, 100, 17), np.ones(17)])
+    return [x, y, x + 50., y + 100., 0.9], keypoints.tolist()
+
+
+def frame(*persons):
+    return [box for box, _ in persons], [kps for _, kps in persons]
+
+
+def test_box_iou_matrix():
+    ious = box_iou_matrix([[0, 0, 10, 10], [0, 0, 20, 10]], [[0, 0, 10, 10], [5, 0, 15, 10], [30, 30, 40, 40]])
+    np.testing.assert_allclose(ious, [[1., 1. / 3, 0.], [0.5, 0.5, 0.]])
+
+
+def test_ids_across_frames():
+    tracker = Tracker()
+    tracks, to_score = tracker.update(*frame(person(0, 0, seed=0), person(200, 0, seed=1)))
+    ids = [track.id for track in tracks]
+    assert ids == [0, 1] and to_score == [0, 1]
+    # both pedestrians moved a little and are detected in the other order
+    tracks, _ = tracker.update(*frame(person(205, 3, seed=1), person(4, 2, seed=0)))
+    assert [track.id for track in tracks] == [1, 0]
+    assert len(tracker.tracks) == 2
+
+
+def test_new_and_expired_tracks():
+    tracker = Tracker(max_missed=2)
+    tracker.update(*frame(person(0, 0)))
+    # a new pedestrian far away gets a new track
+    tracks, _ = tracker.update(*frame(person(0, 0), person(400, 0)))
+    assert [track.id for track in tracks] == [0, 1]
+    # the first pedestrian is missed for max_missed frames, its track is kept
+    for _ in range(2):
+        tracker.update(*frame(person(400, 0)))
+    tracks, _ = tracker.update(*frame(person(0, 0), person(400, 0)))
+    assert [track.id for track in tracks] == [0, 1]
+    # and dropped after one more missed frame
+    for _ in range(3):
+        tracker.update(*frame(person(400, 0)))
+    assert [track.id for track in tracker.tracks] == [1]
+    tracks, _ = tracker.update(*frame(person(0, 0), person(400, 0)))
+    assert [track.id for track in tracks] == [2, 1]
+    tracker.reset()
+    assert tracker.tracks == []
+
+
+def test_score_cache():
+    tracker = Tracker(tolerance=0.02)
+    tracks, to_score = tracker.update(*frame(person(0, 0)))
+    tracker.smooth(tracks, to_score, [0.8])
+    # the keypoints did not move: the cached score is reused
+    tracks, to_score = tracker.update(*frame(person(0, 0)))
+    assert to_score == []
+    tracker.smooth(tracks, to_score, [])
+    # a displacement of 5 % of the box height is scored again
+    tracks, to_score = tracker.update(*frame(person(0, 5)))
+    assert to_score == [0]
+    assert tracker.n_detections == 3 and tracker.n_scored == 2
+
+
+def test_smoothing():
+    tracker = Tracker(tolerance=0., window=2)
+    smoothed = []
+    for y, score in zip([0, 5, 10], [1., 0., 0.5]):
+        tracks, to_score = tracker.update(*frame(person(0, y)))
+        assert to_score == [0]
+        smoothed.append(tracker.smooth(tracks, to_score, [score])[0])
+    # mean over the last two frames
+    np.testing.assert_allclose(smoothed, [1., 0.5, 0.25])
+    # a cached score counts again in the window
+    tracks, to_score = tracker.update(*frame(person(0, 10)))
+    assert to_score == []
+    np.testing.assert_allclose(tracker.smooth(tracks, to_score, []), [0.5])
@@ -0,0 +1,73 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+from utils.writer import ImageWriterPool, ResultsWriter
+
+
+def test_stdout_records_only(capfd):
+    stdout = sys.stdout
+    writer = ResultsWriter('-')
+    assert sys.stdout is stdout
+    writer.write({'image': 'a.png', 'labels': [0.5]})
+    print('progress', file=sys.stderr)
+    writer.write({'image': 'b.png', 'labels': []})
+    writer.close()
+    out, err = capfd.readouterr()
+    assert [json.loads(line)['image'] for line in out.splitlines()] == ['a.png', 'b.png']
+    assert 'progress' in err
+
+
+def test_file_append(tmp_path):
+    path = str(tmp_path / 'predictions.ndjson')
+    for name in ['a.png', 'b.png']:
+        writer = ResultsWriter(path, append=True)
+        writer.write({'image': name})
+        writer.close()
+    with open(path) as file:
+        assert [json.loads(line)['image'] for line in file] == ['a.png', 'b.png']
+
+
+
+def test_image_writer_concurrent_writes(tmp_path):
+    writer = ImageWriterPool(n_workers=2, queue_size=4)
+    image = np.zeros((4, 4, 3), dtype=np.uint8)
+
+    def render(index):
+        for i in range(50):
+            writer.write(str(tmp_path / 'image_{}_{}'.format(index, i)), image)
+
+    # the render threads of the pipelined mode share the writer
+    threads = [threading.Thread(target=render, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer.close()
+    assert writer.n_queued == writer.n_written == 400
+    assert len(os.listdir(str(tmp_path))) == 400
+    assert 0 <= writer.queue_depth_sum <= 400 * 4 and writer.queue_depth_max <= 4
+
+def test_predict_stdout_records_only(tmp_path):
+    # the command line of the predictor needs openpifpaf, the keypoints are read from pifpaf outputs
+    pytest.importorskip('openpifpaf')
+    rng = np.random.RandomState(0)
+    names = ['a.png', 'b.png']
+    for name in names:
+        keypoints = np.stack([rng.uniform(100, 200, 17), rng.uniform(50, 400, 17), rng.uniform(0.2, 1, 17)], 1)
+        with open(str(tmp_path / (name + '.predictions.json')), 'w') as file:
+            json.dump([{'keypoints': keypoints.reshape(-1).tolist(), 'bbox': [100., 50., 100., 350.], 'score': 0.8}], file)
+    os.makedirs(str(tmp_path / 'output'))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    command = [sys.executable, 'predict.py', '--keypoints', str(tmp_path), '--image_size', '640', '480', '--device', 'cpu',
+               '--no_render', '--image-output', str(tmp_path / 'output'), '--json-output', '-']
+    result = subprocess.run(command, cwd=root, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    records = [json.loads(line) for line in result.stdout.decode().splitlines()]
+    assert [record['image'] for record in records] == names
+    assert all(len(record['looking']) == 1 for record in records)
+    assert b'OpenPifPaf version' in result.stderr
@@ -0,0 +1,140 @@
+import os
+import json
+import hashlib
+import collections
+import sys
+
+
+class PifpafCache():
+    """
+        On-disk cache of the pifpaf outputs, addressed by the content of the image and by the pifpaf settings, so that
+        running the predictor again on the same images (e.g. with another looking threshold or checkpoint) skips pifpaf.
+        The least recently used entries are evicted when the cache grows over max_size.
+        The content hash of an image is only computed once: it is kept in an index addressed by the path, size and
+        modification time of the file, an image is hashed again only if one of them changes.
+        Args:
+            - path: str, directory of the cache
+            - settings: dict, every pifpaf setting changing its outputs (checkpoint, decoder thresholds, long edge ...)
+            - max_size: float, maximum size of the cache in MB
+    """
+    def __init__(self, path, settings, max_size=1024):
+        self.path = path
+        self.max_size = int(max_size * 1024 * 1024)
+        self.salt = hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.path, exist_ok=True)
+
+        # entries ordered from the least to the most recently used, the access time is kept in the mtime of the files
+        entries = []
+        for sub_dir in os.listdir(self.path):
+            if not os.path.isdir(os.path.join(self.path, sub_dir)):
+                continue
+            for file_name in os.listdir(os.path.join(self.path, sub_dir)):
+                if file_name.endswith('.json'):
+                    stat = os.stat(os.path.join(self.path, sub_dir, file_name))
+                    entries.append((stat.st_mtime, file_name[:-5], stat.st_size))
+        self.entries = collections.OrderedDict((key, size) for _, key, size in sorted(entries))
+        self.size = sum(self.entries.values())
+
+        # content hashes of the images, by (path, size, mtime)
+        self.index_path = os.path.join(self.path, 'index.json')
+        self.index = {}
+        try:
+            with open(self.index_path, 'r') as file:
+                self.index = json.load(file)
+        except (OSError, ValueError):
+            pass
+        self.n_hashed = 0
+        self.n_indexed = 0
+
+    def key(self, image_path):
+        """
+            Hash of the content of the image and of the pifpaf settings. The image is only read if its path, size or
+            modification time are not in the index.
+        """
+        stat = os.stat(image_path)
+        signature = '{}|{}|{}'.format(os.path.abspath(image_path), stat.st_size, stat.st_mtime_ns)
+        content = self.index.get(signature)
+        if content is None:
+            digest = hashlib.sha1()
+            with open(image_path, 'rb') as file:
+                for chunk in iter(lambda: file.read(1 << 20), b''):
+                    digest.update(chunk)
+            content = digest.hexdigest()
+            self.index[signature] = content
+            self.n_hashed += 1
+        else:
+            self.n_indexed += 1
+        return hashlib.sha1((self.salt + content).encode()).hexdigest()
+
+    def save_index(self):
+        """
+            Write the index of the content hashes, merged with the entries written by the other processes sharing the cache.
+        """
+        try:
+            with open(self.index_path, 'r') as file:
+                index = json.load(file)
+        except (OSError, ValueError):
+            index = {}
+        index.update(self.index)
+        tmp_path = '{}.{}.tmp'.format(self.index_path, os.getpid())
+        with open(tmp_path, 'w') as file:
+            json.dump(index, file)
+        os.replace(tmp_path, self.index_path)
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key[:2], key + '.json')
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        """
+            Returns the cached record {"width", "height", "predictions"} or None.
+        """
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        try:
+            with open(self.entry_path(key), 'r') as file:
+                record = json.load(file)
+        except (OSError, ValueError):
+            self.size -= self.entries.pop(key)
+            self.misses += 1
+            return None
+        os.utime(self.entry_path(key))
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return record
+
+    def put(self, key, record):
+        path = self.entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename, a crash never leaves a truncated entry. The temporary file is per process, the cache can
+        # be shared by the workers of a sharded run
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'w') as file:
+            json.dump(record, file)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        self.size += size - self.entries.pop(key, 0)
+        self.entries[key] = size
+        self.evict()
+
+    def evict(self):
+        while self.size > self.max_size and len(self.entries) > 1:
+            key, size = self.entries.popitem(last=False)
+            try:
+                os.remove(self.entry_path(key))
+            except OSError:
+                pass
+            self.size -= size
+            self.evictions += 1
+
+    def print_stats(self, file=sys.stdout):
+        total = self.hits + self.misses
+        rate = 100. * self.hits / total if total != 0 else 0.
+        print('Pifpaf cache : {} hits | {} misses ({:.1f} % hit rate) | {} evictions | {:.1f} MB in {} entries'.format(self.hits, self.misses, rate, self.evictions, self.size / (1024 * 1024), len(self.entries)), file=file)
+        print('Pifpaf cache : {} images hashed, {} hashes read from the index'.format(self.n_hashed, self.n_indexed), file=file)
@@ -0,0 +1,150 @@
+import os
+import json
+
+import numpy as np
+import torch
+from PIL import Image
+from torchvision import transforms
+
+INDEX = 'index.json'
+
+
+def split_transform(transform):
+    """
+        Split the transform of the crops into the part giving the resized image, applied once when a store is compiled,
+        and the normalization applied when the stored crops are read.
+        Args:
+            - transform: transforms.Compose ending with Resize, ToTensor and optionally Normalize
+        Returns:
+            the PIL -> PIL transform, the tensor -> tensor transform and the (height, width) of the crops
+    """
+    steps = list(transform.transforms)
+    resizes = [i for i, step in enumerate(steps) if isinstance(step, transforms.Resize)]
+    assert len(resizes) != 0, "the crops can only be stored for transforms with a Resize"
+    last = resizes[-1]
+    rest = steps[last+1:]
+    assert len(rest) != 0 and isinstance(rest[0], transforms.ToTensor), "the Resize must be followed by ToTensor"
+    return transforms.Compose(steps[:last+1]), transforms.Compose(rest[1:]), tuple(steps[last].size)
+
+
+def store_name(dataset, size):
+    """
+        Name of the crop store of a dataset: one store per dataset, subset, split, crop type and crop size.
+    """
+    subset = getattr(dataset, 'split_strategy', None) or getattr(dataset, 'data_name', 'all')
+    crop_type = 'eyes' if 'eyes' in dataset.type else 'heads'
+    return '{}_{}_{}_{}_{}x{}'.format(dataset.name.lower(), subset.lower(), dataset.split, crop_type, size[1], size[0])
+
+
+def compile_crop_store(path_data, names, decode, output, shard_size=4096):
+    """
+        Decode and resize crops once, into memory-mapped uint8 shards of shape (N, height, width, 3) and an index
+        mapping each crop name to its shard and row. The index is written last: a store without index is incomplete.
+        Args:
+            - path_data: str, directory the crop names are relative to
+            - names: list of str, crop names as in the split files
+            - decode: PIL -> PIL transform of the crops (see split_transform)
+            - output: str, directory of the store
+            - shard_size: int, number of crops per shard
+    """
+    os.makedirs(output, exist_ok=True)
+    names = sorted(set(names))
+    assert len(names) != 0, "no crop to store"
+    shape = np.asarray(decode(Image.open(os.path.join(path_data, names[0])).convert('RGB'))).shape
+    index = {'shape': list(shape), 'shards': [], 'crops': {}}
+    for i, start in enumerate(range(0, len(names), shard_size)):
+        chunk = names[start:start+shard_size]
+        file = 'shard_{:04d}.u8'.format(i)
+        shard = np.memmap(os.path.join(output, file), dtype=np.uint8, mode='w+', shape=(len(chunk),) + shape)
+        for row, name in enumerate(chunk):
+            shard[row] = np.asarray(decode(Image.open(os.path.join(path_data, name)).convert('RGB')))
+            index['crops'][name] = [i, row]
+        shard.flush()
+        del shard
+        index['shards'].append({'file': file, 'count': len(chunk)})
+        print('{} : {}/{} crops'.format(output, start + len(chunk), len(names)))
+    with open(os.path.join(output, INDEX + '.tmp'), 'w') as file:
+        json.dump(index, file)
+    os.replace(os.path.join(output, INDEX + '.tmp'), os.path.join(output, INDEX))
+
+
+class CropStore():
+    """
+        Read-only access to a store written by compile_crop_store. The shards are memory-mapped when the first crop is
+        read, so that a store can be sent to the DataLoader workers without copying them.
+        Args:
+            - path: str, directory of the store
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX), 'r') as file:
+            index = json.load(file)
+        self.shape = tuple(index['shape'])
+        self.files = [(shard['file'], shard['count']) for shard in index['shards']]
+        self.index = {name: tuple(position) for name, position in index['crops'].items()}
+        self.shards = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __getitem__(self, name):
+        """
+            Stored crop, a (height, width, 3) uint8 view of the shard (no copy).
+        """
+        if self.shards is None:
+            # copy-on-write mapping: the views are writable, as torch.from_numpy expects, but the file is never modified
+            self.shards = [np.memmap(os.path.join(self.path, file), dtype=np.uint8, mode='c', shape=(count,) + self.shape) for file, count in self.files]
+        shard, row = self.index[name]
+        return self.shards[shard][row]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['shards'] = None
+        return state
+
+
+class StoredCropTransform():
+    """
+        Transform of a dataset reading its crops from a store: the stored crops, already resized, are only converted to
+        tensors and normalized. The crops missing from the store go through the full transform.
+    """
+    def __init__(self, transform):
+        self.transform = transform
+        _, self.normalize, _ = split_transform(transform)
+
+    def __call__(self, crop):
+        if isinstance(crop, np.ndarray):
+            return self.normalize(torch.from_numpy(crop).permute(2, 0, 1).float().div_(255.))
+        return self.transform(crop)
+
+
+def open_crop(path_data, name, crops=None):
+    """
+        Crop of a dataset, from its store if it has one (uint8 array) or from its image file (PIL image).
+    """
+    if crops is not None and name in crops:
+        return crops[name]
+    return Image.open(os.path.join(path_data, name))
+
+
+def attach_crop_store(dataset, root):
+    """
+        Make a heads / eyes / heads+joints / eyes+joints dataset read its crops from its store in root, if it was
+        compiled (see compile_crops.py).
+        Returns:
+            True if the store was found
+    """
+    if dataset.type == 'joints' or isinstance(dataset.transform, StoredCropTransform):
+        return False
+    _, _, size = split_transform(dataset.transform)
+    path = os.path.join(root, store_name(dataset, size))
+    if not os.path.isfile(os.path.join(path, INDEX)):
+        print('WARNING : no crop store in {}, the crops are decoded on the fly. Run compile_crops.py to create it'.format(path))
+        return False
+    dataset.crops = CropStore(path)
+    dataset.transform = StoredCropTransform(dataset.transform)
+    print('Crop store {} : {} crops'.format(path, len(dataset.crops)))
+    return True
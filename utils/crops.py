@@ -0,0 +1,106 @@
+import numpy as np
+import torch
+import PIL.Image
+
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+HEAD_CROPS = ['pil', 'roi_align']
+
+
+def head_regions(boxes, image_size):
+    """
+        Integer head regions of the pedestrians: the top third of their boxes, clipped to the image.
+        Args:
+            - boxes: list of boxes (x1, y1, x2, y2, score)
+            - image_size: tuple, (width, height) of the image
+        Returns:
+            an int array of shape (N, 4) with the x1, y1, x2, y2 pixel bounds (x2 and y2 excluded) of each head
+    """
+    boxes = np.array([box[:4] for box in boxes], dtype=np.float64).reshape(-1, 4)
+    width, height = image_size
+    x1, y1 = np.trunc(boxes[:, 0]), np.trunc(boxes[:, 1])
+    x2 = np.trunc(boxes[:, 2])
+    y2 = np.trunc(boxes[:, 1] + np.abs(boxes[:, 3] - boxes[:, 1]) / 3)
+    regions = np.stack([np.clip(x1, 0, width), np.clip(y1, 0, height), np.clip(x2, 0, width), np.clip(y2, 0, height)], axis=1).astype(np.int64)
+    # at least one pixel per head
+    regions[:, 2] = np.maximum(regions[:, 2], regions[:, 0] + 1)
+    regions[:, 3] = np.maximum(regions[:, 3], regions[:, 1] + 1)
+    return regions
+
+
+class PilHeadCropper():
+    """
+        Reference extraction of the head crops: each head is sliced out of the image and goes through the PIL transform
+        the head models are trained with (SquarePad + Resize + ToTensor + Normalize).
+        Args:
+            - device: torch device the crops are moved to
+            - transform: transform of a PIL head crop into a normalized tensor
+    """
+    def __init__(self, device, transform):
+        self.device = device
+        self.transform = transform
+
+    def __call__(self, image, boxes):
+        """
+            Args:
+                - image: RGB image, PIL image or array of shape (H, W, 3)
+                - boxes: list of boxes (x1, y1, x2, y2, score) of the pedestrians
+            Returns:
+                the normalized head crops, tensor of shape (N, 3, size, size) on the device
+        """
+        image = np.asarray(image)
+        heads = []
+        for x1, y1, x2, y2, _ in boxes:
+            h = abs(y2 - y1)
+            heads.append(self.transform(PIL.Image.fromarray(image[int(y1):int(y1+(h/3)), int(x1):int(x2), :])))
+        return torch.stack(heads).to(self.device)
+
+
+class HeadCropper():
+    """
+        Batched extraction of the head crops of an image, an approximation of PilHeadCropper. The image is converted to
+        a tensor once and all the crops are resampled with a single ROI-align; as with SquarePad, the padding around
+        the crops is black. The resampling differs from the PIL resize (no antialiasing), tests/test_crops.py bounds the
+        difference.
+        Args:
+            - device: torch device the crops are computed on
+            - size: int, side of the output crops
+    """
+    def __init__(self, device, size=227):
+        self.device = device
+        self.size = size
+        self.mean = torch.tensor(IMAGENET_MEAN, device=device).view(1, 3, 1, 1)
+        self.std = torch.tensor(IMAGENET_STD, device=device).view(1, 3, 1, 1)
+        self.centers = torch.arange(size, dtype=torch.float32, device=device) + 0.5
+
+    def __call__(self, image, boxes):
+        """
+            Args:
+                - image: RGB image, PIL image or array of shape (H, W, 3)
+                - boxes: list of boxes (x1, y1, x2, y2, score) of the pedestrians
+            Returns:
+                the normalized head crops, tensor of shape (N, 3, size, size) on the device
+        """
+        from torchvision.ops import roi_align
+        image = np.asarray(image)
+        height, width = image.shape[:2]
+        regions = head_regions(boxes, (width, height))
+        crop_w, crop_h = regions[:, 2] - regions[:, 0], regions[:, 3] - regions[:, 1]
+        side = np.maximum(crop_w, crop_h)
+        # same (floored) padding as SquarePad
+        pad_w, pad_h = (side - crop_w) // 2, (side - crop_h) // 2
+        squares = np.stack([regions[:, 0] - pad_w, regions[:, 1] - pad_h, regions[:, 2] + pad_w, regions[:, 3] + pad_h], axis=1)
+
+        tensor = torch.from_numpy(np.ascontiguousarray(image)).to(self.device).permute(2, 0, 1).unsqueeze(0).float().div_(255.)
+        squares = torch.from_numpy(squares).to(self.device, torch.float32)
+        rois = torch.cat([torch.zeros(len(squares), 1, device=self.device), squares], 1)
+        crops = roi_align(tensor, rois, output_size=(self.size, self.size), spatial_scale=1., sampling_ratio=-1, aligned=True)
+
+        # black padding: the output pixels sampled outside of the head region are set to 0 before the normalization
+        regions = torch.from_numpy(regions).to(self.device, torch.float32)
+        xs = squares[:, 0:1] + self.centers[None] * (squares[:, 2:3] - squares[:, 0:1]) / self.size
+        ys = squares[:, 1:2] + self.centers[None] * (squares[:, 3:4] - squares[:, 1:2]) / self.size
+        inside_x = (xs >= regions[:, 0:1]) & (xs < regions[:, 2:3])
+        inside_y = (ys >= regions[:, 1:2]) & (ys < regions[:, 3:4])
+        crops = crops * (inside_y[:, :, None] & inside_x[:, None, :]).unsqueeze(1)
+        return (crops - self.mean) / self.std
@@ -8,11 +8,11 @@ import numpy as np
 from glob import glob
 from PIL import Image
 
-from skimage import io, transform
 from torch.utils.data import Dataset, DataLoader
 from torchvision import transforms, utils
 
 from utils.utils_train import *
+from utils.crop_store import open_crop
 
 np.random.seed(0)
 
@@ -40,6 +40,10 @@ class JAAD_Dataset(Dataset):
         self.pose = pose
         self.transform = transform
         self.device = device
+        # DataLoader options (workers, pinned memory) of the evaluation, see utils.loaders.loader_args
+        self.loader_args = {}
+        # store of the pre-decoded crops, see utils.crop_store.attach_crop_store
+        self.crops = None
         self.name = 'jaad'
         self.HEIGHT = 1980
         self.WIDTH = 1280
@@ -70,28 +74,28 @@ class JAAD_Dataset(Dataset):
         label = self.Y[idx]
 
         if self.type == 'joints':
-            sample = {'input':self.X[idx].to(self.device) ,'label':label}
+            sample = {'input':self.X[idx] ,'label':label}
         elif self.type == 'heads':
-            sample = {'input': Image.open(os.path.join(self.path_data,self.X[idx])), 'label':label}
+            sample = {'input': open_crop(self.path_data, self.X[idx], self.crops), 'label':label}
             if self.transform:
-                sample['input'] = self.transform(sample['input']).to(self.device)
+                sample['input'] = self.transform(sample['input'])
         elif self.type == 'eyes+joints':
-            eyes = Image.open(os.path.join(self.path_data,self.X[idx]))
+            eyes = open_crop(self.path_data, self.X[idx], self.crops)
             sample_ = {'image': eyes, 'keypoints':self.kps[idx] ,'label':label}
             if self.transform:
                 sample_['image'] = self.transform(sample_['image'])
-            sample = {'input':(sample_['image'].to(self.device), sample_['keypoints'].to(self.device)), 'label':sample_['label']}
+            sample = {'input':(sample_['image'], sample_['keypoints']), 'label':sample_['label']}
         elif self.type == 'eyes':
-            eyes = Image.open(os.path.join(self.path_data,self.X[idx]))
+            eyes = open_crop(self.path_data, self.X[idx], self.crops)
             sample_ = {'image': eyes,'label':label}
             if self.transform:
                 sample_['image'] = self.transform(sample_['image'])
-            sample = {'input':sample_['image'].to(self.device), 'label':sample_['label']}
+            sample = {'input':sample_['image'], 'label':sample_['label']}
         else:
-            sample_ = {'image': Image.open(os.path.join(self.path_data,self.X[idx])), 'keypoints':self.kps[idx] ,'label':label}
+            sample_ = {'image': open_crop(self.path_data, self.X[idx], self.crops), 'keypoints':self.kps[idx] ,'label':label}
             if self.transform:
                 sample_['image'] = self.transform(sample_['image'])
-            sample = {'input':(sample_['image'].to(self.device), sample_['keypoints'].to(self.device)), 'label':sample_['label']}
+            sample = {'input':(sample_['image'], sample_['keypoints']), 'label':sample_['label']}
         return sample['input'], torch.Tensor([float(sample['label'])])
 
     def get_joints(self):
@@ -282,7 +286,7 @@ class JAAD_Dataset(Dataset):
                     heights = np.array(self.heights)[np.concatenate((idx_Y1, idx_Y0[:N_pos]))]
 
                 dataset_joints_test = Eval_Dataset_joints(total_samples, total_labels, heights)
-                data_loader = torch.utils.data.DataLoader(dataset_joints_test, batch_size=16, shuffle=True)
+                data_loader = torch.utils.data.DataLoader(dataset_joints_test, batch_size=16, shuffle=True, **self.loader_args)
                 acc = 0
                 predicted_labels = torch.Tensor([]).type(torch.float)
                 ground_truth_labels = torch.Tensor([])
@@ -349,8 +353,8 @@ class JAAD_Dataset(Dataset):
                 total_samples = np.concatenate((positive_samples, neg_samples)).tolist()
                 total_labels = np.concatenate((positive_samples_labels, neg_samples_labels)).tolist()
 
-                dataset_test_heads = Eval_Dataset_heads(self.path_data, total_samples, total_labels, self.transform)
-                data_loader = torch.utils.data.DataLoader(dataset_test_heads, batch_size=16, shuffle=False)
+                dataset_test_heads = Eval_Dataset_heads(self.path_data, total_samples, total_labels, self.transform, crops=self.crops)
+                data_loader = torch.utils.data.DataLoader(dataset_test_heads, batch_size=16, shuffle=False, **self.loader_args)
 
                 
                 acc = 0
@@ -428,8 +432,8 @@ class JAAD_Dataset(Dataset):
                 if heights_:
                     heights = np.array(self.heights)[np.concatenate((idx_Y1, idx_Y0[:N_pos]))]
 
-                dataset_test_heads_joints = Eval_Dataset_heads_joints(self.path_data, total_samples, total_labels, total_samples_kps, self.transform, heights)
-                data_loader = torch.utils.data.DataLoader(dataset_test_heads_joints, batch_size=16, shuffle=False)
+                dataset_test_heads_joints = Eval_Dataset_heads_joints(self.path_data, total_samples, total_labels, total_samples_kps, self.transform, heights, crops=self.crops)
+                data_loader = torch.utils.data.DataLoader(dataset_test_heads_joints, batch_size=16, shuffle=False, **self.loader_args)
                 
                 acc = 0
                 predicted_labels = torch.Tensor([]).type(torch.float)
@@ -496,6 +500,10 @@ class PIE_Dataset(Dataset):
         self.pose = pose
         self.transform = transform
         self.device = device
+        # DataLoader options (workers, pinned memory) of the evaluation, see utils.loaders.loader_args
+        self.loader_args = {}
+        # store of the pre-decoded crops, see utils.crop_store.attach_crop_store
+        self.crops = None
         self.name = 'pie'
         self.nb = 20000 # Number of instances to train on..
         assert self.pose in ['full', 'head', 'body']
@@ -547,21 +555,21 @@ class PIE_Dataset(Dataset):
                 tensor = np.concatenate((X_new, Y_new, C_new)).tolist()
             else:
                 tensor = np.concatenate((X_new, Y_new, joints[34:])).tolist()
-            sample = {'input':torch.Tensor(tensor).to(self.device) ,'label':label}
+            sample = {'input':torch.Tensor(tensor) ,'label':label}
         elif self.type in ['heads', 'eyes']:
-            sample = {'input': Image.open(os.path.join(self.path_data,self.X[idx])), 'label':label}
+            sample = {'input': open_crop(self.path_data, self.X[idx], self.crops), 'label':label}
             if self.transform:
-                sample['input'] = self.transform(sample['input']).to(self.device)
+                sample['input'] = self.transform(sample['input'])
         else:
             joints = np.array(json.load(open(self.kps[idx]+'.json')))["X"]
             X = joints[:17]
             Y = joints[17:34]
             X_new, Y_new, _ = normalize_by_image_(X, Y, height_=True)
             tensor = np.concatenate((X_new, Y_new, joints[34:])).tolist()
-            sample_ = {'image': Image.open(os.path.join(self.path_data,self.X[idx])), 'keypoints':torch.tensor(tensor) ,'label':label}
+            sample_ = {'image': open_crop(self.path_data, self.X[idx], self.crops), 'keypoints':torch.tensor(tensor) ,'label':label}
             if self.transform:
                 sample_['image'] = self.transform(sample_['image'])
-            sample = {'input':(sample_['image'].to(self.device), sample_['keypoints'].to(self.device)), 'label':sample_['label']}
+            sample = {'input':(sample_['image'], sample_['keypoints']), 'label':sample_['label']}
         return sample['input'], torch.Tensor([float(sample['label'])])
 
     def get_joints(self):
@@ -787,7 +795,7 @@ class PIE_Dataset(Dataset):
                     heights = None
 
                 dataset_test_joints = Eval_Dataset_joints_pie(total_samples, total_labels, self.pose, heights)
-                data_loader = torch.utils.data.DataLoader(dataset_test_joints, batch_size=16, shuffle=False)
+                data_loader = torch.utils.data.DataLoader(dataset_test_joints, batch_size=16, shuffle=False, **self.loader_args)
                 acc = 0
                 predicted_labels = torch.Tensor([]).type(torch.float)
                 total_ground_truth = torch.Tensor([])
@@ -854,8 +862,8 @@ class PIE_Dataset(Dataset):
 
                 total_samples = np.concatenate((positive_samples, neg_samples)).tolist()
                 total_labels = np.concatenate((positive_samples_labels, neg_samples_labels)).tolist()
-                new_data = Eval_Dataset_heads(self.path_data, total_samples, total_labels, self.transform)
-                data_loader = torch.utils.data.DataLoader(new_data, batch_size=768, shuffle=False)
+                new_data = Eval_Dataset_heads(self.path_data, total_samples, total_labels, self.transform, crops=self.crops)
+                data_loader = torch.utils.data.DataLoader(new_data, batch_size=768, shuffle=False, **self.loader_args)
 
                 acc = 0
                 out_lab = torch.Tensor([]).type(torch.float)
@@ -942,8 +950,8 @@ class PIE_Dataset(Dataset):
                 total_samples_kps = np.concatenate((positive_samples_kps, neg_samples_kps)).tolist()
                 total_labels = np.concatenate((positive_samples_labels, neg_samples_labels)).tolist()
                 
-                new_data = Eval_Dataset_heads_joints_pie(self.path_data, total_samples, total_labels, total_samples_kps, self.transform)
-                data_loader = torch.utils.data.DataLoader(new_data, batch_size=512, shuffle=False)
+                new_data = Eval_Dataset_heads_joints_pie(self.path_data, total_samples, total_labels, total_samples_kps, self.transform, crops=self.crops)
+                data_loader = torch.utils.data.DataLoader(new_data, batch_size=512, shuffle=False, **self.loader_args)
                 
                 acc = 0
                 out_lab = torch.Tensor([]).type(torch.float)
@@ -1072,7 +1080,7 @@ class Eval_Dataset_joints(Dataset):
 class Eval_Dataset_heads(Dataset):
     """Dataset class for evaluation"""
 
-    def __init__(self, path_jaad, data_x, data_y, transform=None, heights=None):
+    def __init__(self, path_jaad, data_x, data_y, transform=None, heights=None, crops=None):
         """
         Args:
             split : train, val and test
@@ -1085,6 +1093,7 @@ class Eval_Dataset_heads(Dataset):
         self.data_x = data_x
         self.data_y = data_y
         self.heights = heights
+        self.crops = crops
 
 
     def __len__(self):
@@ -1094,7 +1103,7 @@ class Eval_Dataset_heads(Dataset):
         if torch.is_tensor(idx):
             idx = idx.tolist()
         label = self.data_y[idx]
-        sample = {'image': Image.open(os.path.join(self.path, self.data_x[idx])), 'label':label}
+        sample = {'image': open_crop(self.path, self.data_x[idx], self.crops), 'label':label}
         if self.transform:
             sample['image'] = self.transform(sample['image'])
         return sample['image'], sample['label']
@@ -1115,7 +1124,7 @@ class Eval_Dataset_heads(Dataset):
 class Eval_Dataset_heads_joints(Dataset):
 	"""Dataset class for evaluation"""
 
-	def __init__(self, path_data, data_x, data_y, kps, transform, heights=None):
+	def __init__(self, path_data, data_x, data_y, kps, transform, heights=None, crops=None):
 		"""
 		Args:
 			split : train, val and test
@@ -1129,6 +1138,7 @@ class Eval_Dataset_heads_joints(Dataset):
 		self.kps = kps
 		self.transform = transform
 		self.heights = heights
+		self.crops = crops
 
 	def __len__(self):
 		return len(self.data_y)
@@ -1137,7 +1147,7 @@ class Eval_Dataset_heads_joints(Dataset):
 		if torch.is_tensor(idx):
 			idx = idx.tolist()
 		label = self.data_y[idx]
-		sample = {'keypoints': self.kps[idx], 'image':Image.open(os.path.join(self.path_data, self.data_x[idx])),'label':label}
+		sample = {'keypoints': self.kps[idx], 'image':open_crop(self.path_data, self.data_x[idx], self.crops),'label':label}
 		if self.transform:
 			sample['image'] = self.transform(sample['image'])
 		if self.heights is not None:
@@ -1149,7 +1159,7 @@ class Eval_Dataset_heads_joints(Dataset):
 class Eval_Dataset_heads_joints_pie(Dataset):
 	"""Dataset class for evaluation"""
 
-	def __init__(self, path_data, data_x, data_y, kps, transform, heights=None):
+	def __init__(self, path_data, data_x, data_y, kps, transform, heights=None, crops=None):
 		"""
 		Args:
 			split : train, val and test
@@ -1163,6 +1173,7 @@ class Eval_Dataset_heads_joints_pie(Dataset):
 		self.kps = kps
 		self.transform = transform
 		self.heights = heights
+		self.crops = crops
 
 	def __len__(self):
 		return len(self.data_y)
@@ -1176,7 +1187,7 @@ class Eval_Dataset_heads_joints_pie(Dataset):
 		Y = joints[17:34]
 		X_new, Y_new, _ = normalize_by_image_(X, Y, height_=True)
 		tensor = np.concatenate((X_new, Y_new, joints[34:])).tolist()
-		sample = {'keypoints': tensor, 'image':Image.open(os.path.join(self.path_data, self.data_x[idx])),'label':label}
+		sample = {'keypoints': tensor, 'image':open_crop(self.path_data, self.data_x[idx], self.crops),'label':label}
 		if self.transform:
 			sample['image'] = self.transform(sample['image'])
 		if self.heights is not None:
@@ -1201,6 +1212,10 @@ class LOOK_dataset_(Dataset):
         self.pose = pose
         self.type = type_
         self.device = device
+        # DataLoader options (workers, pinned memory) of the evaluation, see utils.loaders.loader_args
+        self.loader_args = {}
+        # store of the pre-decoded crops, see utils.crop_store.attach_crop_store
+        self.crops = None
         self.data_name = data_name
         self.name = 'LOOK'
         assert self.type in ['joints', 'heads', 'heads+joints', 'eyes+joints', 'eyes']
@@ -1218,24 +1233,30 @@ class LOOK_dataset_(Dataset):
         label = self.Y[idx]
 
         if self.type == 'joints':
-            sample = {'input':self.kps[idx].to(self.device) ,'label':label}
+            sample = {'input':self.kps[idx] ,'label':label}
         elif self.type in ['heads', 'eyes']:
-            sample = {'input': Image.open(os.path.join(self.path_data,self.X[idx])), 'label':label}
+            sample = {'input': open_crop(self.path_data, self.X[idx], self.crops), 'label':label}
             if self.transform:
-                sample['input'] = self.transform(sample['input']).to(self.device)
+                sample['input'] = self.transform(sample['input'])
         elif self.type == 'eyes+joints':
-            eyes = Image.open(os.path.join(self.path_data,self.X[idx]))
+            eyes = open_crop(self.path_data, self.X[idx], self.crops)
             sample_ = {'image': eyes, 'keypoints':self.kps[idx] ,'label':label}
             if self.transform:
                 sample_['image'] = self.transform(sample_['image'])
-            sample = {'input':(sample_['image'].to(self.device), sample_['keypoints'].to(self.device)), 'label':sample_['label']}
+            sample = {'input':(sample_['image'], sample_['keypoints']), 'label':sample_['label']}
         else:
-            sample_ = {'image': Image.open(os.path.join(self.path_data,self.X[idx])), 'keypoints':self.kps[idx] ,'label':label}
+            sample_ = {'image': open_crop(self.path_data, self.X[idx], self.crops), 'keypoints':self.kps[idx] ,'label':label}
             if self.transform:
                 sample_['image'] = self.transform(sample_['image'])
-            sample = {'input':(sample_['image'].to(self.device), sample_['keypoints'].to(self.device)), 'label':sample_['label']}
+            sample = {'input':(sample_['image'], sample_['keypoints']), 'label':sample_['label']}
         return sample['input'], torch.Tensor([float(sample['label'])])
 
+    def get_joints(self):
+        """
+            Utility function to get all the instances and their associated ground truth at once
+        """
+        return self.kps, torch.Tensor(self.Y).unsqueeze(1)
+
     def preprocess(self):
         """
         A function to parse the txt gt file and load the annotations, the labels and pre-loads the head images
@@ -1384,7 +1405,7 @@ class LOOK_dataset_(Dataset):
                     heights = np.array(self.heights)[np.concatenate((idx_Y1, idx_Y0[:N_pos]))]
 
                 new_data = Eval_Dataset_joints(total_samples, total_labels, heights)
-                data_loader = torch.utils.data.DataLoader(new_data, batch_size=16, shuffle=False)
+                data_loader = torch.utils.data.DataLoader(new_data, batch_size=16, shuffle=False, **self.loader_args)
 
                 if heights_:
                     heights = []
@@ -1439,8 +1460,8 @@ class LOOK_dataset_(Dataset):
 
                 total_samples = np.concatenate((positive_samples, neg_samples)).tolist()
                 total_labels = np.concatenate((positive_samples_labels, neg_samples_labels)).tolist()
-                new_data = Eval_Dataset_heads(self.path_data, total_samples, total_labels, self.transform)
-                data_loader = torch.utils.data.DataLoader(new_data, batch_size=16, shuffle=False)
+                new_data = Eval_Dataset_heads(self.path_data, total_samples, total_labels, self.transform, crops=self.crops)
+                data_loader = torch.utils.data.DataLoader(new_data, batch_size=16, shuffle=False, **self.loader_args)
 
                 if heights_:
                     heights = np.array(self.heights)[np.concatenate((idx_Y1, idx_Y0[:N_pos]))]
@@ -1507,8 +1528,8 @@ class LOOK_dataset_(Dataset):
                 total_labels = np.concatenate((positive_samples_labels, neg_samples_labels)).tolist()
                 if heights_:
                     heights = np.array(self.heights)[np.concatenate((idx_Y1, idx_Y0[:N_pos]))]
-                new_data = Eval_Dataset_heads_joints(self.path_data, total_samples, total_labels, total_samples_kps, self.transform, heights)
-                data_loader = torch.utils.data.DataLoader(new_data, batch_size=16, shuffle=False)
+                new_data = Eval_Dataset_heads_joints(self.path_data, total_samples, total_labels, total_samples_kps, self.transform, heights, crops=self.crops)
+                data_loader = torch.utils.data.DataLoader(new_data, batch_size=16, shuffle=False, **self.loader_args)
                 
                 acc = 0
                 out_lab = torch.Tensor([]).type(torch.float)
@@ -0,0 +1,250 @@
+import os
+import json
+import hashlib
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+from utils.network import *
+from utils.utils_train import binary_acc, average_precision
+from utils.loaders import to_device
+
+INDEX = 'index.json'
+RESNET_HEADS = (ResNet18_head, ResNet50_head)
+LATE_FUSION = (LookingNet_late_fusion_18, LookingNet_late_fusion_50)
+EARLY_FUSION = (LookingNet_early_fusion_18, LookingNet_early_fusion_50)
+
+
+def frozen_modules(model):
+    """
+        Frozen layers of a fine-tuned heads or fusion model, or None if the model has no frozen layers to cache.
+    """
+    if isinstance(model, AlexNet_head):
+        return [model.net.features, model.net.avgpool]
+    if isinstance(model, RESNET_HEADS):
+        return [module for name, module in model.net.named_children() if name != 'fc']
+    if isinstance(model, LATE_FUSION + EARLY_FUSION):
+        return [model.backbone, model.looking_model]
+    if isinstance(model, LookingNet_early_fusion_eyes):
+        return [model.looking_model]
+    return None
+
+
+def train_mode(model, frozen_eval):
+    """
+        Put a model in training mode. With frozen_eval, used with a feature cache, the frozen layers stay in eval mode:
+        their BatchNorm layers keep their running statistics and their dropout is disabled, as when their activations
+        were cached. Otherwise the whole model is in training mode, as with model.train().
+    """
+    model.train()
+    modules = frozen_modules(model) if frozen_eval else None
+    if modules is not None:
+        for module in modules:
+            module.eval()
+    return model
+
+
+def avgpool_features(net, x):
+    activation = {}
+    def hook(module, input, output):
+        activation['avgpool'] = output
+    handle = net.avgpool.register_forward_hook(hook)
+    _ = net(x)
+    handle.remove()
+    return torch.flatten(activation['avgpool'], 1)
+
+
+def frozen_features(model, x):
+    """
+        Activations of the frozen layers of a model for a batch of inputs, i.e. the inputs of its trainable layers.
+        Returns:
+            a tuple of (N, dim) tensors
+    """
+    if isinstance(model, AlexNet_head):
+        return (torch.flatten(model.net.avgpool(model.net.features(x)), 1),)
+    if isinstance(model, RESNET_HEADS):
+        return (avgpool_features(model.net, x),)
+    if isinstance(model, LATE_FUSION):
+        head, keypoint = x
+        activation = {}
+        def hook(module, input, output):
+            activation['look'] = output
+        handle = model.looking_model.linear_stages[2].bn2.register_forward_hook(hook)
+        _ = model.looking_model(keypoint)
+        handle.remove()
+        return avgpool_features(model.backbone.net, head), activation['look']
+    if isinstance(model, EARLY_FUSION):
+        head, keypoint = x
+        return avgpool_features(model.backbone.net, head), model.looking_model.forward_first_stage(keypoint)
+    eyes, keypoint = x
+    return torch.flatten(eyes, 1), model.looking_model.forward_first_stage(keypoint)
+
+
+def head_forward(model, features):
+    """
+        Output of the trainable layers of a model from the activations of its frozen layers (see frozen_features): the
+        same as model(x) in eval mode.
+    """
+    if isinstance(model, AlexNet_head):
+        return model.net.classifier(features[0])
+    if isinstance(model, RESNET_HEADS):
+        return model.net.fc(features[0])
+    if isinstance(model, LATE_FUSION):
+        return model.final(torch.cat((model.encoder_head(features[0]), model.relu(features[1])), 1))
+    if isinstance(model, EARLY_FUSION):
+        return model.looking_module(features[1] + model.encoder_head(features[0]))
+    return model.looking_module(features[1] + model.encoder_eyes(features[0]))
+
+
+def frozen_weights_key(model):
+    """
+        Hash of the weights of the frozen layers: a cache computed with other weights is not reused.
+    """
+    sha = hashlib.sha1()
+    for module in frozen_modules(model):
+        for name, tensor in module.state_dict().items():
+            sha.update(name.encode())
+            sha.update(tensor.detach().cpu().numpy().tobytes())
+    return sha.hexdigest()
+
+
+def cache_name(model, dataset):
+    subset = getattr(dataset, 'split_strategy', None) or getattr(dataset, 'data_name', 'all')
+    return '{}_{}_{}_{}_{}'.format(dataset.name.lower(), subset.lower(), dataset.split, model.__class__.__name__, frozen_weights_key(model)[:12])
+
+
+def compute_feature_cache(model, dataset, path, device, batch_size=64, loader_args=None):
+    """
+        Run the frozen layers of the model (in eval mode, see train_mode) once over a dataset and write their activations
+        and the labels in memory-mapped float32 arrays. The index is written last: a cache without index is incomplete.
+    """
+    os.makedirs(path, exist_ok=True)
+    n = len(dataset)
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, **(loader_args or {}))
+    labels = np.memmap(os.path.join(path, 'labels.f32'), dtype=np.float32, mode='w+', shape=(n,))
+    arrays = None
+    start = 0
+    model.eval()
+    with torch.no_grad():
+        for x_batch, y_batch in loader:
+            features = frozen_features(model, to_device(x_batch, device))
+            if arrays is None:
+                arrays = [np.memmap(os.path.join(path, 'features_{}.f32'.format(i)), dtype=np.float32, mode='w+', shape=(n,) + tuple(feature.shape[1:])) for i, feature in enumerate(features)]
+            end = start + len(y_batch)
+            for array, feature in zip(arrays, features):
+                array[start:end] = feature.cpu().numpy()
+            labels[start:end] = y_batch.view(-1).numpy()
+            start = end
+    for array in arrays + [labels]:
+        array.flush()
+    index = {'count': n, 'shapes': [list(array.shape[1:]) for array in arrays]}
+    with open(os.path.join(path, INDEX + '.tmp'), 'w') as file:
+        json.dump(index, file)
+    os.replace(os.path.join(path, INDEX + '.tmp'), os.path.join(path, INDEX))
+
+
+class FeatureCache():
+    """
+        Activations of the frozen layers and labels of a dataset, written by compute_feature_cache.
+        Args:
+            - path: str, directory of the cache
+    """
+    def __init__(self, path):
+        with open(os.path.join(path, INDEX), 'r') as file:
+            index = json.load(file)
+        n = index['count']
+        self.features = [np.memmap(os.path.join(path, 'features_{}.f32'.format(i)), dtype=np.float32, mode='r', shape=(n,) + tuple(shape)) for i, shape in enumerate(index['shapes'])]
+        self.labels = np.memmap(os.path.join(path, 'labels.f32'), dtype=np.float32, mode='r', shape=(n,))
+
+    def __len__(self):
+        return len(self.labels)
+
+    def batch(self, rows, device):
+        """
+            Features and (N, 1) labels of the given rows, on the device.
+        """
+        features = tuple(torch.from_numpy(feature[rows]).to(device, non_blocking=True) for feature in self.features)
+        return features, torch.from_numpy(self.labels[rows]).view(-1, 1).to(device, non_blocking=True)
+
+
+def load_feature_cache(model, dataset, root, device, loader_args=None):
+    """
+        Feature cache of a dataset for the frozen layers of a model, computed if it does not exist yet.
+    """
+    path = os.path.join(root, cache_name(model, dataset))
+    if not os.path.isfile(os.path.join(path, INDEX)):
+        print('Computing the features of the frozen layers in {}'.format(path))
+        compute_feature_cache(model, dataset, path, device, loader_args=loader_args)
+    return FeatureCache(path)
+
+
+class FeatureLoader():
+    """
+        Training batches of cached features, drawn from one or several caches (multi-dataset training) as the
+        DataLoader would: shuffled, or sampled with replacement following per-instance weights.
+        Args:
+            - caches: list of FeatureCache
+            - batch_size: int, size of the batches
+            - device: torch device the batches are moved to
+            - weights: tensor of the sampling weight of each instance, in the order of the caches, or None
+    """
+    def __init__(self, caches, batch_size, device, weights=None):
+        self.caches = caches
+        self.offsets = np.cumsum([0] + [len(cache) for cache in caches])
+        self.batch_size = batch_size
+        self.device = device
+        self.weights = weights
+
+    def __len__(self):
+        return int(np.ceil(self.offsets[-1] / self.batch_size))
+
+    def __iter__(self):
+        n = int(self.offsets[-1])
+        if self.weights is None:
+            indices = torch.randperm(n).numpy()
+        else:
+            indices = torch.multinomial(self.weights, n, replacement=True).numpy()
+        for start in range(0, n, self.batch_size):
+            yield self.gather(indices[start:start+self.batch_size])
+
+    def gather(self, indices):
+        features, labels = [], []
+        for cache, offset in zip(self.caches, self.offsets):
+            # sorted rows: sequential reads of the memory-mapped arrays
+            rows = np.sort(indices[(indices >= offset) & (indices < offset + len(cache))] - offset)
+            if len(rows) != 0:
+                batch_features, batch_labels = cache.batch(rows, self.device)
+                features.append(batch_features)
+                labels.append(batch_labels)
+        features = tuple(torch.cat(feature) for feature in zip(*features))
+        return features, torch.cat(labels)
+
+
+def evaluate_cached(model, cache, device, it=1, batch_size=1024):
+    """
+        Same evaluation protocol as the evaluate method of the datasets (all the positive instances and as many random
+        negative ones, it times), with the predictions computed from the cached features.
+        Returns:
+            the mean AP and accuracy
+    """
+    model.eval()
+    predictions = []
+    with torch.no_grad():
+        for start in range(0, len(cache), batch_size):
+            features, _ = cache.batch(np.arange(start, min(start + batch_size, len(cache))), device)
+            predictions.append(head_forward(model, features).view(-1).cpu())
+    predictions = torch.cat(predictions)
+    labels = torch.from_numpy(np.array(cache.labels))
+    idx_Y1 = np.where(labels.numpy() == 1)[0]
+    idx_Y0 = np.where(labels.numpy() == 0)[0]
+    N_pos = len(idx_Y1)
+    aps = []
+    accs = []
+    for i in range(it):
+        np.random.seed(i)
+        np.random.shuffle(idx_Y0)
+        idx = np.concatenate((idx_Y1, idx_Y0[:N_pos]))
+        accs.append(binary_acc(predictions[idx], labels[idx]).item())
+        aps.append(average_precision(predictions[idx], labels[idx]))
+    return np.mean(aps), np.mean(accs)
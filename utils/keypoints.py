@@ -0,0 +1,119 @@
+import numpy as np
+
+
+def normalize_by_image_(X, Y, image_size):
+    """
+        Normalize the image according to the paper.
+        Args:
+            - X: array of X positions of the keypoints
+            - Y: array of Y positions of the keypoints
+            - Image: Image array
+        Returns:
+            returns the normalized arrays
+    """
+    
+    image_width, image_height = image_size
+    
+    center_p = (int((X[11] + X[12]) / 2), int((Y[11] + Y[12]) / 2))
+    X_new = np.array(X)/image_width
+    Y_new = np.array(Y)-center_p[1]
+
+
+    width = abs(np.max(X) - np.min(X))
+    height = abs(np.max(Y) - np.min(Y))
+
+    X_new = X_new + ((np.array(X)-center_p[0])/width)
+    Y_new /= height
+    
+    return X_new, Y_new
+
+
+def normalize_by_image_batch(keypoints, image_size):
+    """
+        Vectorized version of normalize_by_image_ for all the pedestrians of an image.
+        Args:
+            - keypoints: array of shape (N, 3, 17) with the X, Y positions and C confidences of the keypoints
+            - image_size: tuple, (width, height) of the image
+        Returns:
+            a float32 array of shape (N, 51) laid out as [X normalized, Y normalized, C], the input of the looking model
+    """
+    keypoints = np.asarray(keypoints, dtype=np.float64).reshape(-1, 3, 17)
+    image_width, _ = image_size
+    X, Y = keypoints[:, 0], keypoints[:, 1]
+
+    center_x = np.trunc((X[:, 11] + X[:, 12]) / 2)[:, None]
+    center_y = np.trunc((Y[:, 11] + Y[:, 12]) / 2)[:, None]
+    width = np.abs(X.max(axis=1) - X.min(axis=1))[:, None]
+    height = np.abs(Y.max(axis=1) - Y.min(axis=1))[:, None]
+
+    normalized = np.empty((len(keypoints), 51), dtype=np.float32)
+    normalized[:, :17] = X / image_width + (X - center_x) / width
+    normalized[:, 17:34] = (Y - center_y) / height
+    normalized[:, 34:] = keypoints[:, 2]
+    return normalized
+
+
+def prepare_pif_kps(kps_in):
+    """Convert from a list of 51 to a list of 3, 17"""
+
+    assert len(kps_in) % 3 == 0, "keypoints expected as a multiple of 3"
+    xxs = kps_in[0:][::3]
+    yys = kps_in[1:][::3]  # from offset 1 every 3
+    ccs = kps_in[2:][::3]
+
+    return [xxs, yys, ccs]
+
+
+def preprocess_pifpaf(annotations, im_size=None, enlarge_boxes=True, min_conf=0.):
+    """
+    Preprocess pif annotations:
+    1. enlarge the box of 10%
+    2. Constraint it inside the image (if image_size provided)
+    """
+
+    boxes = []
+    keypoints = []
+    enlarge = 1 if enlarge_boxes else 2  # Avoid enlarge boxes for social distancing
+
+    for dic in annotations:
+        kps = prepare_pif_kps(dic['keypoints'])
+        box = dic['bbox']
+        try:
+            conf = dic['score']
+            # Enlarge boxes
+            delta_h = (box[3]) / (10 * enlarge)
+            delta_w = (box[2]) / (5 * enlarge)
+            # from width height to corners
+            box[2] += box[0]
+            box[3] += box[1]
+
+        except KeyError:
+            all_confs = np.array(kps[2])
+            score_weights = np.ones(17)
+            score_weights[:3] = 3.0
+            score_weights[5:] = 0.1
+            # conf = np.sum(score_weights * np.sort(all_confs)[::-1])
+            conf = float(np.mean(all_confs))
+            # Add 15% for y and 20% for x
+            delta_h = (box[3] - box[1]) / (7 * enlarge)
+            delta_w = (box[2] - box[0]) / (3.5 * enlarge)
+            assert delta_h > -5 and delta_w > -5, "Bounding box <=0"
+
+        box[0] -= delta_w
+        box[1] -= delta_h
+        box[2] += delta_w
+        box[3] += delta_h
+
+        # Put the box inside the image
+        if im_size is not None:
+            box[0] = max(0, box[0])
+            box[1] = max(0, box[1])
+            box[2] = min(box[2], im_size[0])
+            box[3] = min(box[3], im_size[1])
+
+        if conf >= min_conf:
+            box.append(conf)
+            boxes.append(box)
+            keypoints.append(kps)
+
+    return boxes, keypoints
@@ -0,0 +1,111 @@
+import math
+
+import torch
+
+
+def sample_weights(lengths, ratios=None, temperature=math.inf):
+    """
+        Sampling weight of each instance of concatenated datasets, computed from their lengths only. The share of the
+        samples drawn from dataset i is proportional to ratios[i] * lengths[i] ** (1 / temperature): a temperature of
+        1 samples the instances uniformly, an infinite temperature gives the same share to each dataset.
+        Args:
+            - lengths: list of int, number of instances of each dataset
+            - ratios: list of float, relative share of each dataset, or None for equal ratios
+            - temperature: float, balancing temperature
+        Returns:
+            a tensor with the weight of each instance, in the order of the concatenation
+    """
+    assert all(length > 0 for length in lengths), "empty dataset"
+    assert temperature > 0, "the temperature must be positive"
+    if ratios is None:
+        ratios = [1.] * len(lengths)
+    assert len(ratios) == len(lengths), "one ratio per dataset is needed"
+    shares = [ratio * length ** (1. / temperature) for ratio, length in zip(ratios, lengths)]
+    total = sum(shares)
+    return torch.cat([torch.full((length,), share / total / length) for share, length in zip(shares, lengths)])
+
+
+def loader_args(config, device):
+    """
+        DataLoader options read from the [General] section of a config: number of workers, pinned memory, prefetch
+        factor and persistent workers. The datasets return cpu tensors, so the images can be decoded in worker
+        processes and the batches copied to the gpu asynchronously (see to_device).
+        Args:
+            - config: configparser section
+            - device: torch device the batches are moved to
+        Returns:
+            a dict of keyword arguments of torch.utils.data.DataLoader
+    """
+    num_workers = config.getint('num_workers', fallback=0)
+    args = {
+        'num_workers': num_workers,
+        'pin_memory': config.getboolean('pin_memory', fallback=False) and torch.device(device).type == 'cuda'
+    }
+    if num_workers > 0:
+        args['prefetch_factor'] = config.getint('prefetch_factor', fallback=2)
+        args['persistent_workers'] = config.getboolean('persistent_workers', fallback=False)
+    return args
+
+
+def to_device(batch, device):
+    """
+        Move a batch, a tensor or a tuple of tensors (e.g. heads+joints inputs), to the device. The copies from
+        pinned memory are asynchronous.
+    """
+    if isinstance(batch, (list, tuple)):
+        return type(batch)(to_device(tensor, device) for tensor in batch)
+    return batch.to(device, non_blocking=True)
+
+
+def joints_tensors(dataset):
+    """
+        Keypoints and labels of a joints dataset as two tensors.
+        Args:
+            - dataset: JAAD_Dataset, PIE_Dataset or LOOK_dataset_ of type joints
+        Returns:
+            the (N, input_size) keypoints and the (N, 1) float labels
+    """
+    assert dataset.type == 'joints', "only the joints datasets can be loaded as tensors"
+    joints, labels = dataset.get_joints()
+    if not torch.is_tensor(joints):
+        # PIE loads the keypoints of an instance when it is read, this is done once here
+        joints = torch.stack([dataset[i][0].cpu() for i in range(len(dataset))])
+    return joints.float(), labels.float().view(-1, 1)
+
+
+class JointsLoader():
+    """
+        Replacement of the DataLoader for the joints datasets: the keypoints and the labels of every instance are kept
+        in two tensors on the device and each batch is a single indexing of them, without any per-instance Python work.
+        Args:
+            - datasets: joints dataset or list of joints datasets, concatenated
+            - batch_size: int, size of the batches
+            - device: torch device the tensors are kept on
+            - weights: tensor of the sampling weight of each instance, or None for a shuffled epoch. As with the
+            WeightedRandomSampler, the weighted epochs are drawn with replacement.
+    """
+    def __init__(self, datasets, batch_size, device, weights=None):
+        if not isinstance(datasets, (list, tuple)):
+            datasets = [datasets]
+        tensors = [joints_tensors(dataset) for dataset in datasets]
+        self.X = torch.cat([joints for joints, _ in tensors]).to(device)
+        self.Y = torch.cat([labels for _, labels in tensors]).to(device)
+        self.batch_size = batch_size
+        self.device = device
+        self.weights = None
+        if weights is not None:
+            assert len(weights) == len(self.Y), "one weight per instance is needed"
+            self.weights = torch.as_tensor(weights, dtype=torch.float).to(device)
+
+    def __len__(self):
+        return math.ceil(len(self.Y) / self.batch_size)
+
+    def __iter__(self):
+        n = len(self.Y)
+        if self.weights is None:
+            indices = torch.randperm(n, device=self.device)
+        else:
+            indices = torch.multinomial(self.weights, n, replacement=True)
+        for start in range(0, n, self.batch_size):
+            batch = indices[start:start+self.batch_size]
+            yield self.X[batch], self.Y[batch]
@@ -0,0 +1,210 @@
+import os
+import csv
+import json
+import math
+import time
+import sys
+import threading
+
+# stages of the predictor and the keys of the frame timings they sum
+STAGES = [
+    ('load', ['read', 'cache', 'load']),
+    ('pifpaf', ['pifpaf_nn', 'pifpaf_decoder']),
+    ('preprocess', ['preprocess']),
+    ('looking_model', ['looking_model']),
+    ('render', ['render']),
+    ('write', ['write'])
+]
+QUANTILES = [0.5, 0.95, 0.99]
+
+
+class Histogram():
+    """
+        Fixed-memory histogram of durations in ms, with log-spaced buckets: the quantiles are exact up to the width of
+        a bucket (about 5 % with the default 50 buckets per decade), whatever the number of measurements.
+        Args:
+            - min_value: float, upper bound of the first bucket
+            - max_value: float, lower bound of the overflow bucket
+            - bins_per_decade: int, number of buckets per power of 10
+    """
+    def __init__(self, min_value=1e-3, max_value=1e6, bins_per_decade=50):
+        self.min_value = min_value
+        self.max_value = max_value
+        self.bins_per_decade = bins_per_decade
+        n_bins = int(math.ceil(math.log10(max_value / min_value) * bins_per_decade))
+        # underflow bucket, n_bins buckets, overflow bucket
+        self.counts = [0] * (n_bins + 2)
+        self.count = 0
+        self.total = 0.
+        self.min = math.inf
+        self.max = -math.inf
+
+    def bucket(self, value):
+        if value < self.min_value:
+            return 0
+        if value >= self.max_value:
+            return len(self.counts) - 1
+        return 1 + int(math.log10(value / self.min_value) * self.bins_per_decade)
+
+    def bucket_value(self, index):
+        """
+            Geometric middle of a bucket.
+        """
+        if index == 0:
+            return self.min_value
+        if index == len(self.counts) - 1:
+            return self.max_value
+        return self.min_value * 10 ** ((index - 0.5) / self.bins_per_decade)
+
+    def add(self, value):
+        self.counts[self.bucket(value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        if self.count == 0:
+            return 0.
+        rank = q * self.count
+        cumulated = 0
+        for index, count in enumerate(self.counts):
+            cumulated += count
+            if cumulated >= rank and count != 0:
+                return min(max(self.bucket_value(index), self.min), self.max)
+        return self.max
+
+    def summary(self):
+        summary = {
+            'count': self.count,
+            'mean': self.total / self.count if self.count != 0 else 0.,
+            'min': self.min if self.count != 0 else 0.,
+            'max': self.max if self.count != 0 else 0.
+        }
+        for q in QUANTILES:
+            summary['p{}'.format(int(q * 100))] = self.quantile(q)
+        return summary
+
+
+class StageMetrics():
+    """
+        Latency histograms of each stage of the predictor, fed with the timings (in ms) of each frame. The timings of
+        every frame are kept in its NDJSON record and optionally in a per-image CSV file.
+        Args:
+            - per_image_path: str, CSV file with the timings of each image, or None
+            - prometheus_path: str, text file rewritten with the metrics in the Prometheus format, or None. It is written
+            by a background thread, off the prediction loop, and a last time by close()
+            - prometheus_interval: float, seconds between two updates of the Prometheus file
+    """
+    def __init__(self, per_image_path=None, prometheus_path=None, prometheus_interval=10.):
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.n_frames = 0
+        self.prometheus_path = prometheus_path
+        self.prometheus_interval = prometheus_interval
+        self.per_image_file = None
+        if per_image_path is not None:
+            self.per_image_file = open(per_image_path, 'w', newline='')
+            self.per_image_writer = csv.writer(self.per_image_file)
+            self.per_image_writer.writerow(['image'] + [stage for stage, _ in STAGES] + ['total'])
+        self.stop = threading.Event()
+        self.exporter = None
+        if prometheus_path is not None:
+            self.exporter = threading.Thread(target=self._export, daemon=True)
+            self.exporter.start()
+
+    def _export(self):
+        while not self.stop.wait(self.prometheus_interval):
+            self.write_prometheus(self.prometheus_path)
+
+    def add(self, name, value):
+        """
+            Add a single measurement in ms, thread-safe.
+        """
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].add(value)
+
+    def attach(self, name, histogram):
+        """
+            Report a histogram filled elsewhere (e.g. the encoding times of the image writer).
+        """
+        if histogram.count != 0:
+            with self.lock:
+                self.histograms[name] = histogram
+
+    def add_frame(self, name, timings):
+        """
+            Add the timings of one frame: each stage is the sum of its timings, total the sum of every stage.
+        """
+        stages = [sum(timings.get(key, 0.) for key in keys) for _, keys in STAGES]
+        for (stage, keys), value in zip(STAGES, stages):
+            if any(key in timings for key in keys):
+                self.add(stage, value)
+        self.add('total', sum(stages))
+        self.n_frames += 1
+        if self.per_image_file is not None:
+            self.per_image_writer.writerow([name] + ['{:.3f}'.format(value) for value in stages] + ['{:.3f}'.format(sum(stages))])
+
+    def report(self):
+        with self.lock:
+            stages = {name: histogram.summary() for name, histogram in self.histograms.items()}
+        elapsed = time.perf_counter() - self.start
+        return {
+            'frames': self.n_frames,
+            'elapsed': elapsed,
+            'throughput': self.n_frames / elapsed if elapsed > 0 else 0.,
+            'stages': stages
+        }
+
+    def write_json(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.report(), file, indent=2)
+
+    def write_csv(self, path):
+        report = self.report()
+        columns = ['count', 'mean', 'min', 'max'] + ['p{}'.format(int(q * 100)) for q in QUANTILES]
+        with open(path, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['stage'] + columns)
+            for stage, summary in report['stages'].items():
+                writer.writerow([stage] + [summary[column] for column in columns])
+
+    def write_prometheus(self, path):
+        """
+            Write the metrics in the Prometheus text format, through a temporary file so that a scraper never reads a
+            partial file.
+        """
+        report = self.report()
+        lines = [
+            '# TYPE looking_frames_total counter',
+            'looking_frames_total {}'.format(report['frames']),
+            '# TYPE looking_throughput gauge',
+            'looking_throughput {:.3f}'.format(report['throughput']),
+            '# TYPE looking_stage_latency_ms summary'
+        ]
+        for stage, summary in report['stages'].items():
+            for q in QUANTILES:
+                lines.append('looking_stage_latency_ms{{stage="{}",quantile="{}"}} {:.3f}'.format(stage, q, summary['p{}'.format(int(q * 100))]))
+            lines.append('looking_stage_latency_ms_sum{{stage="{}"}} {:.3f}'.format(stage, summary['mean'] * summary['count']))
+            lines.append('looking_stage_latency_ms_count{{stage="{}"}} {}'.format(stage, summary['count']))
+        with open(path + '.tmp', 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        os.replace(path + '.tmp', path)
+
+    def print_summary(self, file=sys.stdout):
+        report = self.report()
+        print('{:<22} {:>8} {:>10} {:>10} {:>10} {:>10}'.format('Stage (ms)', 'count', 'mean', 'p50', 'p95', 'p99'), file=file)
+        for stage, summary in report['stages'].items():
+            print('{:<22} {:>8} {:>10.2f} {:>10.2f} {:>10.2f} {:>10.2f}'.format(stage, summary['count'], summary['mean'], summary['p50'], summary['p95'], summary['p99']), file=file)
+
+    def close(self):
+        if self.per_image_file is not None:
+            self.per_image_file.close()
+        if self.exporter is not None:
+            self.stop.set()
+            self.exporter.join()
+            self.exporter = None
+            self.write_prometheus(self.prometheus_path)
@@ -1,3 +1,6 @@
+import copy
+import sys
+
 import torch.nn as nn
 import torch
 import numpy as np
@@ -144,15 +147,97 @@ class Linear(nn.Module):
 
         return out
 
+def fold_batch_norm(linear, batch_norm):
+    """
+        Fold an eval-mode BatchNorm1d into the nn.Linear layer preceding it.
+        Args:
+            - linear: nn.Linear layer
+            - batch_norm: nn.BatchNorm1d applied on the output of linear
+        Returns:
+            a new nn.Linear computing batch_norm(linear(x)) with the running statistics of batch_norm
+    """
+    scale = batch_norm.weight.detach() / torch.sqrt(batch_norm.running_var + batch_norm.eps)
+    fused = nn.Linear(linear.in_features, linear.out_features)
+    with torch.no_grad():
+        fused.weight.copy_(linear.weight * scale[:, None])
+        fused.bias.copy_((linear.bias - batch_norm.running_mean) * scale + batch_norm.bias)
+    return fused
+
+
+class FusedLookingModel(nn.Module):
+    """
+    Inference-only version of the Looking Model: the BatchNorm layers are folded into the linear layers and the dropout
+    layers are removed, so each stage is a single linear layer followed by a ReLU. Build it with fuse_looking_model.
+    """
+    def __init__(self, w1, linear_stages, w2):
+        """
+        Args:
+            w1 (nn.Linear): First layer, batch_norm1 folded in.
+            linear_stages (list): (l1, l2) pairs of nn.Linear of each Linear block, bn1 and bn2 folded in.
+            w2 (nn.Linear): Output layer.
+        """
+        super(FusedLookingModel, self).__init__()
+        self.input_size = w1.in_features
+        self.w1 = w1
+        self.l1 = nn.ModuleList([l1 for l1, _ in linear_stages])
+        self.l2 = nn.ModuleList([l2 for _, l2 in linear_stages])
+        self.w2 = w2
+
+    def forward(self, x):
+        y = torch.relu(self.w1(x))
+        for l1, l2 in zip(self.l1, self.l2):
+            y = y + torch.relu(l2(torch.relu(l1(y))))
+        return torch.sigmoid(self.w2(y))
+
+
+def fuse_looking_model(model):
+    """
+        Fold the BatchNorm layers of a trained LookingModel into its linear layers.
+        Args:
+            - model: LookingModel
+        Returns:
+            the FusedLookingModel in eval mode, on the cpu
+    """
+    model = copy.deepcopy(model).cpu().eval()
+    w1 = fold_batch_norm(model.w1, model.batch_norm1)
+    linear_stages = [(fold_batch_norm(stage.l1, stage.bn1), fold_batch_norm(stage.l2, stage.bn2)) for stage in model.linear_stages]
+    w2 = nn.Linear(model.w2.in_features, model.w2.out_features)
+    w2.load_state_dict(model.w2.state_dict())
+    return FusedLookingModel(w1, linear_stages, w2).eval()
+
+
+def export_looking_model_npz(fused_model, path):
+    """
+        Write the weights of a FusedLookingModel to a flat .npz file, read by utils.numpy_runtime.NumpyLookingModel.
+    """
+    np.savez(path, **{name: value.detach().cpu().numpy() for name, value in fused_model.state_dict().items()})
+
+
+def check_fused_model(model, fused_model, n_samples=4096, tolerance=1e-5):
+    """
+        Compare the outputs of the original and of the fused model on random inputs.
+        Returns:
+            the maximum absolute difference between the two outputs
+    """
+    x = torch.randn(n_samples, fused_model.input_size)
+    model = copy.deepcopy(model).cpu().eval()
+    fused_model = copy.deepcopy(fused_model).cpu().eval()
+    with torch.no_grad():
+        max_diff = (model(x) - fused_model(x)).abs().max().item()
+    assert max_diff <= tolerance, "the fused model differs from the original one by {}".format(max_diff)
+    return max_diff
+
+
 class AlexNet_head(nn.Module):
     """
     Class definition of the AlexNet crops model (Rasouli et al.).
     """
-    def __init__(self, device, fine_tune=True):
+    def __init__(self, device, fine_tune=True, log=sys.stdout):
         """
         Args:
             device (torch device): PyTorch device 
             fine_tune (bool, optional): Use the finetuned model. Defaults to True.
+            log (file, optional): Stream of the logs. Defaults to sys.stdout.
         """
         super(AlexNet_head, self).__init__()
         net = models.alexnet(pretrained=fine_tune).to(device)
@@ -171,17 +256,18 @@ class AlexNet_head(nn.Module):
                 param.requires_grad = False
             for param in net.classifier.parameters():
                 param.requires_grad = True
-            print('Fine Tune : ', fine_tune)
+            print('Fine Tune : ', fine_tune, file=log)
         self.net = net
     def forward(self, x):
         return self.net(x)
 
 class ResNet18_head(nn.Module):
-    def __init__(self, device, fine_tune=True):
+    def __init__(self, device, fine_tune=True, log=sys.stdout):
         """
         Args:
             device (torch device): PyTorch device 
             fine_tune (bool, optional): Use the finetuned model. Defaults to True.
+            log (file, optional): Stream of the logs. Defaults to sys.stdout.
         """
         super(ResNet18_head, self).__init__()
         self.net = models.resnet18(pretrained=True)
@@ -194,17 +280,18 @@ class ResNet18_head(nn.Module):
                 param.requires_grad = False
             for param in self.net.fc.parameters():
                 param.requires_grad = True
-        print('Fine Tune : ', fine_tune)
+        print('Fine Tune : ', fine_tune, file=log)
 
     def forward(self, x):
         return self.net(x)
 
 class ResNet50_head(nn.Module):
-    def __init__(self, device, fine_tune=True):
+    def __init__(self, device, fine_tune=True, log=sys.stdout):
         """
         Args:
             device (torch device): PyTorch device 
             fine_tune (bool, optional): Use the finetuned model. Defaults to True.
+            log (file, optional): Stream of the logs. Defaults to sys.stdout.
         """
         super(ResNet50_head, self).__init__()
         net = models.resnext50_32x4d(pretrained=True)
@@ -218,7 +305,7 @@ class ResNet50_head(nn.Module):
             for param in net.fc.parameters():
                 param.requires_grad = True
         self.net = net
-        print('Fine Tune : ', fine_tune)
+        print('Fine Tune : ', fine_tune, file=log)
 
     def forward(self, x):
         return self.net(x)
@@ -0,0 +1,71 @@
+import numpy as np
+
+from utils.keypoints import normalize_by_image_batch, preprocess_pifpaf
+
+
+def sigmoid(x):
+    return 0.5 * (np.tanh(0.5 * x) + 1.)
+
+
+class NumpyLookingModel():
+    """
+        Torch-free inference of the Looking Model, for the deployments that already receive the keypoints. The weights
+        are read from the .npz file written by export_model.py --npz, where the BatchNorm layers are already folded into
+        the linear layers, so a forward pass is a few matrix products.
+        Args:
+            - path: str, .npz file of the fused model
+    """
+    def __init__(self, path):
+        with np.load(path) as weights:
+            # nn.Linear stores (out, in) weights, they are transposed once here
+            layer = lambda name: (np.ascontiguousarray(weights[name+'.weight'].T, dtype=np.float32), weights[name+'.bias'].astype(np.float32))
+            num_stage = len([key for key in weights.files if key.startswith('l1.') and key.endswith('.weight')])
+            self.w1 = layer('w1')
+            self.linear_stages = [(layer('l1.{}'.format(i)), layer('l2.{}'.format(i))) for i in range(num_stage)]
+            self.w2 = layer('w2')
+        self.input_size = self.w1[0].shape[0]
+
+    def forward(self, x):
+        """
+            Args:
+                - x: array of shape (N, input_size), the normalized keypoints
+            Returns:
+                the eye contact probabilities, array of shape (N,)
+        """
+        x = np.asarray(x, dtype=np.float32)
+        weight, bias = self.w1
+        y = np.maximum(x @ weight + bias, 0.)
+        for (weight_1, bias_1), (weight_2, bias_2) in self.linear_stages:
+            y = y + np.maximum(np.maximum(y @ weight_1 + bias_1, 0.) @ weight_2 + bias_2, 0.)
+        weight, bias = self.w2
+        return sigmoid(y @ weight + bias).reshape(-1)
+
+    def __call__(self, x):
+        return self.forward(x)
+
+    def predict_look(self, boxes, keypoints, im_size, batch_wise=True):
+        """
+            Same interface as Predictor.predict_look.
+            Args:
+                - boxes: list of the boxes of the pedestrians of an image
+                - keypoints: list of [X, Y, C] keypoints, one per pedestrian
+                - im_size: tuple, (width, height) of the image
+                - batch_wise: bool, score all the pedestrians with a single forward pass
+            Returns:
+                the eye contact probability of each pedestrian
+        """
+        if len(boxes) == 0:
+            return []
+        x = normalize_by_image_batch(keypoints, im_size)
+        if batch_wise:
+            return self.forward(x)
+        return np.concatenate([self.forward(x[i:i+1]) for i in range(len(x))])
+
+    def predict_pifpaf(self, annotations, im_size):
+        """
+            Score the pifpaf annotations (json_data format) of an image.
+            Returns:
+                the boxes, the keypoints and the eye contact probability of each pedestrian
+        """
+        boxes, keypoints = preprocess_pifpaf(annotations, im_size, enlarge_boxes=False)
+        return boxes, keypoints, self.predict_look(boxes, keypoints, im_size)
@@ -0,0 +1,151 @@
+import os
+import json
+import gzip
+import time
+import collections
+from glob import glob
+from concurrent.futures import ThreadPoolExecutor
+
+import PIL.Image
+
+KEYPOINTS_SUFFIX = '.predictions.json'
+STORE_SUFFIXES = ('.ndjson', '.ndjson.gz', '.jsonl', '.jsonl.gz')
+
+
+def list_pifpaf_files(paths):
+    """
+        Expand the input paths into the list of pifpaf outputs to read.
+        Args:
+            - paths: list of *.predictions.json files, of directories (searched recursively) or of consolidated stores
+        Returns:
+            the list of files, directories being sorted
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob(os.path.join(path, '**', '*'+KEYPOINTS_SUFFIX), recursive=True)))
+        else:
+            files.append(path)
+    return files
+
+
+def find_image(name, path_json, image_dir=None):
+    """
+        Look for the image a pifpaf output has been computed on, in image_dir first and then next to the json file.
+        Returns:
+            the path to the image or None
+    """
+    candidates = [os.path.join(os.path.dirname(path_json), name)]
+    if image_dir is not None:
+        candidates.insert(0, os.path.join(image_dir, name))
+    for candidate in candidates:
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def get_size(image_path, image_size=None):
+    """
+        Size of the image, either given or read from the header of the image file (the image is not decoded).
+    """
+    if image_size is not None:
+        return tuple(image_size)
+    if image_path is None:
+        raise ValueError('the image size is unknown, please give the images directory or the image size')
+    with PIL.Image.open(image_path) as image:
+        return image.size
+
+
+def read_pifpaf_file(path, image_dir=None, image_size=None):
+    """
+        Read one openpifpaf *.predictions.json file.
+        Returns:
+            (pred, meta, image) as given by utils_predict.iterate_pifpaf. The image is not loaded (None), its path is
+            kept in meta['image_path'] for the rendering
+    """
+    start = time.perf_counter()
+    with open(path, 'r') as file:
+        pred = json.load(file)
+    name = os.path.basename(path)
+    if name.endswith(KEYPOINTS_SUFFIX):
+        name = name[:-len(KEYPOINTS_SUFFIX)]
+    image_path = find_image(name, path, image_dir)
+    meta = {
+        'file_name': name,
+        'image_path': image_path,
+        'size': get_size(image_path, image_size),
+        'timings': {'read': (time.perf_counter() - start) * 1000}
+    }
+    return pred, meta, None
+
+
+def record_annotations(record):
+    """
+        pifpaf annotations of a record written by the predictor (--json-output), from its boxes and keypoints.
+        The boxes of the record have been enlarged by preprocess_pifpaf(enlarge_boxes=False): 20 % of the width and 10 %
+        of the height. They are shrunk back so that preprocess_pifpaf gives the same boxes again, clipped ones included.
+    """
+    annotations = []
+    for box, kps in zip(record['boxes'], record['keypoints']):
+        width, height = (box[2] - box[0]) / 1.2, (box[3] - box[1]) / 1.1
+        annotations.append({
+            'keypoints': [kps[row][i] for i in range(len(kps[0])) for row in range(3)],
+            'bbox': [box[0] + width / 10, box[1] + height / 20, width, height],
+            'score': box[4]
+        })
+    return annotations
+
+
+def read_pifpaf_store(path, image_dir=None, image_size=None):
+    """
+        Read a consolidated store of pifpaf outputs: a (gzipped) NDJSON file with one record per image, either
+        {"image": file name, "width": int, "height": int, "predictions": [pifpaf annotations]} or a record of the
+        predictor NDJSON output (--json-output) with its "boxes" and "keypoints".
+        Returns:
+            a generator of (pred, meta, image), see read_pifpaf_file
+    """
+    open_ = gzip.open if path.endswith('.gz') else open
+    with open_(path, 'rt') as file:
+        start = time.perf_counter()
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            # the records of the predictor keep the path of their image
+            name = record.get('path', record['image'])
+            image_path = find_image(name, path, image_dir)
+            if image_size is None and 'width' in record:
+                size = (record['width'], record['height'])
+            else:
+                size = get_size(image_path, image_size)
+            meta = {
+                'file_name': name,
+                'image_path': image_path,
+                'size': size,
+                'timings': {'read': (time.perf_counter() - start) * 1000}
+            }
+            pred = record['predictions'] if 'predictions' in record else record_annotations(record)
+            yield pred, meta, None
+            start = time.perf_counter()
+
+
+def read_pifpaf_outputs(paths, image_dir=None, image_size=None, n_workers=8, window=256):
+    """
+        Stream the pifpaf outputs of single files, directories or consolidated stores, in order.
+        The single files are read by a pool of threads, at most window files ahead.
+        Returns:
+            a generator of (pred, meta, image), see read_pifpaf_file
+    """
+    with ThreadPoolExecutor(n_workers) as executor:
+        futures = collections.deque()
+        for path in list_pifpaf_files(paths):
+            if path.endswith(STORE_SUFFIXES):
+                while futures:
+                    yield futures.popleft().result()
+                yield from read_pifpaf_store(path, image_dir, image_size)
+                continue
+            futures.append(executor.submit(read_pifpaf_file, path, image_dir, image_size))
+            if len(futures) >= window:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
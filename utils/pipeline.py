@@ -0,0 +1,133 @@
+import threading
+import queue
+
+_SENTINEL = object()
+
+
+class Pipeline():
+    """
+        Runs a chain of stages concurrently. Each stage has its own pool of worker threads and the stages are
+        connected by bounded queues, so that a slow stage applies back-pressure instead of buffering the whole input.
+        The outputs are given back in the order of the input. The number of items in flight (queued, being processed
+        or waiting in the reorder buffer) is bounded as well: if the oldest item is slow, the source is not read
+        further than max_ahead items after it.
+        Args:
+            - stages: list of (function, n_workers) tuples. Each function maps the output of the previous stage to its own output
+            - queue_size: int, capacity of each queue between two stages
+            - max_ahead: int, maximum number of items in flight, by default enough to fill every queue and worker
+    """
+    def __init__(self, stages, queue_size=8, max_ahead=None):
+        assert len(stages) > 0, "the pipeline needs at least one stage"
+        self.stages = [(function, max(1, int(n_workers))) for function, n_workers in stages]
+        self.queue_size = queue_size
+        if max_ahead is None:
+            max_ahead = queue_size * (len(self.stages) + 1) + sum(n_workers for _, n_workers in self.stages)
+        self.max_ahead = max_ahead
+
+    def run(self, source):
+        """
+            Generator feeding the items of source through every stage.
+            The first exception raised by a stage (or by source) is raised again here. The threads are stopped and
+            joined when the generator ends, raises or is closed.
+        """
+        queues = [queue.Queue(self.queue_size) for _ in range(len(self.stages) + 1)]
+        slots = threading.Semaphore(self.max_ahead)
+        stop = threading.Event()
+
+        threads = [threading.Thread(target=self._feed, args=(source, queues[0], self.stages[0][1], slots, stop), daemon=True)]
+        for i, (function, n_workers) in enumerate(self.stages):
+            n_next = self.stages[i+1][1] if i+1 < len(self.stages) else 1
+            finished = [0]
+            lock = threading.Lock()
+            for _ in range(n_workers):
+                threads.append(threading.Thread(target=self._work, args=(function, queues[i], queues[i+1], n_workers, n_next, finished, lock, stop), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        # reorder buffer, the workers of a stage can finish out of order
+        buffer = {}
+        next_idx = 0
+        try:
+            while True:
+                item = queues[-1].get()
+                if item is _SENTINEL:
+                    break
+                idx, value, error = item
+                if error is not None:
+                    raise error
+                buffer[idx] = value
+                while next_idx in buffer:
+                    value = buffer.pop(next_idx)
+                    next_idx += 1
+                    slots.release()
+                    yield value
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+    @staticmethod
+    def _put(q, item, stop):
+        """
+            Blocking put that gives up when the pipeline is stopped. Returns False if the item was not put.
+        """
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    @staticmethod
+    def _get(q, stop):
+        """
+            Blocking get that returns the sentinel when the pipeline is stopped.
+        """
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _SENTINEL
+
+    @staticmethod
+    def _feed(source, q_out, n_workers, slots, stop):
+        idx = 0
+        try:
+            for value in source:
+                while not slots.acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+                if not Pipeline._put(q_out, (idx, value, None), stop):
+                    return
+                idx += 1
+        except Exception as e:
+            Pipeline._put(q_out, (idx, None, e), stop)
+            return
+        for _ in range(n_workers):
+            if not Pipeline._put(q_out, _SENTINEL, stop):
+                return
+
+    @staticmethod
+    def _work(function, q_in, q_out, n_workers, n_next, finished, lock, stop):
+        while True:
+            item = Pipeline._get(q_in, stop)
+            if item is _SENTINEL:
+                break
+            idx, value, error = item
+            if error is None:
+                try:
+                    value = function(value)
+                except Exception as e:
+                    value, error = None, e
+            if not Pipeline._put(q_out, (idx, value, error), stop):
+                return
+        if stop.is_set():
+            return
+        # the last worker of the stage to stop closes the next stage
+        with lock:
+            finished[0] += 1
+            if finished[0] == n_workers:
+                for _ in range(n_next):
+                    Pipeline._put(q_out, _SENTINEL, stop)
@@ -1,37 +1,123 @@
-import configparser
 import os, errno
-import seaborn as sns
-import matplotlib.pyplot as plt
+import sys
 import copy
+import queue
 import argparse
+import threading
 import PIL
-from zipfile import ZipFile
 from glob import glob
 from tqdm import tqdm
-import openpifpaf.datasets as datasets
 import time
 
-from utils.dataset import *
 from utils.network import *
 from utils.utils_predict import *
+from utils.pipeline import Pipeline
+from utils.writer import ImageWriterPool, VideoWriterSink, ResultsWriter
+from utils.video import VideoReader
+from utils.tracker import Tracker
+from utils.pifpaf_io import read_pifpaf_outputs
+from utils.cache import PifpafCache
+from utils.crops import HeadCropper, PilHeadCropper, HEAD_CROPS
+from utils.metrics import StageMetrics
 
 from PIL import Image, ImageFile
 
 DOWNLOAD = None
 INPUT_SIZE=51
-FONT = cv2.FONT_HERSHEY_SIMPLEX
 
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
-print('OpenPifPaf version', openpifpaf.__version__)
-print('PyTorch version', torch.__version__)
+
+def cli(prog='python3 predict'):
+    """
+        Command line arguments of the predictor.
+    """
+    from openpifpaf import decoder, logger, network, show, visualizer
+    parser = argparse.ArgumentParser(prog=prog, usage='%(prog)s [options] images', description=__doc__, formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--version', action='version',version='Looking Model {version}'.format(version=0.1))
+    parser.add_argument('--images', nargs='*',help='input images')
+    parser.add_argument('--transparency', default=0.4, type=float, help='transparency of the overlayed poses')
+    parser.add_argument('--looking_threshold', default=0.5, type=float, help='eye contact threshold')
+    parser.add_argument('--mode', default='joints', type=str, help='prediction mode')
+    parser.add_argument('--head_crops', default='pil', choices=HEAD_CROPS, help='extraction of the head crops in the heads modes: the PIL transform of the training, or a single batched ROI-align (faster, approximate)')
+    parser.add_argument('--fuse', action='store_true', help='fold the BatchNorm layers of the looking model into its linear layers')
+    parser.add_argument('--looking_model', default=None, type=str, help='fused TorchScript looking model written by export_model.py, replaces the default one')
+    parser.add_argument('--quantize', default=None, choices=['dynamic', 'static'], help='int8 quantization of the looking model, on the cpu only')
+    parser.add_argument('--calibration', nargs='*', help='calibration data of the static quantization: pifpaf outputs in joints mode, directory of head crops in alexnet mode')
+    parser.add_argument('--calibration_samples', default=256, type=int, help='number of pedestrians used for the static quantization')
+    parser.add_argument('--quantize_backend', default='fbgemm', choices=['fbgemm', 'qnnpack'], help='quantized engine, fbgemm on x86 and qnnpack on ARM')
+    parser.add_argument('--time', action='store_true', help='track comptutational time')
+    parser.add_argument('--metrics', default=None, type=str, help='write the p50/p95/p99 latency of each stage to this file, CSV if it ends with .csv, JSON otherwise')
+    parser.add_argument('--metrics_per_image', default=None, type=str, help='write the latency of each stage for each image to this CSV file')
+    parser.add_argument('--metrics_prometheus', default=None, type=str, help='text file regularly rewritten with the metrics in the Prometheus format, for long runs')
+    parser.add_argument('--metrics_interval', default=10., type=float, help='seconds between two updates of the Prometheus file')
+    parser.add_argument('--glob', help='glob expression for input images (for many images)')
+    parser.add_argument('--video', nargs='*', help='input videos, or index of a capture device (e.g. 0)')
+    parser.add_argument('--frame_stride', default=1, type=int, help='process one video frame every frame_stride frames')
+    parser.add_argument('--start_time', default=None, type=float, help='time in seconds of the first video frame to process')
+    parser.add_argument('--end_time', default=None, type=float, help='time in seconds of the last video frame to process')
+    parser.add_argument('--keypoints', nargs='*', help='skip pifpaf and read its outputs: *.predictions.json files, directories or consolidated NDJSON stores, such as the --json-output records')
+    parser.add_argument('--keypoints_images', default=None, help='directory of the images of the pifpaf outputs, used for the image size and the rendering')
+    parser.add_argument('--image_size', default=None, nargs=2, type=int, help='width and height of the images of the pifpaf outputs, avoids opening the images')
+    parser.add_argument('--keypoints_workers', default=8, type=int, help='number of threads reading the pifpaf outputs')
+    parser.add_argument('--cache', default=None, help='directory of the on-disk cache of the pifpaf outputs')
+    parser.add_argument('--cache_size', default=1024, type=float, help='maximum size of the pifpaf cache in MB, the least recently used entries are evicted')
+    parser.add_argument('--track', action='store_true', help='track the pedestrians across consecutive frames of a video, reuse and smooth their eye contact scores')
+    parser.add_argument('--track_iou', default=0.3, type=float, help='minimum IoU to link a pedestrian to a track')
+    parser.add_argument('--track_kps_distance', default=0.2, type=float, help='maximum keypoints distance, relative to the box height, to link a pedestrian to a track')
+    parser.add_argument('--track_tolerance', default=0.02, type=float, help='maximum keypoints displacement, relative to the box height, to reuse the score of a track')
+    parser.add_argument('--track_window', default=5, type=int, help='number of frames of the smoothing window of the eye contact scores')
+    parser.add_argument('--track_max_missed', default=5, type=int, help='number of frames a track is kept without detection')
+    parser.add_argument('--look_batch_size', default=0, type=int, help='score the pedestrians of several images in one forward pass, up to this many pedestrians (0 disables micro-batching), joints mode only')
+    parser.add_argument('--look_batch_deadline', default=50., type=float, help='maximum time in ms an image waits for the micro-batch to fill up')
+    parser.add_argument('--pipeline', action='store_true', help='run pifpaf, the looking model and the rendering concurrently')
+    parser.add_argument('--look_workers', default=1, type=int, help='number of looking model threads in pipelined mode')
+    parser.add_argument('--render_workers', default=2, type=int, help='number of rendering threads in pipelined mode')
+    parser.add_argument('--queue_size', default=8, type=int, help='capacity of the queues between the stages in pipelined mode')
+    parser.add_argument('--writer_workers', default=2, type=int, help='number of background threads encoding the output images')
+    parser.add_argument('--writer_queue_size', default=16, type=int, help='maximum number of output images waiting to be encoded')
+    parser.add_argument('--image_format', default='png', choices=['png', 'jpg'], help='format of the output images')
+    parser.add_argument('--png_compression', default=1, type=int, help='PNG compression level, from 0 (fastest) to 9 (smallest)')
+    parser.add_argument('--jpeg_quality', default=95, type=int, help='JPEG quality, from 0 to 100')
+
+    # Pifpaf args
+
+    parser.add_argument('-o', '--image-output', default=None, nargs='?', const=True, help='Whether to output an image, with the option to specify the output path or directory')
+    parser.add_argument('--json-output', default=None, nargs='?', const=True,help='Whether to output the results as NDJSON (one record per image), with the option to specify the output file or - for the standard output')
+    parser.add_argument('--json_gzip', action='store_true', help='gzip the NDJSON output')
+    parser.add_argument('--no_render', action='store_true', help='do not render the output images')
+    parser.add_argument('--shards', default=0, type=int, help='split the input images across this number of worker processes (0 to disable)')
+    parser.add_argument('--shard_dir', default='./output/shards', type=str, help='directory of the shard outputs, run the same command again to resume the failed shards')
+    parser.add_argument('--shard_threads', default=None, type=int, help='number of torch threads of each worker process, defaults to the number of cores divided by the number of shards')
+    parser.add_argument('--shard_devices', default=None, nargs='*', help='devices of the worker processes, assigned round-robin (e.g. 0 1 2 3)')
+    parser.set_defaults(json_append=False)
+    parser.add_argument('--batch_size', default=1, type=int, help='number of images in a batch of pifpaf, the images of different sizes are padded at the bottom and on the right')
+    parser.add_argument('--benchmark_batch_sizes', default=None, nargs='*', type=int, help='time pifpaf on the input images with each of these batch sizes before predicting (e.g. 1 4 8 16)')
+    parser.add_argument('--device', default='0', type=str, help='cuda device')
+    parser.add_argument('--long-edge', default=None, type=int, help='rescale the long side of the image (aspect ratio maintained)')
+    parser.add_argument('--loader-workers', default=None, type=int, help='number of workers for data loading')
+    parser.add_argument('--precise-rescaling', dest='fast_rescaling', default=True, action='store_false', help='use more exact image rescaling (requires scipy)')
+    parser.add_argument('--checkpoint_', default='shufflenetv2k30', type=str, help='backbone model to use')
+    parser.add_argument('--disable-cuda', action='store_true', help='disable CUDA')
+
+    decoder.cli(parser)
+    logger.cli(parser)
+    network.Factory.cli(parser)
+    show.cli(parser)
+    visualizer.cli(parser)
+    return parser
 
 
 class Predictor():
     """
         Class definition for the predictor.
+        Args:
+            - args: parsed arguments of cli()
+            - pifpaf_ver: str, pifpaf checkpoint
+            - outputs: bool, set up the outputs of predict() (output directory, image writers, NDJSON results, metrics).
+            Disabled when only the models are used, e.g. by the server
     """
-    def __init__(self, args, pifpaf_ver='shufflenetv2k30'):
+    def __init__(self, args, pifpaf_ver='shufflenetv2k30', outputs=True):
         device = args.device
         args.checkpoint = pifpaf_ver
         args.force_complete_pose = True
@@ -41,10 +127,32 @@ class Predictor():
         else:
             self.device = torch.device('cpu')
         args.device = self.device
-        print('device : {}'.format(self.device))
+        # the standard output is kept for the records when they are written to it
+        self.log = sys.stderr if args.json_output == '-' else sys.stdout
+        import openpifpaf
+        print('OpenPifPaf version', openpifpaf.__version__, file=self.log)
+        print('PyTorch version', torch.__version__, file=self.log)
+        print('device : {}'.format(self.device), file=self.log)
         self.path_images = args.images
         #self.net, self.processor, self.preprocess = load_pifpaf(args)
-        self.predictor_ = load_pifpaf(args)
+        if args.keypoints is not None:
+            # the keypoints are read from existing pifpaf outputs
+            self.predictor_ = None
+        else:
+            self.predictor_ = load_pifpaf(args, self.log)
+        self.cache = None
+        if args.cache is not None and self.predictor_ is not None:
+            settings = {
+                'openpifpaf': openpifpaf.__version__,
+                'checkpoint': args.checkpoint_,
+                'instance_threshold': args.instance_threshold,
+                'keypoint_threshold': args.keypoint_threshold,
+                'keypoint_threshold_rel': args.keypoint_threshold_rel,
+                'force_complete_pose': args.force_complete_pose,
+                'long_edge': args.long_edge,
+                'fast_rescaling': args.fast_rescaling
+            }
+            self.cache = PifpafCache(args.cache, settings, args.cache_size)
         self.path_model = './models/predictor'
         try:
             os.makedirs(self.path_model)
@@ -52,23 +160,66 @@ class Predictor():
             if e.errno != errno.EEXIST:
                 raise
         self.mode = args.mode
+        self.fuse = args.fuse
+        self.looking_model = args.looking_model
         self.model = self.get_model().to(self.device)
-        if args.image_output is None:
-            self.path_out = './output'
-            self.path_out = filecreation(self.path_out)
-        else:
-            self.path_out = args.image_output
+        if args.quantize is not None:
+            assert self.device.type == 'cpu', "the quantized models only run on the cpu, please use --device cpu"
+            assert self.looking_model is None, "the TorchScript looking model can not be quantized"
+            self.model = self.quantize_model(args)
+        if self.mode != 'joints':
+            if args.head_crops == 'roi_align':
+                self.head_cropper = HeadCropper(self.device)
+            else:
+                self.head_cropper = PilHeadCropper(self.device, self.get_head_transform())
         self.track_time = args.time
-        if self.track_time:
-            self.pifpaf_time = []
-            self.inference_time = []
-            self.total_time = []
+        self.look_batch_size = args.look_batch_size
+        self.look_batch_deadline = args.look_batch_deadline / 1000.
+        self.pipeline = args.pipeline
+        self.look_workers = args.look_workers
+        self.render_workers = args.render_workers
+        self.queue_size = args.queue_size
+        assert not (self.pipeline and self.look_batch_size > 0), "micro-batching is not supported in pipelined mode"
+        assert self.mode == 'joints' or self.look_batch_size == 0, "micro-batching (--look_batch_size) is only supported in joints mode"
+        self.outputs = outputs
+        self.path_out = None
+        self.writer = None
+        self.video_sinks = {}
+        self.render = not args.no_render
+        self.results_writer = None
+        self.metrics = None
+        if outputs:
+            if args.image_output is None:
+                self.path_out = './output'
+                self.path_out = filecreation(self.path_out)
+            else:
+                self.path_out = args.image_output
+            self.writer = ImageWriterPool(args.writer_workers, args.writer_queue_size, args.image_format, args.png_compression, args.jpeg_quality)
+            if args.json_output is not None:
+                json_output = args.json_output
+                if json_output is True:
+                    json_output = self.path_out
+                if os.path.isdir(json_output):
+                    json_output = os.path.join(json_output, 'predictions.ndjson')
+                self.results_writer = ResultsWriter(json_output, args.json_gzip, args.json_append)
+            self.metrics = StageMetrics(args.metrics_per_image, args.metrics_prometheus, args.metrics_interval)
+        self.tracker = None
+        if args.track:
+            assert self.look_batch_size == 0, "micro-batching is not supported with the tracker"
+            assert not self.pipeline or self.look_workers == 1, "the tracker needs a single looking model thread in pipelined mode"
+            self.tracker = Tracker(args.track_iou, args.track_kps_distance, args.track_tolerance, args.track_window, args.track_max_missed)
+            self.tracked_video = None
+        self.n_frames = 0
 
     
     def get_model(self):
         if self.mode == 'joints':
+            if self.looking_model is not None:
+                model = torch.jit.load(self.looking_model, map_location=self.device)
+                model.eval()
+                return model
             model = LookingModel(INPUT_SIZE)
-            print(self.device)
+            print(self.device, file=self.log)
             if not os.path.isfile(os.path.join(self.path_model, 'LookingModel_LOOK+PIE.p')):
                 """
                 DOWNLOAD(LOOKING_MODEL, os.path.join(self.path_model, 'Looking_Model.zip'), quiet=False)
@@ -79,8 +230,11 @@ class Predictor():
                 raise NotImplementedError
             model.load_state_dict(torch.load(os.path.join(self.path_model, 'LookingModel_LOOK+PIE.p'), map_location=self.device))
             model.eval()
+            if self.fuse:
+                model = fuse_looking_model(model)
         else:
-            model = AlexNet_head(self.device)
+            # the weights are loaded just below, the layers are not frozen for inference
+            model = AlexNet_head(self.device, fine_tune=False, log=self.log)
             if not os.path.isfile(os.path.join(self.path_model, 'AlexNet_LOOK.p')):
                 """
                 DOWNLOAD(LOOKING_MODEL, os.path.join(self.path_model, 'Looking_Model.zip'), quiet=False)
@@ -93,100 +247,86 @@ class Predictor():
             model.eval()
         return model
 
-    def predict_look(self, boxes, keypoints, im_size, batch_wise=True):
-        label_look = []
-        final_keypoints = []
-        if batch_wise:
-            if len(boxes) != 0:
-                for i in range(len(boxes)):
-                    kps = keypoints[i]
-                    kps_final = np.array([kps[0], kps[1], kps[2]]).flatten().tolist()
-                    X, Y = kps_final[:17], kps_final[17:34]
-                    X, Y = normalize_by_image_(X, Y, im_size)
-                    #X, Y = normalize(X, Y, divide=True, height_=False)
-                    kps_final_normalized = np.array([X, Y, kps_final[34:]]).flatten().tolist()
-                    final_keypoints.append(kps_final_normalized)
-                tensor_kps = torch.Tensor([final_keypoints]).to(self.device)
-                if self.track_time:
-                    start = time.time()
-                    out_labels = self.model(tensor_kps.squeeze(0)).detach().cpu().numpy().reshape(-1)
-                    end = time.time()
-                    self.inference_time.append(end-start)
-                else:
-                    out_labels = self.model(tensor_kps.squeeze(0)).detach().cpu().numpy().reshape(-1)
-            else:
-                out_labels = []
+    def quantize_model(self, args):
+        """
+            Int8 quantization of the looking model, the static quantization is calibrated on args.calibration.
+        """
+        from utils.quantization import quantize_dynamic, quantize_static, load_calibration_crops, load_calibration_keypoints
+        if args.quantize == 'dynamic':
+            assert self.mode == 'joints', "dynamic quantization only speeds up the joints model, please use --quantize static"
+            return quantize_dynamic(self.model)
+        assert args.calibration, "the static quantization needs calibration data, please use --calibration"
+        if self.mode == 'joints':
+            outputs = read_pifpaf_outputs(args.calibration, args.keypoints_images, args.image_size, args.keypoints_workers)
+            batches = load_calibration_keypoints(outputs, args.calibration_samples)
         else:
-            if len(boxes) != 0:
-                for i in range(len(boxes)):
-                    kps = keypoints[i]
-                    kps_final = np.array([kps[0], kps[1], kps[2]]).flatten().tolist()
-                    X, Y = kps_final[:17], kps_final[17:34]
-                    X, Y = normalize_by_image_(X, Y, im_size)
-                    #X, Y = normalize(X, Y, divide=True, height_=False)
-                    kps_final_normalized = np.array([X, Y, kps_final[34:]]).flatten().tolist()
-                    #final_keypoints.append(kps_final_normalized)
-                    tensor_kps = torch.Tensor(kps_final_normalized).to(self.device)
-                    if self.track_time:
-                        start = time.time()
-                        out_labels = self.model(tensor_kps.unsqueeze(0)).detach().cpu().numpy().reshape(-1)
-                        end = time.time()
-                        self.inference_time.append(end-start)
-                    else:
-                        out_labels = self.model(tensor_kps.unsqueeze(0)).detach().cpu().numpy().reshape(-1)
-            else:
-                out_labels = []
-        return out_labels
-    
-    def predict_look_alexnet(self, boxes, image, batch_wise=True):
-        out_labels = []
-        data_transform = transforms.Compose([
+            batches = load_calibration_crops(args.calibration[0], self.get_head_transform(), args.calibration_samples)
+        return quantize_static(self.model, batches, args.quantize_backend)
+
+    def get_head_transform(self):
+        return transforms.Compose([
                         SquarePad(),
                         transforms.Resize((227,227)),
                     transforms.ToTensor(),
                         transforms.Normalize(mean=[0.485, 0.456, 0.406],
                                             std=[0.229, 0.224, 0.225])])
-        if len(boxes) != 0:
-            if batch_wise:
-                heads = []
-                for i in range(len(boxes)):
-                    bbox = boxes[i]
-                    x1, y1, x2, y2, _ = bbox
-                    w, h = abs(x2-x1), abs(y2-y1)
-                    head_image = Image.fromarray(np.array(image)[int(y1):int(y1+(h/3)), int(x1):int(x2), :])
-                    head_tensor = data_transform(head_image)
-                    heads.append(head_tensor.detach().cpu().numpy())
-                if self.track_time:
-                    start = time.time()
-                    out_labels = self.model(torch.Tensor([heads]).squeeze(0).to(self.device)).detach().cpu().numpy().reshape(-1)
-                    end = time.time()
-                    self.inference_time.append(end-start)
-            else:
-                out_labels = []
-                for i in range(len(boxes)):
-                    bbox = boxes[i]
-                    x1, y1, x2, y2, _ = bbox
-                    w, h = abs(x2-x1), abs(y2-y1)
-                    head_image = Image.fromarray(np.array(image)[int(y1):int(y1+(h/3)), int(x1):int(x2), :])
-                    head_tensor = data_transform(head_image)
-                    #heads.append(head_tensor.detach().cpu().numpy())
-                    if self.track_time:
-                        start = time.time()
-                        looking_label = self.model(torch.Tensor(head_tensor).unsqueeze(0).to(self.device)).detach().cpu().numpy().reshape(-1)[0]
-                        end = time.time()
-                        self.inference_time.append(end-start)
-                    else:
-                        looking_label = self.model(torch.Tensor(head_tensor).unsqueeze(0).to(self.device)).detach().cpu().numpy().reshape(-1)[0]
-                    out_labels.append(looking_label)
-                #if self.track_time:
-                #    out_labels = self.model(torch.Tensor([heads]).squeeze(0).to(self.device)).detach().cpu().numpy().reshape(-1)
-        else:
-            out_labels = []
+
+    def get_look_input(self, keypoints, im_size):
+        """
+            Normalize the keypoints of one image and stack them into the input tensor of the looking model.
+            Args:
+                - keypoints: list of [X, Y, C] keypoints, one per pedestrian
+                - im_size: tuple, (width, height) of the image
+            Returns:
+                a (N, 51) float32 tensor on the cpu
+        """
+        if len(keypoints) == 0:
+            return torch.zeros((0, INPUT_SIZE))
+        return torch.from_numpy(normalize_by_image_batch(keypoints, im_size))
+
+    def forward_look(self, tensor_kps):
+        """
+            Run the looking model on a batch of inputs, (N, 51) normalized keypoints or (N, 3, 227, 227) head crops,
+            and return the scores as a numpy array.
+        """
+        if len(tensor_kps) == 0:
+            return np.zeros(0, dtype=np.float32)
+        tensor_kps = tensor_kps.to(self.device)
+        start = time.perf_counter()
+        with torch.no_grad():
+            out_labels = self.model(tensor_kps).detach().cpu().numpy().reshape(-1)
+        # no metrics when the predictor is created without outputs, e.g. by the server
+        if self.metrics is not None:
+            self.metrics.add('looking_model_forward', (time.perf_counter() - start) * 1000)
         return out_labels
+
+    def predict_look(self, boxes, keypoints, im_size, batch_wise=True):
+        if len(boxes) == 0:
+            return []
+        tensor_kps = self.get_look_input(keypoints, im_size)
+        if batch_wise:
+            return self.forward_look(tensor_kps)
+        return np.concatenate([self.forward_look(tensor_kps[i:i+1]) for i in range(len(tensor_kps))])
+    
+    def predict_look_alexnet(self, boxes, image, batch_wise=True):
+        if len(boxes) == 0:
+            return []
+        heads = self.head_cropper(image, boxes)
+        if batch_wise:
+            return self.forward_look(heads)
+        return np.concatenate([self.forward_look(heads[i:i+1]) for i in range(len(heads))])
     
     def render_image(self, image, bbox, keypoints, pred_labels, image_name, transparency, eyecontact_thresh):
-        open_cv_image = np.array(image) 
-        open_cv_image = open_cv_image[:, :, ::-1].copy()
+        open_cv_image = self.draw_image(image, keypoints, pred_labels, transparency, eyecontact_thresh)
+        return self.writer.write(os.path.join(self.path_out, image_name[:-4]+'.predictions'), open_cv_image)
+
+    def draw_image(self, image, keypoints, pred_labels, transparency, eyecontact_thresh):
+        """
+            Overlay the predicted poses on the image. Returns the BGR image.
+        """
+        import cv2
+        # single conversion of the decoded RGB image to a BGR canvas
+        open_cv_image = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
         
         scale = 0.007
         imageWidth, imageHeight, _ = open_cv_image.shape
@@ -205,52 +345,392 @@ class Predictor():
         mask = cv2.GaussianBlur(mask,(3,3),0)
         #open_cv_image = cv2.addWeighted(open_cv_image, 0.5, np.ones(open_cv_image.shape, dtype=np.uint8)*255, 0.5, 1.0)
         #open_cv_image = cv2.addWeighted(open_cv_image, 0.5, np.zeros(open_cv_image.shape, dtype=np.uint8), 0.5, 1.0)
-        open_cv_image = cv2.addWeighted(open_cv_image, 1, mask, transparency, 1.0)
-        cv2.imwrite(os.path.join(self.path_out, image_name[:-4]+'.predictions.png'), open_cv_image)
+        return cv2.addWeighted(open_cv_image, 1, mask, transparency, 1.0, dst=open_cv_image)
+
+
+    def get_frame(self, pred_batch, meta_batch, cpu_image):
+        """
+            Gather the image and the preprocessed pifpaf outputs of one image in a frame dictionary.
+            The image is the one already decoded by the pifpaf loader, or None if it has not been loaded yet.
+        """
+        start = time.perf_counter()
+        im_size = meta_batch['size'] if cpu_image is None else get_image_size(cpu_image)
+        boxes, keypoints = preprocess_pifpaf(pred_batch, im_size, enlarge_boxes=False)
+        frame = {
+            'name': os.path.basename(meta_batch['file_name']),
+            'path': meta_batch['file_name'],
+            'image': cpu_image,
+            'image_path': meta_batch.get('image_path'),
+            'size': im_size,
+            'boxes': boxes,
+            'keypoints': keypoints,
+            'timings': dict(meta_batch.get('timings', {}))
+        }
+        frame['timings']['preprocess'] = (time.perf_counter() - start) * 1000
+        if 'video' in meta_batch:
+            for key in ['video', 'frame_index', 'timestamp', 'fps']:
+                frame[key] = meta_batch[key]
+        return frame
+
+    def process_frame(self, item):
+        """
+            Run the looking model on the pifpaf outputs (pred_batch, meta_batch, image) of one image.
+        """
+        frame = self.get_frame(*item)
+        start = time.perf_counter()
+        if self.tracker is not None:
+            # the still images are independent, only the frames of a same video share tracks
+            if frame.get('video') is None or frame.get('video') != self.tracked_video:
+                self.tracker.reset()
+                self.tracked_video = frame.get('video')
+            tracks, to_score = self.tracker.update(frame['boxes'], frame['keypoints'])
+            scores = self.score_frame(frame, [frame['boxes'][j] for j in to_score], [frame['keypoints'][j] for j in to_score])
+            frame['labels'] = self.tracker.smooth(tracks, to_score, scores)
+            frame['track_ids'] = [track.id for track in tracks]
+        else:
+            frame['labels'] = self.score_frame(frame, frame['boxes'], frame['keypoints'])
+        frame['timings']['looking_model'] = (time.perf_counter() - start) * 1000
+        return frame
 
+    def score_frame(self, frame, boxes, keypoints):
+        """
+            Run the looking model of the selected mode on some of the pedestrians of a frame.
+        """
+        if self.mode == 'joints':
+            return self.predict_look(boxes, keypoints, frame['size'])
+        image = self.load_image(frame)
+        assert image is not None, "the image {} is needed by the heads model".format(frame['name'])
+        return self.predict_look_alexnet(boxes, image)
+
+    def load_image(self, frame):
+        """
+            Image of a frame, loaded from the disk if it has not been decoded yet. Returns None if there is no image.
+        """
+        if frame['image'] is None and frame['image_path'] is not None:
+            start = time.perf_counter()
+            frame['image'] = PIL.Image.open(open(frame['image_path'], 'rb')).convert('RGB')
+            frame['timings']['load'] = frame['timings'].get('load', 0.) + (time.perf_counter() - start) * 1000
+        return frame['image']
+
+    def output(self, frame, args):
+        """
+            Render one frame. Images are handed over to the writer pool, the frames of a video are kept for emit().
+        """
+        if not self.render or self.load_image(frame) is None:
+            return frame
+        start = time.perf_counter()
+        if 'video' in frame:
+            frame['canvas'] = self.draw_image(frame['image'], frame['keypoints'], frame['labels'], args.transparency, args.looking_threshold)
+        else:
+            self.render_image(frame['image'], frame['boxes'], frame['keypoints'], frame['labels'], frame['name'], args.transparency, args.looking_threshold)
+        frame['timings']['render'] = (time.perf_counter() - start) * 1000
+        return frame
+
+    def emit(self, frame):
+        """
+            Outputs that have to be written in the input order, called once per frame after output().
+        """
+        start = time.perf_counter()
+        if 'canvas' in frame:
+            if frame['video'] not in self.video_sinks:
+                path = os.path.join(self.path_out, frame['video']+'.predictions.mp4')
+                self.video_sinks[frame['video']] = VideoWriterSink(path, frame['fps'])
+            self.video_sinks[frame['video']].write(frame.pop('canvas'))
+        if self.results_writer is not None:
+            self.results_writer.write(self.get_record(frame))
+        frame['timings']['write'] = (time.perf_counter() - start) * 1000
+        self.metrics.add_frame(frame['name'], frame['timings'])
+        self.n_frames += 1
+
+    def get_record(self, frame):
+        """
+            JSON serializable results of a frame, as written to the NDJSON output.
+        """
+        record = {
+            'image': frame['name'],
+            'width': int(frame['size'][0]),
+            'height': int(frame['size'][1])
+        }
+        if 'video' in frame:
+            record['video'] = frame['video']
+            record['frame_index'] = int(frame['frame_index'])
+            record['timestamp'] = round(float(frame['timestamp']), 3)
+        else:
+            record['path'] = frame['path']
+        record['boxes'] = [[round(float(v), 2) for v in box] for box in frame['boxes']]
+        record['keypoints'] = [[[round(float(v), 2) for v in row] for row in kps] for kps in frame['keypoints']]
+        record['looking'] = [round(float(label), 4) for label in frame['labels']]
+        if 'track_ids' in frame:
+            record['track_ids'] = frame['track_ids']
+        record['timings'] = {stage: round(float(ms), 3) for stage, ms in frame['timings'].items()}
+        return record
+
+    def read_videos(self, args):
+        """
+            Generator of the (RGB frame, meta) of every input video, decoded on the fly.
+        """
+        for source in args.video:
+            reader = VideoReader(source, args.frame_stride, args.start_time, args.end_time)
+            for index, timestamp, image in reader:
+                meta = {
+                    'file_name': '{}_{:06d}.png'.format(reader.name, index),
+                    'video': reader.name,
+                    'frame_index': index,
+                    'timestamp': timestamp,
+                    'fps': reader.output_fps()
+                }
+                yield image, meta
 
     def predict(self, args):
-        transparency = args.transparency
-        eyecontact_thresh = args.looking_threshold
-        
-        if args.glob:
-            array_im = glob(os.path.join(args.images[0], '*'+args.glob))
+        assert self.outputs, "the predictor has been created without outputs"
+        if args.keypoints is not None:
+            loader = read_pifpaf_outputs(args.keypoints, args.keypoints_images, args.image_size, args.keypoints_workers)
+            n_images = None
+        elif args.video:
+            loader = iterate_pifpaf_stream(self.predictor_, self.read_videos(args))
+            n_images = None
         else:
-            array_im = args.images
-        loader = self.predictor_.images(array_im)
-        start_pifpaf = time.time()
-        for i, (pred_batch, _, meta_batch) in enumerate(tqdm(loader)):
-            if self.track_time:
-                end_pifpaf = time.time()
-                self.pifpaf_time.append(end_pifpaf-start_pifpaf)
-            cpu_image = PIL.Image.open(open(meta_batch['file_name'], 'rb')).convert('RGB')
-            pifpaf_outs = {
-            'json_data': [ann.json_data() for ann in pred_batch],
-            'image': cpu_image
-            }
-            
-            im_name = os.path.basename(meta_batch['file_name'])
-            im_size = (cpu_image.size[0], cpu_image.size[1])
-            boxes, keypoints = preprocess_pifpaf(pifpaf_outs['json_data'], im_size, enlarge_boxes=False)
-            if self.mode == 'joints':
-                pred_labels = self.predict_look(boxes, keypoints, im_size)
+            if args.glob:
+                array_im = glob(os.path.join(args.images[0], '*'+args.glob))
             else:
-                pred_labels = self.predict_look_alexnet(boxes, cpu_image)
-            if self.track_time:
-                end_process = time.time()
-                self.total_time.append(end_process - start_pifpaf)
-            
-            #break
-            if self.track_time:
-                start_pifpaf = time.time()
+                array_im = args.images
+            if self.cache is not None:
+                loader = self.iterate_cached(array_im)
             else:
-                self.render_image(pifpaf_outs['image'], boxes, keypoints, pred_labels, im_name, transparency, eyecontact_thresh)
-
-            #if i > 20:
-            #    break
+                loader = iterate_pifpaf(self.predictor_, pifpaf_image_list(self.predictor_, array_im))
+            n_images = len(array_im)
+        if args.benchmark_batch_sizes and self.predictor_ is not None and not args.video:
+            self.benchmark_pifpaf(array_im, args.benchmark_batch_sizes)
+        start = time.perf_counter()
+        if self.pipeline:
+            self.predict_pipelined(loader, args, n_images)
+        else:
+            self.predict_sequential(loader, args, n_images)
+        elapsed = time.perf_counter() - start
+        self.writer.close()
+        for sink in self.video_sinks.values():
+            sink.close()
+        if self.results_writer is not None:
+            self.results_writer.close()
+        if self.cache is not None:
+            self.cache.print_stats(self.log)
         
-        if self.track_time and len(self.pifpaf_time) != 0 and len(self.inference_time) != 0:
-            print('Av. pifpaf time : {} ms. ± {} ms'.format(np.mean(self.pifpaf_time)*1000, np.std(self.pifpaf_time)*1000))
-            print('Av. inference time : {} ms. ± {} ms'.format(np.mean(self.inference_time)*1000, np.std(self.inference_time)*1000))
-            print('Av. total time : {} ms. ± {} ms'.format(np.mean(self.total_time)*1000, np.std(self.total_time)*1000))
-    
+        self.metrics.attach('image_encode', self.writer.encode_time)
+        self.metrics.close()
+        if args.metrics is not None:
+            if args.metrics.endswith('.csv'):
+                self.metrics.write_csv(args.metrics)
+            else:
+                self.metrics.write_json(args.metrics)
+        if self.track_time:
+            self.metrics.print_summary(self.log)
+        if self.track_time and self.n_frames != 0:
+            batch_size = self.predictor_.batch_size if self.predictor_ is not None else None
+            print('Throughput : {:.2f} images/s ({} images in {:.1f} s.), pifpaf batch size {}'.format(self.n_frames/elapsed, self.n_frames, elapsed, batch_size), file=self.log)
+        if self.track_time:
+            self.writer.print_stats(self.log)
+            if self.tracker is not None:
+                self.tracker.print_stats(self.log)
+
+    def benchmark_pifpaf(self, array_im, batch_sizes):
+        """
+            Throughput of pifpaf alone (loading, network and decoder) on the input images, for each batch size.
+        """
+        batch_size = self.predictor_.batch_size
+        for size in batch_sizes:
+            self.predictor_.batch_size = size
+            data = pifpaf_image_list(self.predictor_, array_im)
+            start = time.perf_counter()
+            n_images = sum(1 for _ in iterate_pifpaf(self.predictor_, data))
+            elapsed = time.perf_counter() - start
+            print('Pifpaf batch size {:3d} : {:.2f} images/s ({} images in {:.1f} s.)'.format(size, n_images/elapsed, n_images, elapsed), file=self.log)
+        self.predictor_.batch_size = batch_size
+
+    def iterate_cached(self, array_im):
+        """
+            Same outputs as iterate_pifpaf, but pifpaf only runs on the images missing from the cache.
+            The cached images are not decoded unless they are rendered.
+        """
+        # only the new or modified images are hashed, the others are looked up by path, size and mtime
+        keys = [self.cache.key(path) for path in array_im]
+        self.cache.save_index()
+        hits = [key in self.cache for key in keys]
+        missing = [path for path, hit in zip(array_im, hits) if not hit]
+        pifpaf_outputs = iterate_pifpaf(self.predictor_, pifpaf_image_list(self.predictor_, missing))
+        for path, key, hit in zip(array_im, keys, hits):
+            start = time.perf_counter()
+            record = self.cache.get(key) if hit else None
+            if record is not None:
+                meta = {
+                    'file_name': path,
+                    'image_path': path,
+                    'size': (record['width'], record['height']),
+                    'timings': {'cache': (time.perf_counter() - start) * 1000}
+                }
+                yield record['predictions'], meta, None
+                continue
+            if hit:
+                # the entry has been evicted in the meantime
+                pred, meta, image = next(iterate_pifpaf(self.predictor_, pifpaf_image_list(self.predictor_, [path])))
+            else:
+                self.cache.misses += 1
+                pred, meta, image = next(pifpaf_outputs)
+            width, height = get_image_size(image)
+            self.cache.put(key, {'width': width, 'height': height, 'predictions': pred})
+            yield pred, meta, image
+
+    def predict_sequential(self, loader, args, n_images=None):
+        if self.look_batch_size > 0:
+            self.predict_micro_batched(loader, args, n_images)
+            return
+        for item in tqdm(loader, total=n_images):
+            frame = self.process_frame(item)
+            self.output(frame, args)
+            self.emit(frame)
+
+    def predict_micro_batched(self, loader, args, n_images=None):
+        """
+            Sequential execution with the looking model micro-batched across images. The pifpaf outputs are read in a
+            background thread, so that the deadline of the pending images is honoured even when the next image is slow
+            to come (e.g. a live stream).
+        """
+        batcher = LookBatcher(self, self.look_batch_size, self.look_batch_deadline)
+        items = queue.Queue(self.queue_size)
+        stop = threading.Event()
+        feeder = threading.Thread(target=feed_queue, args=(loader, items, stop), daemon=True)
+        feeder.start()
+        try:
+            with tqdm(total=n_images) as progress:
+                while True:
+                    try:
+                        entry = items.get(timeout=batcher.time_left())
+                    except queue.Empty:
+                        # the oldest pending image has reached the deadline
+                        self.emit_scored(batcher.flush(), args)
+                        continue
+                    if entry is None:
+                        break
+                    item, error = entry
+                    if error is not None:
+                        raise error
+                    frame = self.get_frame(*item)
+                    self.emit_scored(batcher.add(self.get_look_input(frame['keypoints'], frame['size']), frame), args)
+                    progress.update(1)
+            self.emit_scored(batcher.flush(), args)
+        finally:
+            stop.set()
+            feeder.join()
+
+    def emit_scored(self, scored, args):
+        """
+            Render and emit the frames scored by a LookBatcher, with their share of the forward pass time.
+        """
+        for scored_frame, pred_labels, elapsed in scored:
+            scored_frame['labels'] = pred_labels
+            scored_frame['timings']['looking_model'] = elapsed
+            self.output(scored_frame, args)
+            self.emit(scored_frame)
+
+    def predict_pipelined(self, loader, args, n_images=None):
+        """
+            Pipelined execution: pifpaf, the looking model and the rendering run concurrently in their own threads,
+            connected by bounded queues. The frames are given back in the input order.
+        """
+        pipeline = Pipeline([
+            (self.process_frame, self.look_workers),
+            (lambda frame: self.output(frame, args), self.render_workers)
+        ], self.queue_size)
+        start = time.perf_counter()
+        n_frames = 0
+        for frame in tqdm(pipeline.run(loader), total=n_images):
+            self.emit(frame)
+            n_frames += 1
+        if self.track_time and n_frames != 0:
+            elapsed = time.perf_counter() - start
+            print('Pipelined throughput : {:.2f} images/s ({} images in {:.1f} s.)'.format(n_frames/elapsed, n_frames, elapsed), file=self.log)
+
+
+class LookBatcher():
+    """
+        Micro-batching of the looking model across images. The normalized keypoints of several images are
+        collected and scored with a single forward pass, then the scores are split back per image.
+        Args:
+            - predictor: Predictor object holding the looking model
+            - max_persons: int, run the model as soon as this many pedestrians are pending
+            - deadline: float, run the model when the oldest pending image has waited this many seconds
+    """
+    def __init__(self, predictor, max_persons=64, deadline=0.05):
+        self.predictor = predictor
+        self.max_persons = max_persons
+        self.deadline = deadline
+        self.pending = []
+        self.n_persons = 0
+        self.start = None
+
+    def add(self, tensor_kps, item):
+        """
+            Queue the (N, 51) keypoints tensor of one image together with an arbitrary item identifying it.
+            Returns:
+                the list of (item, labels, time in ms) that have been scored, in the order they were added
+        """
+        if len(self.pending) == 0:
+            self.start = time.perf_counter()
+        self.pending.append((tensor_kps, item))
+        self.n_persons += len(tensor_kps)
+        if self.n_persons >= self.max_persons or self.time_left() == 0:
+            return self.flush()
+        return []
+
+    def time_left(self):
+        """
+            Seconds before the oldest pending image reaches the deadline, None if nothing is pending.
+        """
+        if len(self.pending) == 0:
+            return None
+        return max(0., self.deadline - (time.perf_counter() - self.start))
+
+    def flush(self):
+        """
+            Score every pending image with one forward pass. The time of the forward pass is shared between the images
+            in proportion to their number of pedestrians.
+        """
+        if len(self.pending) == 0:
+            return []
+        start_forward = time.perf_counter()
+        tensors = [tensor_kps for tensor_kps, _ in self.pending]
+        out_labels = self.predictor.forward_look(torch.cat(tensors, 0))
+        elapsed = (time.perf_counter() - start_forward) * 1000
+        results = []
+        start = 0
+        for tensor_kps, item in self.pending:
+            share = len(tensor_kps) / self.n_persons if self.n_persons != 0 else 1. / len(self.pending)
+            results.append((item, out_labels[start:start+len(tensor_kps)], elapsed * share))
+            start += len(tensor_kps)
+        self.pending = []
+        self.n_persons = 0
+        self.start = None
+        return results
+
+
+def feed_queue(source, items, stop):
+    """
+        Put the (item, None) of an iterable into a queue, then None. An error of the iterable is put as (None, error).
+        Stops early when the stop event is set.
+    """
+    def put(entry):
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        for item in source:
+            if not put((item, None)):
+                return
+    except Exception as e:
+        put((None, e))
+        return
+    put(None)
@@ -0,0 +1,110 @@
+import os
+import copy
+import random
+from glob import glob
+
+import torch
+import torch.nn as nn
+import PIL.Image
+
+from utils.network import LookingModel, FusedLookingModel, fuse_looking_model
+from utils.keypoints import normalize_by_image_batch, preprocess_pifpaf
+
+QUANTIZATION_MODES = ['dynamic', 'static']
+CROPS_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def prepare_for_quantization(model):
+    """
+        Copy of the model in eval mode on the cpu, the BatchNorm layers of a LookingModel being folded into its linear
+        layers so that they are quantized as well.
+    """
+    if isinstance(model, LookingModel):
+        return fuse_looking_model(model)
+    return copy.deepcopy(model).cpu().eval()
+
+
+def quantize_dynamic(model):
+    """
+        Dynamic int8 quantization of the nn.Linear layers: the weights are quantized once, the activations on the fly.
+        Only the joints model is supported, the heads models are mostly convolutions that dynamic quantization leaves
+        in float: use quantize_static for them.
+        Args:
+            - model: LookingModel or FusedLookingModel
+        Returns:
+            the quantized model, on the cpu
+    """
+    assert isinstance(model, (LookingModel, FusedLookingModel)), "dynamic quantization only speeds up the joints model, please use the static quantization for the heads models"
+    return torch.quantization.quantize_dynamic(prepare_for_quantization(model), {nn.Linear}, dtype=torch.qint8)
+
+
+def quantize_static(model, calibration_batches, backend='fbgemm'):
+    """
+        Static int8 quantization (FX graph mode) of every layer of the model, the ranges of the activations being
+        calibrated on a sample of the inputs.
+        Args:
+            - model: LookingModel, AlexNet_head, ResNet18_head or ResNet50_head
+            - calibration_batches: list of input tensors, e.g. batches of normalized keypoints or of LOOK head crops
+            - backend: str, quantized engine, 'fbgemm' on x86 and 'qnnpack' on ARM
+        Returns:
+            the quantized model, on the cpu
+    """
+    from torch.quantization import quantize_fx
+    assert len(calibration_batches) != 0, "static quantization needs calibration data"
+    torch.backends.quantized.engine = backend
+    model = prepare_for_quantization(model)
+    qconfig_dict = {'': torch.quantization.get_default_qconfig(backend)}
+    try:
+        prepared = quantize_fx.prepare_fx(model, qconfig_dict, example_inputs=(calibration_batches[0].cpu(),))
+    except TypeError:
+        # torch < 1.13 does not take example inputs
+        prepared = quantize_fx.prepare_fx(model, qconfig_dict)
+    with torch.no_grad():
+        for batch in calibration_batches:
+            prepared(batch.cpu())
+    return quantize_fx.convert_fx(prepared)
+
+
+def load_calibration_crops(path, transform, n_samples=256, batch_size=32):
+    """
+        Random sample of head crops (e.g. the head images of LOOK), searched recursively in path.
+        Returns:
+            a list of batches of transformed crops
+    """
+    files = sorted(f for f in glob(os.path.join(path, '**', '*'), recursive=True) if f.lower().endswith(CROPS_EXTENSIONS))
+    assert len(files) != 0, "no crops found in {}".format(path)
+    files = random.Random(0).sample(files, min(n_samples, len(files)))
+    crops = [transform(PIL.Image.open(f).convert('RGB')) for f in files]
+    return [torch.stack(crops[i:i+batch_size]) for i in range(0, len(crops), batch_size)]
+
+
+def load_calibration_keypoints(pifpaf_outputs, n_samples=256, batch_size=32):
+    """
+        Normalized keypoints of the pedestrians of pifpaf outputs (see utils.pifpaf_io.read_pifpaf_outputs).
+        Returns:
+            a list of (batch_size, 51) tensors
+    """
+    keypoints = []
+    for pred, meta, _ in pifpaf_outputs:
+        _, kps = preprocess_pifpaf(pred, meta['size'], enlarge_boxes=False)
+        if len(kps) != 0:
+            keypoints.extend(torch.from_numpy(normalize_by_image_batch(kps, meta['size'])))
+        if len(keypoints) >= n_samples:
+            break
+    assert len(keypoints) != 0, "no pedestrian found in the calibration data"
+    keypoints = keypoints[:n_samples]
+    return [torch.stack(keypoints[i:i+batch_size]) for i in range(0, len(keypoints), batch_size)]
+
+
+def loader_calibration_batches(loader, n_samples=256):
+    """
+        Input batches of a DataLoader yielding (input, label), until n_samples inputs have been gathered.
+    """
+    batches = []
+    n = 0
+    for x_batch, _ in loader:
+        batches.append(x_batch.cpu())
+        n += len(x_batch)
+        if n >= n_samples:
+            break
+    return batches
@@ -0,0 +1,247 @@
+import asyncio
+import collections
+import io
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import PIL.Image
+import torch
+
+from utils.utils_predict import preprocess_pifpaf, iterate_pifpaf_stream, get_image_size
+
+HTTP_STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class LookingServer():
+    """
+        Local inference server keeping pifpaf and the looking model warm. It speaks HTTP/1.1 (with keep-alive) over TCP
+        or over a Unix socket:
+            - POST /keypoints : JSON {"width", "height", "predictions": [pifpaf annotations]}
+            - POST /image : encoded image (png, jpeg, ...) in the body
+            - GET /metrics : queue depth, batch sizes and latencies in the Prometheus text format
+        Both prediction endpoints answer {"boxes", "keypoints", "looking"}. The pedestrians of concurrent requests are
+        scored together: a batch is run as soon as max_batch pedestrians are waiting or the oldest request has waited
+        max_wait seconds.
+        Args:
+            - predictor: Predictor object, in joints mode
+            - max_batch: int, maximum number of pedestrians in a forward pass of the looking model
+            - max_wait: float, maximum time in seconds a request waits for its batch to fill up
+            - n_decoders: int, number of threads decoding the images
+    """
+    def __init__(self, predictor, max_batch=256, max_wait=0.005, n_decoders=2):
+        assert predictor.mode == 'joints', "the server only supports the joints mode"
+        self.predictor = predictor
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        # a single thread runs the networks, another pool decodes the images
+        self.model_executor = ThreadPoolExecutor(1)
+        self.pifpaf_executor = ThreadPoolExecutor(1)
+        self.decode_executor = ThreadPoolExecutor(n_decoders)
+        self.queue = None
+
+        # metrics
+        self.n_requests = collections.Counter()
+        self.n_errors = 0
+        self.n_batches = 0
+        self.n_batched_persons = 0
+        self.in_flight = 0
+        self.latencies = collections.deque(maxlen=10000)
+        self.batch_sizes = collections.deque(maxlen=10000)
+
+    async def score(self, tensor_kps):
+        """
+            Queue the (N, 51) keypoints of one request and wait for their scores.
+        """
+        if len(tensor_kps) == 0:
+            return np.zeros(0, dtype=np.float32)
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((tensor_kps, future))
+        return await future
+
+    async def batch_loop(self):
+        """
+            Dynamic batching: gather the waiting requests and score them with one forward pass.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self.queue.get()]
+            n_persons = len(pending[0][0])
+            deadline = loop.time() + self.max_wait
+            while n_persons < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                pending.append(item)
+                n_persons += len(item[0])
+            tensors = torch.cat([tensor_kps for tensor_kps, _ in pending], 0)
+            try:
+                out_labels = await loop.run_in_executor(self.model_executor, self.predictor.forward_look, tensors)
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+            self.n_batches += 1
+            self.n_batched_persons += n_persons
+            self.batch_sizes.append(n_persons)
+            start = 0
+            for tensor_kps, future in pending:
+                if not future.cancelled():
+                    future.set_result(out_labels[start:start+len(tensor_kps)])
+                start += len(tensor_kps)
+
+    async def predict_annotations(self, predictions, im_size):
+        boxes, keypoints = preprocess_pifpaf(predictions, im_size, enlarge_boxes=False)
+        labels = await self.score(self.predictor.get_look_input(keypoints, im_size))
+        return {
+            'boxes': [[float(v) for v in box] for box in boxes],
+            'keypoints': [[[float(v) for v in row] for row in kps] for kps in keypoints],
+            'looking': [float(label) for label in labels]
+        }
+
+    def run_pifpaf(self, image):
+        pred, _, _ = next(iterate_pifpaf_stream(self.predictor.predictor_, [(image, {'file_name': 'request'})]))
+        return pred
+
+    async def predict_image(self, body):
+        loop = asyncio.get_running_loop()
+        image = await loop.run_in_executor(self.decode_executor, lambda: np.asarray(PIL.Image.open(io.BytesIO(body)).convert('RGB')))
+        predictions = await loop.run_in_executor(self.pifpaf_executor, self.run_pifpaf, image)
+        return await self.predict_annotations(predictions, get_image_size(image))
+
+    def metrics(self):
+        """
+            Metrics in the Prometheus text format.
+        """
+        lines = [
+            '# TYPE looking_requests_total counter'
+        ]
+        for endpoint, count in sorted(self.n_requests.items()):
+            lines.append('looking_requests_total{{endpoint="{}"}} {}'.format(endpoint, count))
+        lines += [
+            '# TYPE looking_errors_total counter',
+            'looking_errors_total {}'.format(self.n_errors),
+            '# TYPE looking_requests_in_flight gauge',
+            'looking_requests_in_flight {}'.format(self.in_flight),
+            '# TYPE looking_queue_depth gauge',
+            'looking_queue_depth {}'.format(self.queue.qsize() if self.queue is not None else 0),
+            '# TYPE looking_batches_total counter',
+            'looking_batches_total {}'.format(self.n_batches),
+            '# TYPE looking_batched_persons_total counter',
+            'looking_batched_persons_total {}'.format(self.n_batched_persons)
+        ]
+        if len(self.batch_sizes) != 0:
+            lines += ['# TYPE looking_batch_size gauge', 'looking_batch_size{{stat="mean"}} {:.2f}'.format(np.mean(self.batch_sizes))]
+        if len(self.latencies) != 0:
+            lines.append('# TYPE looking_latency_ms summary')
+            for quantile in [0.5, 0.95, 0.99]:
+                lines.append('looking_latency_ms{{quantile="{}"}} {:.3f}'.format(quantile, np.percentile(self.latencies, quantile*100)))
+        return '\n'.join(lines) + '\n'
+
+    async def dispatch(self, method, path, body):
+        if path == '/metrics':
+            if method != 'GET':
+                return 405, 'text/plain', 'use GET\n'
+            return 200, 'text/plain; version=0.0.4', self.metrics()
+        if path not in ['/keypoints', '/image']:
+            return 404, 'text/plain', 'unknown endpoint {}\n'.format(path)
+        if method != 'POST':
+            return 405, 'text/plain', 'use POST\n'
+        if path == '/image' and self.predictor.predictor_ is None:
+            return 400, 'text/plain', 'pifpaf is not loaded, only /keypoints is available\n'
+        if path == '/keypoints':
+            try:
+                request = json.loads(body)
+                predictions, im_size = request['predictions'], (request['width'], request['height'])
+            except (ValueError, KeyError, TypeError) as e:
+                return 400, 'text/plain', 'invalid request: {}\n'.format(e)
+            result = await self.predict_annotations(predictions, im_size)
+        else:
+            result = await self.predict_image(body)
+        return 200, 'application/json', json.dumps(result)
+
+    async def handle(self, reader, writer):
+        """
+            Serve the HTTP requests of one connection.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in [b'\r\n', b'\n', b'']:
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                start = time.time()
+                self.in_flight += 1
+                self.n_requests[path] += 1
+                try:
+                    status, content_type, content = await self.dispatch(method, path, body)
+                except Exception as e:
+                    status, content_type, content = 500, 'text/plain', '{}\n'.format(e)
+                finally:
+                    self.in_flight -= 1
+                if status != 200:
+                    self.n_errors += 1
+                elif path != '/metrics':
+                    self.latencies.append((time.time() - start) * 1000)
+
+                content = content.encode()
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write('HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n'.format(
+                    status, HTTP_STATUS[status], content_type, len(content), 'keep-alive' if keep_alive else 'close').encode() + content)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8080, unix_socket=None):
+        """
+            Serve forever, on unix_socket if given, otherwise on host:port.
+        """
+        self.queue = asyncio.Queue()
+        batcher = asyncio.get_running_loop().create_task(self.batch_loop())
+        if unix_socket is not None:
+            if os.path.exists(unix_socket):
+                os.remove(unix_socket)
+            server = await asyncio.start_unix_server(self.handle, path=unix_socket)
+            print('Serving on unix socket {}'.format(unix_socket))
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+            print('Serving on http://{}:{}'.format(host, port))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+    def run(self, host='127.0.0.1', port=8080, unix_socket=None):
+        """
+            Serve until interrupted, on unix_socket if given, otherwise on host:port.
+        """
+        try:
+            asyncio.run(self.serve(host, port, unix_socket))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for executor in [self.model_executor, self.pifpaf_executor, self.decode_executor]:
+                executor.shutdown(wait=False)
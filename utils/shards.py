@@ -0,0 +1,164 @@
+import os
+import sys
+import copy
+import gzip
+import json
+import time
+import shutil
+import hashlib
+import multiprocessing
+from glob import glob
+
+
+def list_images(args):
+    """
+        List of the input images. The images given with --images keep their order, the ones matched by --glob are
+        sorted so that a resumed run gets the same shards.
+    """
+    if args.glob:
+        return sorted(glob(os.path.join(args.images[0], '*'+args.glob)))
+    return list(args.images)
+
+
+def split_shards(items, n_shards):
+    """
+        Split items into n_shards contiguous chunks of (almost) the same size, the concatenation of the chunks
+        keeping the order of items.
+    """
+    size, remainder = divmod(len(items), n_shards)
+    shards = []
+    start = 0
+    for i in range(n_shards):
+        end = start + size + (1 if i < remainder else 0)
+        shards.append(items[start:end])
+        start = end
+    return shards
+
+
+def shard_path(shard_dir, index, suffix='.ndjson'):
+    return os.path.join(shard_dir, 'shard_{:04d}{}'.format(index, suffix))
+
+
+def read_completed(path):
+    """
+        Paths of the images with a complete record in a shard output. A record cut by a crash is removed from the file.
+    """
+    if not os.path.isfile(path):
+        return set()
+    with open(path, 'rb+') as file:
+        data = file.read()
+        end = data.rfind(b'\n') + 1
+        if end != len(data):
+            file.truncate(end)
+    return set(json.loads(line)['path'] for line in data[:end].splitlines() if line.strip())
+
+
+def run_shard(args, index, images):
+    """
+        Worker process: run a predictor on one shard, appending its records to the shard output. The images already
+        scored by a previous run of the shard are skipped.
+    """
+    import torch
+    from utils.predictor import Predictor
+
+    torch.set_num_threads(args.shard_threads)
+    if args.shard_devices:
+        args.device = args.shard_devices[index % len(args.shard_devices)]
+    output = shard_path(args.shard_dir, index)
+    # the records are matched by image path, they don't have to be written in the input order
+    done = read_completed(output)
+    if args.json_output == '-':
+        # the shard writes its records to a file, its logs must not mix with the merged records on the standard output
+        sys.stdout.flush()
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    print('Shard {} : {} images, {} already done'.format(index, len(images), len(done)))
+    args.images = [image for image in images if image not in done]
+    args.glob = None
+    args.json_output = output
+    args.json_append = True
+    args.json_gzip = False
+    if len(args.images) != 0:
+        predictor = Predictor(args)
+        predictor.predict(args)
+    open(shard_path(args.shard_dir, index, '.done'), 'w').close()
+
+
+def merge_shards(shard_dir, n_shards, output, compress=False):
+    """
+        Concatenate the shard outputs, in the shard order, into a single NDJSON file.
+    """
+    if output == '-':
+        for index in range(n_shards):
+            with open(shard_path(shard_dir, index), 'rb') as shard:
+                shutil.copyfileobj(shard, sys.stdout.buffer)
+        sys.stdout.flush()
+        return output
+    if compress and not output.endswith('.gz'):
+        output = output + '.gz'
+    open_ = gzip.open if output.endswith('.gz') else open
+    with open_(output, 'wb') as file:
+        for index in range(n_shards):
+            with open(shard_path(shard_dir, index), 'rb') as shard:
+                shutil.copyfileobj(shard, file)
+    return output
+
+
+def predict_sharded(args):
+    """
+        Split the input images across args.shards worker processes, each with its own pifpaf and looking model, then
+        merge their NDJSON outputs in the shard order. The run can be resumed by running the same command again: the
+        finished shards are skipped and the failed ones only score the images without a record.
+    """
+    images = list_images(args)
+    n_shards = min(args.shards, len(images))
+    assert n_shards > 0, "no input images"
+    os.makedirs(args.shard_dir, exist_ok=True)
+
+    # the shards of a resumed run must be the same
+    manifest = {'shards': n_shards, 'images': hashlib.sha1('\n'.join(images).encode()).hexdigest()}
+    manifest_path = os.path.join(args.shard_dir, 'manifest.json')
+    if os.path.isfile(manifest_path):
+        with open(manifest_path, 'r') as file:
+            assert json.load(file) == manifest, "{} holds the shards of other inputs, please use another --shard_dir".format(args.shard_dir)
+    else:
+        with open(manifest_path, 'w') as file:
+            json.dump(manifest, file)
+
+    args = copy.copy(args)
+    # the standard output is kept for the merged records when they are written to it
+    log = sys.stderr if args.json_output == '-' else sys.stdout
+    if args.shard_threads is None:
+        args.shard_threads = max(1, (os.cpu_count() or 1) // n_shards)
+    if args.image_output is None or args.image_output is True:
+        args.image_output = os.path.join(args.shard_dir, 'images')
+    os.makedirs(args.image_output, exist_ok=True)
+
+    # spawn: each worker initializes its own torch (and cuda) state
+    context = multiprocessing.get_context('spawn')
+    start = time.time()
+    processes = {}
+    for index, shard in enumerate(split_shards(images, n_shards)):
+        if os.path.isfile(shard_path(args.shard_dir, index, '.done')):
+            print('Shard {} already done'.format(index), file=log)
+            continue
+        process = context.Process(target=run_shard, args=(args, index, shard))
+        process.start()
+        processes[index] = process
+
+    failed = []
+    for index, process in processes.items():
+        process.join()
+        if process.exitcode != 0:
+            failed.append(index)
+    elapsed = time.time() - start
+    if len(failed) != 0:
+        print('ERROR : shards {} failed, run the same command again to resume them'.format(failed), file=log)
+        sys.exit(1)
+
+    json_output = args.json_output
+    if json_output is None or json_output is True:
+        json_output = args.shard_dir
+    if os.path.isdir(json_output):
+        json_output = os.path.join(json_output, 'predictions.ndjson')
+    output = merge_shards(args.shard_dir, n_shards, json_output, args.json_gzip)
+    print('{} images scored by {} processes in {:.1f} s. ({:.2f} images/s), results in {}'.format(len(images), n_shards, elapsed, len(images) / max(elapsed, 1e-9), output), file=log)
@@ -0,0 +1,55 @@
+import sys
+import time
+import builtins
+import collections
+
+PROFILE_FLAG = '--profile-startup'
+
+_start = None
+_import = None
+_self_times = collections.Counter()
+_stack = []
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level != 0 or name in sys.modules:
+        return _import(name, globals, locals, fromlist, level)
+    start = time.perf_counter()
+    _stack.append(0.)
+    try:
+        return _import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.perf_counter() - start
+        children = _stack.pop()
+        _self_times[name.split('.')[0]] += elapsed - children
+        if _stack:
+            _stack[-1] += elapsed
+
+
+def profile_startup():
+    """
+        Time the imports of the entry point if --profile-startup is in the command line. It has to be called before
+        the other imports, and the flag is removed from sys.argv so that the argument parsers never see it.
+    """
+    global _start, _import
+    if PROFILE_FLAG not in sys.argv or _import is not None:
+        return
+    sys.argv.remove(PROFILE_FLAG)
+    _start = time.perf_counter()
+    _import = builtins.__import__
+    builtins.__import__ = _timed_import
+
+
+def print_startup_profile(n_modules=20):
+    """
+        Print the import time of each top-level package (its own time, without the packages it imports), slowest first.
+    """
+    global _import
+    if _import is None:
+        return
+    builtins.__import__ = _import
+    _import = None
+    total = time.perf_counter() - _start
+    print('Startup : {:.3f} s, import time per package:'.format(total))
+    for name, self_time in _self_times.most_common(n_modules):
+        print('  {:<24} {:8.1f} ms'.format(name, self_time * 1000))
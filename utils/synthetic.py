@@ -0,0 +1,58 @@
+import numpy as np
+
+# standing pedestrian in the COCO-17 order, x relative to the center of the hips and y relative to the top of the head,
+# both in units of the height of the pedestrian
+COCO_TEMPLATE = np.array([
+    [0.00, 0.05],   # nose
+    [-0.02, 0.04],  # left eye
+    [0.02, 0.04],   # right eye
+    [-0.05, 0.05],  # left ear
+    [0.05, 0.05],   # right ear
+    [-0.11, 0.19],  # left shoulder
+    [0.11, 0.19],   # right shoulder
+    [-0.14, 0.34],  # left elbow
+    [0.14, 0.34],   # right elbow
+    [-0.15, 0.47],  # left wrist
+    [0.15, 0.47],   # right wrist
+    [-0.07, 0.52],  # left hip
+    [0.07, 0.52],   # right hip
+    [-0.07, 0.75],  # left knee
+    [0.07, 0.75],   # right knee
+    [-0.07, 0.97],  # left ankle
+    [0.07, 0.97]    # right ankle
+])
+
+
+def synthetic_pifpaf(n_persons, image_size, rng):
+    """
+        Random pedestrians in the json format of the pifpaf outputs.
+        Args:
+            - n_persons: int, number of pedestrians
+            - image_size: tuple, (width, height) of the image
+            - rng: np.random.RandomState
+        Returns:
+            a list of {"keypoints": [x, y, c] * 17, "bbox": [x, y, w, h], "score"} dictionaries
+    """
+    width, height = image_size
+    annotations = []
+    for _ in range(n_persons):
+        person_height = rng.uniform(0.1, 0.8) * height
+        x0 = rng.uniform(0.05, 0.95) * width
+        y0 = rng.uniform(0., 1. - person_height / height) * height
+        # mirrored poses for the pedestrians seen from the back, and some noise on every joint
+        direction = rng.choice([-1., 1.])
+        X = x0 + direction * COCO_TEMPLATE[:, 0] * person_height + rng.normal(0., 0.01, 17) * person_height
+        Y = y0 + COCO_TEMPLATE[:, 1] * person_height + rng.normal(0., 0.01, 17) * person_height
+        C = rng.uniform(0.2, 1., 17)
+        keypoints = np.stack([X, Y, C], axis=1).reshape(-1)
+        box = [float(X.min()), float(Y.min()), float(X.max() - X.min()), float(Y.max() - Y.min())]
+        annotations.append({'keypoints': keypoints.tolist(), 'bbox': box, 'score': float(C.mean())})
+    return annotations
+
+
+def synthetic_image(image_size, rng):
+    """
+        Random RGB image, array of shape (height, width, 3).
+    """
+    width, height = image_size
+    return rng.randint(0, 256, (height, width, 3), dtype=np.uint8)
@@ -0,0 +1,151 @@
+import collections
+import sys
+
+import numpy as np
+
+
+def box_iou_matrix(boxes_a, boxes_b):
+    """
+        Vectorized IoU between two sets of boxes in the x1, y1, x2, y2 format.
+        Returns:
+            an array of shape (len(boxes_a), len(boxes_b))
+    """
+    boxes_a = np.asarray(boxes_a, dtype=np.float64)[:, None, :4]
+    boxes_b = np.asarray(boxes_b, dtype=np.float64)[None, :, :4]
+    width = np.clip(np.minimum(boxes_a[..., 2], boxes_b[..., 2]) - np.maximum(boxes_a[..., 0], boxes_b[..., 0]), 0, None)
+    height = np.clip(np.minimum(boxes_a[..., 3], boxes_b[..., 3]) - np.maximum(boxes_a[..., 1], boxes_b[..., 1]), 0, None)
+    inter = width * height
+    area_a = np.abs((boxes_a[..., 2] - boxes_a[..., 0]) * (boxes_a[..., 3] - boxes_a[..., 1]))
+    area_b = np.abs((boxes_b[..., 2] - boxes_b[..., 0]) * (boxes_b[..., 3] - boxes_b[..., 1]))
+    union = area_a + area_b - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.)
+
+
+def keypoints_distance(kps_a, kps_b, scale):
+    """
+        Mean distance between the visible joints of two poses of shape (3, 17), relative to scale (e.g. the box height).
+    """
+    visible = (kps_a[2] > 0) & (kps_b[2] > 0)
+    if not visible.any():
+        visible = np.ones(kps_a.shape[1], dtype=bool)
+    distances = np.hypot(kps_a[0, visible] - kps_b[0, visible], kps_a[1, visible] - kps_b[1, visible])
+    return float(np.mean(distances)) / max(scale, 1.)
+
+
+class Track():
+    """
+        State of one tracked pedestrian.
+    """
+    def __init__(self, track_id, box, keypoints, window):
+        self.id = track_id
+        self.box = box
+        self.keypoints = keypoints
+        self.scored_keypoints = None
+        self.score = None
+        self.history = collections.deque(maxlen=window)
+        self.missed = 0
+
+
+class Tracker():
+    """
+        Links the pedestrians across consecutive frames by IoU of the boxes and distance of the keypoints.
+        The looking model is not run again on the tracks whose keypoints barely moved since the last time they were
+        scored, and the eye contact probability of each track is smoothed over a sliding window.
+        Args:
+            - iou_threshold: float, minimum IoU to link a detection to a track
+            - kps_threshold: float, maximum keypoints distance (relative to the box height) to link a detection to a track
+            - tolerance: float, maximum keypoints displacement (relative to the box height) to reuse the cached score
+            - window: int, number of frames of the smoothing window
+            - max_missed: int, number of frames a track is kept without any detection
+    """
+    def __init__(self, iou_threshold=0.3, kps_threshold=0.2, tolerance=0.02, window=5, max_missed=5):
+        self.iou_threshold = iou_threshold
+        self.kps_threshold = kps_threshold
+        self.tolerance = tolerance
+        self.window = window
+        self.max_missed = max_missed
+        self.tracks = []
+        self.next_id = 0
+        self.n_detections = 0
+        self.n_scored = 0
+
+    def reset(self):
+        self.tracks = []
+
+    def match(self, boxes, keypoints):
+        """
+            Greedy matching of the detections to the current tracks, best IoU first.
+            Returns:
+                a list with the matched track (or None) of each detection
+        """
+        matches = [None] * len(boxes)
+        if len(self.tracks) == 0 or len(boxes) == 0:
+            return matches
+        ious = box_iou_matrix([track.box for track in self.tracks], boxes)
+        candidates = []
+        for i, track in enumerate(self.tracks):
+            height = abs(track.box[3] - track.box[1])
+            for j in range(len(boxes)):
+                if ious[i, j] >= self.iou_threshold:
+                    candidates.append((-ious[i, j], i, j))
+                elif ious[i, j] > 0 and keypoints_distance(track.keypoints, keypoints[j], height) <= self.kps_threshold:
+                    candidates.append((-ious[i, j], i, j))
+        used_tracks = set()
+        for _, i, j in sorted(candidates):
+            if i in used_tracks or matches[j] is not None:
+                continue
+            used_tracks.add(i)
+            matches[j] = self.tracks[i]
+        return matches
+
+    def update(self, boxes, keypoints):
+        """
+            Link the detections of a new frame to the tracks.
+            Args:
+                - boxes: list of boxes (x1, y1, x2, y2, score) of the frame
+                - keypoints: list of [X, Y, C] keypoints of the frame
+            Returns:
+                - the list of tracks, one per detection
+                - the indices of the detections that need to be scored by the looking model
+        """
+        keypoints = [np.asarray(kps, dtype=np.float64) for kps in keypoints]
+        matches = self.match(boxes, keypoints)
+        tracks = []
+        to_score = []
+        for j, track in enumerate(matches):
+            if track is None:
+                track = Track(self.next_id, boxes[j], keypoints[j], self.window)
+                self.next_id += 1
+                self.tracks.append(track)
+            track.box = boxes[j]
+            track.keypoints = keypoints[j]
+            track.missed = -1
+            height = abs(boxes[j][3] - boxes[j][1])
+            if track.score is None or keypoints_distance(track.scored_keypoints, keypoints[j], height) > self.tolerance:
+                to_score.append(j)
+            tracks.append(track)
+
+        for track in self.tracks:
+            track.missed += 1
+        self.tracks = [track for track in self.tracks if track.missed <= self.max_missed]
+        self.n_detections += len(boxes)
+        self.n_scored += len(to_score)
+        return tracks, to_score
+
+    def smooth(self, tracks, to_score, scores):
+        """
+            Store the new scores of the detections in to_score and return the smoothed score of every detection.
+        """
+        for j, score in zip(to_score, scores):
+            tracks[j].score = float(score)
+            tracks[j].scored_keypoints = tracks[j].keypoints
+        smoothed = []
+        for track in tracks:
+            track.history.append(track.score)
+            smoothed.append(float(np.mean(track.history)))
+        return np.array(smoothed, dtype=np.float32)
+
+    def print_stats(self, file=sys.stdout):
+        if self.n_detections == 0:
+            return
+        print('Tracker : {} tracks | {} / {} detections scored by the looking model ({:.1f} %)'.format(self.next_id, self.n_scored, self.n_detections, 100.*self.n_scored/self.n_detections), file=file)
@@ -1,13 +1,15 @@
 import configparser
+import math
 import os, errno
 import copy
 
-import seaborn as sns
-import matplotlib.pyplot as plt
 from torch.utils.data.sampler import WeightedRandomSampler
 
 from utils.dataset import *
 from utils.network import *
+from utils.loaders import JointsLoader, sample_weights, loader_args, to_device
+from utils.crop_store import attach_crop_store
+from utils.feature_cache import frozen_modules, train_mode, head_forward, load_feature_cache, FeatureLoader, evaluate_cached
 
 class Parser():
     """
@@ -38,7 +40,15 @@ class Parser():
         self.dropout = float(self.general['dropout'])
         self.multi_dataset = self.general.getboolean('multi_dataset')
         self.weighted = self.multi_args.getboolean('weighted')
+        self.ratios = None
+        if self.multi_args.get('ratios'):
+            self.ratios = [float(ratio) for ratio in self.multi_args['ratios'].split(',')]
+        self.temperature = self.multi_args.getfloat('temperature', fallback=math.inf)
         self.fine_tune = self.model_type.getboolean('fine_tune')
+        self.tensor_loader = self.general.getboolean('tensor_loader', fallback=True)
+        self.loader_args = loader_args(self.general, self.device)
+        self.crop_store = self.general.get('crop_store')
+        self.feature_cache = self.general.get('feature_cache')
 
         assert criterion_type in ['BCE']
         assert optimizer_type in ['adam', 'sgd']
@@ -242,8 +252,19 @@ class Parser():
             dataset_test = PIE_Dataset(path_data, self.model_type_, 'test', self.pose, split_strategy, self.data_transform, path_txt, self.device)
         else:
             dataset_test = LOOK_dataset_('test', self.model_type_, path_txt, path_data, self.pose, self.data_transform, self.device, self.look_args['data'])
+        dataset_test.loader_args = self.loader_args
+        if self.crop_store:
+            attach_crop_store(dataset_test, self.crop_store)
         return dataset_test
 
+    def get_datasets(self):
+        """
+            List of the training and validation datasets.
+        """
+        if self.multi_dataset:
+            return self.dataset_train + self.dataset_val
+        return [self.dataset_train, self.dataset_val]
+
     def parse(self):
         self.model, self.criterion, self.optimizer, self.data_transform = self.get_model()
         if self.multi_dataset:
@@ -302,10 +323,21 @@ class Parser():
             self.path_model = os.path.join(self.path_output, name_model)
             if self.grad_map:
                 self.out_grad = self.path_model[:-2]+'_grads.png'
+        for data in (self.dataset_val if self.multi_dataset else [self.dataset_val]):
+            data.loader_args = self.loader_args
+        if self.crop_store:
+            for data in self.get_datasets():
+                attach_crop_store(data, self.crop_store)
  
     def load_model_for_eval(self):
         print(self.path_model)
-        self.model.load_state_dict(torch.load(self.path_model))
+        if self.model_type_ == 'joints' and self.eval_params.get('fused_model'):
+            # TorchScript model written by export_model.py
+            self.model = torch.jit.load(self.eval_params['fused_model'], map_location=self.device)
+        else:
+            self.model.load_state_dict(torch.load(self.path_model))
+            if self.model_type_ == 'joints' and self.eval_params.getboolean('fused', fallback=False):
+                self.model = fuse_looking_model(self.model)
         self.model = self.model.to(self.device)
         self.model.eval()
 
@@ -316,7 +348,7 @@ class Evaluator():
     def __init__(self, parser):
         self.parser = parser
         print(self.parser.path_model)
-        if os.path.isfile(self.parser.path_model):
+        if os.path.isfile(self.parser.eval_params.get('fused_model') or self.parser.path_model):
             print('Model file exists.. Loading model file ...')
             self.parser.load_model_for_eval()
         else:
@@ -349,31 +381,63 @@ class Trainer():
     def __init__(self, parser):
         self.parser = parser
         self.get_grads = parser.grad_map
+        self.val_caches = None
+        self.frozen_eval = False
     def get_sampler(self, concat_dataset):
-        weigths = 1./ torch.Tensor([len(data) for data in concat_dataset])
-        di = {}
-        for i, data in enumerate(self.parser.dataset_train):
-            di[data.name] = weigths[i]
-        weigths_samples = []
-        for data in self.parser.dataset_train:
-            for _ in data:
-                weigths_samples.append(di[data.name])
-        sampler = WeightedRandomSampler(torch.Tensor(weigths_samples), len(weigths_samples))
-        return sampler
+        weights = self.get_sample_weights(concat_dataset.datasets)
+        return WeightedRandomSampler(weights, len(weights))
+
+    def get_sample_weights(self, datasets):
+        """
+            Weight of each training instance, from the lengths of the datasets and the ratios / temperature of the
+            Multi_Dataset config: no instance is read.
+        """
+        lengths = [len(data) for data in datasets]
+        weights = sample_weights(lengths, self.parser.ratios, self.parser.temperature)
+        start = 0
+        for data, length in zip(datasets, lengths):
+            print('{} : {} instances, {:.1f} % of the samples'.format(data.name, length, 100 * weights[start:start+length].sum().item()))
+            start += length
+        return weights
+
+    def get_feature_loader(self):
+        """
+            Loader of the activations of the frozen layers of a fine-tuned model, computed once over the training and
+            validation sets: only the trainable layers run during the training (see utils.feature_cache).
+        """
+        datasets_train = self.parser.dataset_train if self.parser.multi_dataset else [self.parser.dataset_train]
+        datasets_val = self.parser.dataset_val if self.parser.multi_dataset else [self.parser.dataset_val]
+        caches = [load_feature_cache(self.parser.model, data, self.parser.feature_cache, self.parser.device, self.parser.loader_args) for data in datasets_train]
+        self.val_caches = [load_feature_cache(self.parser.model, data, self.parser.feature_cache, self.parser.device, self.parser.loader_args) for data in datasets_val]
+        weights = None
+        if self.parser.multi_dataset and self.parser.weighted:
+            weights = self.get_sample_weights(datasets_train)
+        return FeatureLoader(caches, self.parser.batch_size, self.parser.device, weights)
 
     def train(self):
         self.parser.model = self.parser.model.to(self.parser.device)
-        self.parser.model.train()
+        # the frozen layers only run in eval mode with the feature cache, as when their activations were cached
+        self.frozen_eval = bool(self.parser.feature_cache and self.parser.fine_tune and frozen_modules(self.parser.model) is not None)
+        train_mode(self.parser.model, self.frozen_eval)
         print('Path to save the model : {}'.format(self.parser.path_model))
-        if self.parser.multi_dataset:
+        if self.frozen_eval:
+            train_loader = self.get_feature_loader()
+        elif self.parser.model_type_ == 'joints' and self.parser.tensor_loader:
+            # the whole training set is kept on the device, see utils.loaders
+            datasets = self.parser.dataset_train if self.parser.multi_dataset else [self.parser.dataset_train]
+            weights = None
+            if self.parser.multi_dataset and self.parser.weighted:
+                weights = self.get_sample_weights(datasets)
+            train_loader = JointsLoader(datasets, self.parser.batch_size, self.parser.device, weights)
+        elif self.parser.multi_dataset:
             concat_dataset = torch.utils.data.ConcatDataset(self.parser.dataset_train)
             if self.parser.weighted:
                 sampler = self.get_sampler(concat_dataset)
-                train_loader = DataLoader(concat_dataset, batch_size=self.parser.batch_size, sampler=sampler)
+                train_loader = DataLoader(concat_dataset, batch_size=self.parser.batch_size, sampler=sampler, **self.parser.loader_args)
             else:
-                train_loader = DataLoader(concat_dataset, batch_size=self.parser.batch_size, shuffle=True)
+                train_loader = DataLoader(concat_dataset, batch_size=self.parser.batch_size, shuffle=True, **self.parser.loader_args)
         else:
-            train_loader = DataLoader(self.parser.dataset_train, batch_size=self.parser.batch_size, shuffle=True)
+            train_loader = DataLoader(self.parser.dataset_train, batch_size=self.parser.batch_size, shuffle=True, **self.parser.loader_args)
         running_loss = 0
         i = 0
         best_ap = 0
@@ -382,15 +446,18 @@ class Trainer():
         grads = []
         
         for epoch in range(self.parser.epochs):
-            self.parser.model.train()
+            train_mode(self.parser.model, self.frozen_eval)
             losses = []
             accuracies = []
 
             for x_batch, y_batch in train_loader:
                 
-                y_batch = y_batch.to(self.parser.device)
+                x_batch, y_batch = to_device(x_batch, self.parser.device), to_device(y_batch, self.parser.device)
                 self.parser.optimizer.zero_grad()
-                output = self.parser.model(x_batch)
+                if self.val_caches is not None:
+                    output = head_forward(self.parser.model, x_batch)
+                else:
+                    output = self.parser.model(x_batch)
                 loss = self.parser.criterion(output, y_batch.float())
                 running_loss += loss.item()
                 
@@ -430,6 +497,9 @@ class Trainer():
                 model = None
                 torch.cuda.empty_cache()
         if self.get_grads:
+            # only needed to plot the gradient maps
+            import seaborn as sns
+            import matplotlib.pyplot as plt
             res = torch.stack(grads,1)
             y_labels = ['nose', 'left_eye','right_eye','left_ear','right_ear','left_shoulder','right_shoulder','left_elbow','right_elbow','left_wrist','right_wrist','left_hip','right_hip','left_knee','right_knee','left_ankle','right_ankle','nose', 'left_eye','right_eye','left_ear','right_ear','left_shoulder','right_shoulder','left_elbow','right_elbow','left_wrist','right_wrist','left_hip','right_hip','left_knee','right_knee','left_ankle','right_ankle','nose', 'left_eye','right_eye','left_ear','right_ear','left_shoulder','right_shoulder','left_elbow','right_elbow','left_wrist','right_wrist','left_hip','right_hip','left_knee','right_knee','left_ankle','right_ankle']
             grads_magnitude = res
@@ -466,7 +536,10 @@ class Trainer():
 
     def eval_epoch(self, best_ap, best_ac):
         self.parser.model.eval()
-        if self.parser.multi_dataset:
+        if self.val_caches is not None:
+            results = [evaluate_cached(self.parser.model, cache, self.parser.device, it=self.parser.eval_it) for cache in self.val_caches]
+            aps, accs = np.mean([ap for ap, _ in results]), np.mean([acc for _, acc in results])
+        elif self.parser.multi_dataset:
             tab_ap = []
             tab_acc = []
             for data in self.parser.dataset_val:
@@ -481,5 +554,5 @@ class Trainer():
             best_ap = aps
             best_ac = accs
             torch.save(self.parser.model.state_dict(), self.parser.path_model)
-        self.parser.model.train()
+        train_mode(self.parser.model, self.frozen_eval)
         return best_ap, best_ac, aps, accs
\ No newline at end of file
@@ -1,14 +1,17 @@
 
-import cv2
-import openpifpaf
 import os
-
-import openpifpaf
+import sys
+import errno
+import collections
+import itertools
+import time
+import PIL.Image
 import numpy as np
 from datetime import datetime
-from openpifpaf import datasets
-from openpifpaf import decoder, network, visualizer, show, logger, Predictor
-from openpifpaf.predict import out_name
+
+from utils.keypoints import *
+
+# cv2, torch and openpifpaf are imported by the functions using them, so that importing this module stays cheap
 
 """COCO_PERSON_SKELETON = [
         [16, 14], [14, 12], [17, 15], [15, 13], [12, 13], [6, 12], [7, 13],
@@ -21,6 +24,18 @@ COCO_PERSON_SKELETON = [
 COCO_HEAD = [
     [3,4]
 ]
+# run_pifpaf relies on the internals of openpifpaf.Predictor (enumerated_dataloader, last_nn_time, last_decoder_time),
+# only checked with this minor version, as pinned in requirements.txt
+PIFPAF_VERSION = '0.13.0'
+
+
+def supported_pifpaf_version(version):
+    """
+        Whether an openpifpaf version has the major and minor versions of PIFPAF_VERSION, any patch release being accepted
+    """
+    return version.split('.')[:2] == PIFPAF_VERSION.split('.')[:2]
+
+
 def convert(data):
     """X = []
     Y = []
@@ -38,97 +53,6 @@ def convert(data):
     A = np.array([X, Y, C]).flatten().tolist()
     return X, Y, C, A
 
-def normalize_by_image_(X, Y, image_size):
-    """
-        Normalize the image according to the paper.
-        Args:
-            - X: array of X positions of the keypoints
-            - Y: array of Y positions of the keypoints
-            - Image: Image array
-        Returns:
-            returns the normalized arrays
-    """
-    
-    image_width, image_height = image_size
-    
-    center_p = (int((X[11] + X[12]) / 2), int((Y[11] + Y[12]) / 2))
-    X_new = np.array(X)/image_width
-    Y_new = np.array(Y)-center_p[1]
-
-
-    width = abs(np.max(X) - np.min(X))
-    height = abs(np.max(Y) - np.min(Y))
-
-    X_new = X_new + ((np.array(X)-center_p[0])/width)
-    Y_new /= height
-    
-    return X_new, Y_new
-
-
-def prepare_pif_kps(kps_in):
-    """Convert from a list of 51 to a list of 3, 17"""
-
-    assert len(kps_in) % 3 == 0, "keypoints expected as a multiple of 3"
-    xxs = kps_in[0:][::3]
-    yys = kps_in[1:][::3]  # from offset 1 every 3
-    ccs = kps_in[2:][::3]
-
-    return [xxs, yys, ccs]
-
-
-def preprocess_pifpaf(annotations, im_size=None, enlarge_boxes=True, min_conf=0.):
-    """
-    Preprocess pif annotations:
-    1. enlarge the box of 10%
-    2. Constraint it inside the image (if image_size provided)
-    """
-
-    boxes = []
-    keypoints = []
-    enlarge = 1 if enlarge_boxes else 2  # Avoid enlarge boxes for social distancing
-
-    for dic in annotations:
-        kps = prepare_pif_kps(dic['keypoints'])
-        box = dic['bbox']
-        try:
-            conf = dic['score']
-            # Enlarge boxes
-            delta_h = (box[3]) / (10 * enlarge)
-            delta_w = (box[2]) / (5 * enlarge)
-            # from width height to corners
-            box[2] += box[0]
-            box[3] += box[1]
-
-        except KeyError:
-            all_confs = np.array(kps[2])
-            score_weights = np.ones(17)
-            score_weights[:3] = 3.0
-            score_weights[5:] = 0.1
-            # conf = np.sum(score_weights * np.sort(all_confs)[::-1])
-            conf = float(np.mean(all_confs))
-            # Add 15% for y and 20% for x
-            delta_h = (box[3] - box[1]) / (7 * enlarge)
-            delta_w = (box[2] - box[0]) / (3.5 * enlarge)
-            assert delta_h > -5 and delta_w > -5, "Bounding box <=0"
-
-        box[0] -= delta_w
-        box[1] -= delta_h
-        box[2] += delta_w
-        box[3] += delta_h
-
-        # Put the box inside the image
-        if im_size is not None:
-            box[0] = max(0, box[0])
-            box[1] = max(0, box[1])
-            box[2] = min(box[2], im_size[0])
-            box[3] = min(box[3], im_size[1])
-
-        if conf >= min_conf:
-            box.append(conf)
-            boxes.append(box)
-            keypoints.append(kps)
-
-    return boxes, keypoints
 
 def filecreation(dirname):
     mydir = os.path.join(dirname,'_'+datetime.now().strftime('%Y-%m-%d_%H-%M-%S'))
@@ -140,6 +64,7 @@ def filecreation(dirname):
     return mydir
 
 def draw_skeleton(img, kps, color, skeleton=COCO_PERSON_SKELETON):
+    import cv2
     X, Y, C, _ = convert(kps)
     linewidth = 4
     height = abs(Y[0]-Y[-1])
@@ -157,6 +82,7 @@ def draw_skeleton(img, kps, color, skeleton=COCO_PERSON_SKELETON):
     img = cv2.circle(img, center, radius, (255, 255, 255), 2)
     return img
 def run_and_kps(img, kps, label):
+    import cv2
     blk = np.zeros(img.shape, np.uint8)
     X, Y, C, _ = convert(kps)
     if label > 0.5:
@@ -185,11 +111,17 @@ def run_and_kps(img, kps, label):
     #preprocess = preprocess_factory(args)
     #return net, processor, preprocess
 
-def load_pifpaf(args):
+def load_pifpaf(args, log=sys.stdout):
+    import openpifpaf
+    from openpifpaf import decoder, network, visualizer, show, Predictor
+    assert supported_pifpaf_version(openpifpaf.__version__), "openpifpaf {}.x is required, found {}".format(PIFPAF_VERSION.rsplit('.', 1)[0], openpifpaf.__version__)
     pifpaf_model = args.checkpoint_
-    print(pifpaf_model)
+    print(pifpaf_model, file=log)
     args.figure_width = 10
     args.dpi_factor = 1.0
+    # openpifpaf only batches images padded to --long-edge. The images are preprocessed as for a batch size of 1
+    # (tight padding) and letterboxed by collate_letterbox instead, so any batch size works without --long-edge
+    batch_size = args.batch_size
     args.batch_size = 1
 
 
@@ -207,4 +139,117 @@ def load_pifpaf(args):
     show.configure(args)
     visualizer.configure(args)
 
-    return Predictor(checkpoint=pifpaf_model)
\ No newline at end of file
+    predictor = Predictor(checkpoint=pifpaf_model)
+    predictor.batch_size = args.batch_size = batch_size
+    for name in ['enumerated_dataloader', 'last_nn_time', 'last_decoder_time']:
+        assert hasattr(predictor, name), "openpifpaf.Predictor has no {}, run_pifpaf does not support this openpifpaf version".format(name)
+    return predictor
+
+
+def pifpaf_image_list(predictor, paths):
+    """
+        openpifpaf dataset of the images at paths, keeping the decoded images for iterate_pifpaf
+    """
+    from openpifpaf import datasets
+    return datasets.ImageList(paths, preprocess=predictor.preprocess, with_raw_image=True)
+
+
+def get_image_size(image):
+    """
+        Returns the (width, height) of a PIL image or of a numpy array
+    """
+    if isinstance(image, np.ndarray):
+        return image.shape[1], image.shape[0]
+    return image.size[0], image.size[1]
+
+
+def collate_letterbox(batch):
+    """
+        Collate (image, processed_image, anns, meta) items of different sizes into one batch: the processed images are
+        padded at the bottom and on the right up to the largest one of the batch. Zero is the mean color once the images
+        are normalized, and the coordinates in the images are unchanged, so the pifpaf outputs need no correction.
+    """
+    import torch
+    processed_images = [item[1] for item in batch]
+    height = max(processed_image.shape[1] for processed_image in processed_images)
+    width = max(processed_image.shape[2] for processed_image in processed_images)
+    padded = torch.zeros((len(batch), processed_images[0].shape[0], height, width), dtype=processed_images[0].dtype)
+    for i, processed_image in enumerate(processed_images):
+        padded[i, :, :processed_image.shape[1], :processed_image.shape[2]] = processed_image
+    return [item[0] for item in batch], padded, [item[2] for item in batch], [item[3] for item in batch]
+
+
+def run_pifpaf(predictor, batches):
+    """
+        Run pifpaf on collated batches (image_batch, processed_image_batch, anns_batch, meta_batch) and keep the raw
+        images next to the predictions.
+        Returns:
+            a generator of (pred, meta, image), pred being the list of annotations in the json format of openpifpaf
+    """
+    # the predictor un-batches each batch entirely before asking for the next one
+    images = collections.deque()
+    load_times = collections.deque()
+    def enumerated_dataloader():
+        batches_iter = iter(batches)
+        for batch_i in itertools.count():
+            # time spent waiting for the loader, shared by the images of the batch
+            start = time.perf_counter()
+            item = next(batches_iter, None)
+            if item is None:
+                return
+            load_time = (time.perf_counter() - start) * 1000 / len(item[0])
+            images.extend(item[0])
+            load_times.extend([load_time] * len(item[0]))
+            yield batch_i, item
+
+    for pred, _, meta in predictor.enumerated_dataloader(enumerated_dataloader()):
+        # network and decoder times of the batch the image belongs to
+        meta['timings'] = {
+            'load': load_times.popleft(),
+            'pifpaf_nn': predictor.last_nn_time * 1000,
+            'pifpaf_decoder': predictor.last_decoder_time * 1000
+        }
+        yield [ann.json_data() for ann in pred], meta, images.popleft()
+
+
+def iterate_pifpaf(predictor, data):
+    """
+        Run pifpaf on a dataset built with with_raw_image=True (e.g. datasets.ImageList) and keep the images decoded by
+        the loader, so that they don't have to be read again from the disk.
+        Args:
+            - predictor: openpifpaf.Predictor object
+            - data: openpifpaf dataset returning (image, processed_image, anns, meta)
+        Returns:
+            a generator of (pred, meta, image), image being the decoded RGB PIL image
+    """
+    import torch
+    loader_workers = predictor.loader_workers
+    if loader_workers is None:
+        loader_workers = predictor.batch_size if len(data) > 1 else 0
+    dataloader = torch.utils.data.DataLoader(
+        data, batch_size=predictor.batch_size, pin_memory=predictor.device.type != 'cpu',
+        num_workers=loader_workers, collate_fn=collate_letterbox)
+    yield from run_pifpaf(predictor, dataloader)
+
+
+def iterate_pifpaf_stream(predictor, frames):
+    """
+        Streaming version of iterate_pifpaf for inputs of unknown length, such as the frames of a video.
+        The frames are preprocessed and batched in the calling thread as they arrive.
+        Args:
+            - predictor: openpifpaf.Predictor object
+            - frames: iterable of (RGB numpy array, meta dictionary)
+        Returns:
+            a generator of (pred, meta, image), image being the numpy array given as input
+    """
+    def batches():
+        batch = []
+        for image, meta in frames:
+            processed_image, anns, meta = predictor.preprocess(PIL.Image.fromarray(image), [], meta)
+            batch.append((image, processed_image, anns, meta))
+            if len(batch) == predictor.batch_size:
+                yield collate_letterbox(batch)
+                batch = []
+        if len(batch) != 0:
+            yield collate_letterbox(batch)
+    yield from run_pifpaf(predictor, batches())
@@ -0,0 +1,68 @@
+import os
+import time
+
+
+class VideoReader():
+    """
+        Decode the frames of a video file or of a capture device on the fly, without writing them to the disk.
+        Args:
+            - source: str, path to a video file or index of a capture device (e.g. '0')
+            - stride: int, keep one frame every stride frames. The skipped frames are grabbed but not decoded
+            - start_time: float, time in seconds of the first frame to keep (video files only)
+            - end_time: float, time in seconds after which the decoding stops
+    """
+    def __init__(self, source, stride=1, start_time=None, end_time=None):
+        assert stride >= 1, "the frame stride must be a positive integer"
+        self.source = source
+        self.is_device = source.isdigit()
+        self.stride = stride
+        self.start_time = start_time
+        self.end_time = end_time
+        if self.is_device:
+            self.name = 'device_{}'.format(source)
+        else:
+            self.name = os.path.splitext(os.path.basename(source))[0]
+        import cv2
+        self.capture = cv2.VideoCapture(int(source) if self.is_device else source)
+        if not self.capture.isOpened():
+            raise IOError('could not open the video source {}'.format(source))
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 0.
+
+    def __iter__(self):
+        """
+            Returns:
+                a generator of (frame index, timestamp in seconds, RGB frame as a numpy array)
+        """
+        import cv2
+        if self.start_time and not self.is_device:
+            self.capture.set(cv2.CAP_PROP_POS_MSEC, self.start_time * 1000)
+        first_index = int(self.capture.get(cv2.CAP_PROP_POS_FRAMES)) if not self.is_device else 0
+        index = first_index
+        start = time.time()
+        try:
+            while True:
+                if self.fps > 0 and not self.is_device:
+                    timestamp = index / self.fps
+                else:
+                    timestamp = time.time() - start
+                if self.end_time is not None and timestamp > self.end_time:
+                    break
+                if (index - first_index) % self.stride != 0:
+                    if not self.capture.grab():
+                        break
+                else:
+                    ok, frame = self.capture.read()
+                    if not ok:
+                        break
+                    yield index, timestamp, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                index += 1
+        finally:
+            self.capture.release()
+
+    def output_fps(self):
+        """
+            Frame rate of the kept frames, used for the output video.
+        """
+        if self.fps > 0:
+            return self.fps / self.stride
+        return 10.
@@ -0,0 +1,201 @@
+import threading
+import queue
+import time
+import json
+import gzip
+import sys
+
+from utils.metrics import Histogram
+
+_SENTINEL = object()
+
+
+class ImageWriterPool():
+    """
+        Pool of background threads encoding and writing the output images, so that the encoding does not block the
+        prediction loop. The queue is bounded: if the writers can't keep up, write() blocks until a slot is free.
+        Args:
+            - n_workers: int, number of writer threads
+            - queue_size: int, maximum number of images waiting to be written
+            - image_format: str, must be in ['png', 'jpg']
+            - png_compression: int, PNG compression level between 0 (fastest) and 9 (smallest)
+            - jpeg_quality: int, JPEG quality between 0 and 100
+    """
+    def __init__(self, n_workers=2, queue_size=16, image_format='png', png_compression=1, jpeg_quality=95):
+        assert image_format in ['png', 'jpg']
+        self.extension = '.' + image_format
+        self.image_format = image_format
+        self.png_compression = int(png_compression)
+        self.jpeg_quality = int(jpeg_quality)
+        self.queue = queue.Queue(queue_size)
+        self.lock = threading.Lock()
+        self.error = None
+
+        # statistics
+        self.n_written = 0
+        self.encode_time = Histogram()
+        self.queue_depth_sum = 0
+        self.queue_depth_max = 0
+        self.n_queued = 0
+        self.start = None
+        self.end = None
+
+        self.workers = [threading.Thread(target=self._work, daemon=True) for _ in range(max(1, n_workers))]
+        for worker in self.workers:
+            worker.start()
+
+    def write(self, path, image):
+        """
+            Queue a BGR image to be written at path (without extension, it is given by the image format).
+            Returns:
+                the full path of the output file
+        """
+        if self.error is not None:
+            raise self.error
+        # several render threads may write at the same time in pipelined mode
+        with self.lock:
+            if self.start is None:
+                self.start = time.time()
+            depth = self.queue.qsize()
+            self.queue_depth_sum += depth
+            self.queue_depth_max = max(self.queue_depth_max, depth)
+            self.n_queued += 1
+        path = path + self.extension
+        self.queue.put((path, image))
+        return path
+
+    def close(self):
+        """
+            Wait for every queued image to be written and stop the workers.
+        """
+        for _ in self.workers:
+            self.queue.put(_SENTINEL)
+        for worker in self.workers:
+            worker.join()
+        self.end = time.time()
+        if self.error is not None:
+            raise self.error
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is _SENTINEL:
+                break
+            # cv2 is only imported once there is an image to write
+            import cv2
+            if self.image_format == 'png':
+                params = [cv2.IMWRITE_PNG_COMPRESSION, self.png_compression]
+            else:
+                params = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+            path, image = item
+            start = time.perf_counter()
+            try:
+                if not cv2.imwrite(path, image, params):
+                    raise IOError('could not write {}'.format(path))
+            except Exception as e:
+                with self.lock:
+                    self.error = e
+                continue
+            with self.lock:
+                self.n_written += 1
+                self.encode_time.add((time.perf_counter() - start) * 1000)
+
+    def print_stats(self, file=sys.stdout):
+        if self.n_written == 0:
+            return
+        elapsed = (self.end or time.time()) - self.start
+        print('Writer : {} images written in {:.1f} s. ({:.2f} images/s with {} workers)'.format(self.n_written, elapsed, self.n_written/elapsed, len(self.workers)), file=file)
+        print('Encoding time : av. {:.2f} ms | p50 {:.2f} ms | p95 {:.2f} ms | p99 {:.2f} ms'.format(self.encode_time.total/self.encode_time.count, self.encode_time.quantile(0.5), self.encode_time.quantile(0.95), self.encode_time.quantile(0.99)), file=file)
+        print('Writer queue depth : av. {:.1f} | max {}'.format(self.queue_depth_sum/self.n_queued, self.queue_depth_max), file=file)
+
+
+class VideoWriterSink():
+    """
+        Background writer of the rendered frames of a video. A single thread keeps the frames in order.
+        Args:
+            - path: str, path of the output video
+            - fps: float, frame rate of the output video
+            - queue_size: int, maximum number of frames waiting to be encoded
+            - fourcc: str, four character code of the codec
+    """
+    def __init__(self, path, fps, queue_size=16, fourcc='mp4v'):
+        self.path = path
+        self.fps = fps
+        self.fourcc = fourcc
+        self.queue = queue.Queue(queue_size)
+        self.video_writer = None
+        self.error = None
+        self.n_written = 0
+        self.worker = threading.Thread(target=self._work, daemon=True)
+        self.worker.start()
+
+    def write(self, image):
+        """
+            Queue a BGR frame, frames are written in the order they are queued.
+        """
+        if self.error is not None:
+            raise self.error
+        self.queue.put(image)
+
+    def close(self):
+        self.queue.put(_SENTINEL)
+        self.worker.join()
+        if self.video_writer is not None:
+            self.video_writer.release()
+        if self.error is not None:
+            raise self.error
+
+    def _work(self):
+        while True:
+            image = self.queue.get()
+            if image is _SENTINEL:
+                break
+            if self.error is not None:
+                continue
+            try:
+                import cv2
+                if self.video_writer is None:
+                    height, width = image.shape[:2]
+                    self.video_writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.fourcc), self.fps, (width, height))
+                    if not self.video_writer.isOpened():
+                        raise IOError('could not open {} for writing'.format(self.path))
+                self.video_writer.write(image)
+                self.n_written += 1
+            except Exception as e:
+                self.error = e
+
+
+class ResultsWriter():
+    """
+        Writes one JSON record per line (NDJSON) as the results come, to a file or to the standard output.
+        Args:
+            - path: str, path of the output file, '-' for the standard output
+            - compress: bool, gzip the output file. Enabled as well if path ends with '.gz'
+            - append: bool, append to the output file instead of overwriting it
+    """
+    def __init__(self, path, compress=False, append=False):
+        self.path = path
+        if path == '-':
+            # the records are written to the underlying binary stream, the logs have to be sent to stderr by the caller
+            self.file = sys.stdout.buffer
+        elif compress or path.endswith('.gz'):
+            if not path.endswith('.gz'):
+                self.path = path + '.gz'
+            self.file = gzip.open(self.path, 'at' if append else 'wt')
+        else:
+            self.file = open(path, 'a' if append else 'w', buffering=1)
+        self.n_written = 0
+
+    def write(self, record):
+        if self.path == '-':
+            self.file.write((json.dumps(record) + '\n').encode('utf-8'))
+            self.file.flush()
+        else:
+            self.file.write(json.dumps(record) + '\n')
+        self.n_written += 1
+
+    def close(self):
+        if self.path == '-':
+            self.file.flush()
+        else:
+            self.file.close()